@@ -1,19 +1,3226 @@
 import os
+import time
+startup_started = time.perf_counter()
 os.environ["PATH"] = os.path.dirname(__file__) + os.pathsep + os.environ["PATH"]
-import mpv
 import tkinter as tk
+from tkinter import filedialog
 from tkinterdnd2 import *
 import urllib.parse
-import time
+import threading
+import math
+import queue
+import json
+import platform
+import argparse
+import hashlib
+import shutil
+import subprocess
+import collections
+import bisect
+import concurrent.futures
+import multiprocessing
+import multiprocessing.shared_memory
+import struct
+import itertools
+import types
+import logging
+import logging.handlers
+import importlib.util
+import socket
+import sys
 import traceback
 
 
-version = "1.0.2"
+version = "1.0.2"
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.gif')
+MANIFEST_EXTENSIONS = ('.json', '.txt', '.lst')
+
+log = logging.getLogger("simul_pb")
+startup_log = logging.getLogger("simul_pb.startup")
+cache_log = logging.getLogger("simul_pb.cache")
+sync_log = logging.getLogger("simul_pb.sync")
+load_log = logging.getLogger("simul_pb.load")
+seek_log = logging.getLogger("simul_pb.seek")
+player_log = logging.getLogger("simul_pb.player")
+decode_log = logging.getLogger("simul_pb.decode")
+media_log = logging.getLogger("simul_pb.media")
+ui_log = logging.getLogger("simul_pb.ui")
+metrics_log = logging.getLogger("simul_pb.metrics")
+analysis_log = logging.getLogger("simul_pb.analysis")
+export_log = logging.getLogger("simul_pb.export")
+control_log = logging.getLogger("simul_pb.control")
+benchmark_log = logging.getLogger("simul_pb.benchmark")
+mpv_log = logging.getLogger("simul_pb.mpv")  # mpv自身のログ。コンポーネントごとに子ロガーを使う
+LOG_COMPONENTS = ("startup", "cache", "sync", "load", "seek", "player", "decode", "media", "metrics", "analysis", "export", "control",
+                  "benchmark", "ui", "mpv")
+
+# mpvのログレベル。mpv側で捨てさせるので、出力しないメッセージはPythonまで届かない
+MPV_LOG_LEVELS = {"fatal": logging.CRITICAL, "error": logging.ERROR, "warn": logging.WARNING, "info": logging.INFO,
+                  "status": logging.INFO, "v": logging.DEBUG, "debug": logging.DEBUG, "trace": logging.DEBUG}
+
+
+class RingBufferHandler(logging.Handler):
+    # 直近のログを一定数だけメモリに残す (アプリ内のログ表示用)
+    def __init__(self, capacity=2000):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+        self.serial = 0  # これまでに追加した行数
+
+    def emit(self, record):
+        # handle()がself.lockを取得した状態で呼ばれる
+        self.records.append((self.serial, self.format(record)))
+        self.serial += 1
+
+    def lines_since(self, serial):
+        # serial以降に追加された行と、次に渡すserialを返す
+        with self.lock:
+            return [line for n, line in self.records if n >= serial], self.serial
+
+
+class RateLimitFilter(logging.Filter):
+    # 同じ書式のメッセージがperiod秒の間にburst回を超えたら捨て、捨てた数を次に通すメッセージに付ける
+    def __init__(self, burst=5, period=1.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._state = {}  # (ロガー名, 書式) -> [期間の開始時刻, 件数, 捨てた件数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                if len(self._state) > 1000:
+                    self._state.clear()
+                state = self._state[key] = [now, 0, 0]
+            if now - state[0] >= self.period:
+                state[0], state[1] = now, 0
+            state[1] += 1
+            if state[1] > self.burst:
+                state[2] += 1
+                return False
+            suppressed, state[2] = state[2], 0
+        if suppressed and isinstance(record.args, tuple):
+            record.msg = f"{record.msg} (%d similar messages suppressed)"
+            record.args = record.args + (suppressed,)
+        return True
+
+
+def parse_log_levels(specs):
+    # "sync=debug" のような指定を {コンポーネント: レベル} にする
+    levels = {}
+    for spec in specs or []:
+        component, _, level = spec.partition("=")
+        if component not in LOG_COMPONENTS or not isinstance(logging.getLevelName(level.upper()), int):
+            raise ValueError(f"invalid log level {spec!r} (components: {', '.join(LOG_COMPONENTS)})")
+        levels[component] = logging.getLevelName(level.upper())
+    return levels
+
+
+def setup_logging(level=logging.INFO, component_levels=None, capacity=2000):
+    # ログを出す側はキューに積むだけにして、コンソールへの書き出しはバックグラウンドのスレッドで行う
+    formatter = logging.Formatter("%(asctime)s.%(msecs)03d %(levelname)-7s [%(name)s] %(message)s", "%H:%M:%S")
+    console = logging.StreamHandler(sys.stdout)
+    ring = RingBufferHandler(capacity)
+    for handler in (console, ring):
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    log.addHandler(queue_handler)
+    log.setLevel(level)
+    log.propagate = False
+    mpv_log.setLevel(logging.WARNING)  # mpvの情報メッセージは多いので、指定がなければ警告以上だけ
+    for component, component_level in (component_levels or {}).items():
+        logging.getLogger(f"simul_pb.{component}").setLevel(component_level)
+    listener = logging.handlers.QueueListener(log_queue, console, ring)
+    listener.start()
+    return listener, ring
+
+
+def mpv_loglevel():
+    # mpv_logで出力するレベルに合わせてmpvに渡すログレベルを決める
+    level = mpv_log.getEffectiveLevel()
+    for name in ("v", "info", "warn", "error"):
+        if MPV_LOG_LEVELS[name] >= level:
+            return name
+    return "fatal"
+
+
+mpv = None  # load_mpv()で読み込む
+mpv_import_lock = threading.Lock()
+
+
+def mpv_log_handler(loglevel, component, message):
+    # mpvのイベントスレッドから呼ばれる。キューに積むだけなので待たされない
+    mpv_log.getChild(component).log(MPV_LOG_LEVELS.get(loglevel, logging.DEBUG), "%s", message.rstrip())
+
+
+def load_mpv():
+    # mpvのimport(libmpvの読み込み)は重いので、ウィンドウを表示した後、必要になった時点で行う
+    global mpv
+    with mpv_import_lock:
+        if mpv is None:
+            started = time.perf_counter()
+            import mpv as mpv_module
+            mpv = mpv_module
+            startup_log.info("import mpv: %.1fms (%s)",
+                             (time.perf_counter() - started) * 1000, threading.current_thread().name)
+    return mpv
+
+
+def cache_dir():
+    # ユーザーごとのキャッシュ保存先 (Windowsは%LOCALAPPDATA%、それ以外はXDG_CACHE_HOME)
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "simul_pb")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class JsonCache:
+    # キーと値(JSONで表現できるもの)を1つのファイルに保存する小さな永続キャッシュ
+    def __init__(self, filename):
+        self.path = os.path.join(cache_dir(), filename)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            self._data = {}
+        except Exception as e:
+            cache_log.warning("Ignoring unreadable cache %s: %s", self.path, e)
+            self._data = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._save()
+
+    def remove(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        # 書き込み途中で終了してもファイルが壊れないよう、一時ファイルに書いてから置き換える
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            cache_log.error("Error saving cache %s: %s", self.path, e)
+
+
+def media_key(path):
+    # ファイルの内容が変わったら別のキーになるよう、パス・サイズ・更新時刻から作る
+    st = os.stat(path)
+    text = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def tool_priority():
+    # ffmpeg/ffprobeを再生の邪魔にならない低い優先度で起動するためのPopenの引数
+    if os.name == "nt":
+        return {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS | subprocess.CREATE_NO_WINDOW}
+    return {"preexec_fn": lambda: os.nice(10)}
+
+
+def run_tool(args, timeout=120, running=None):
+    # ffmpeg/ffprobeを低い優先度で実行し、標準出力を返す。
+    # runningを渡すと実行中のプロセスを登録するので、終了時にまとめて止められる
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               **tool_priority())
+    if running is not None:
+        running.add(process)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise
+    finally:
+        if running is not None:
+            running.discard(process)
+    if process.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(args[0])} failed: {stderr.decode('utf-8', 'replace').strip()[-300:]}")
+    return stdout
+
+
+def stop_tools(running):
+    for process in list(running):
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+class StartupTimer:
+    # 起動処理の各段階にかかった時間を記録する
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        for name, seconds in self.phases:
+            startup_log.info("%s: %.1fms", name, seconds * 1000)
+        startup_log.info("total: %.1fms", (time.perf_counter() - self.started) * 1000)
+
+
+def format_time(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = max(0, int(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+
+def parse_time(text):
+    # "1:23.5" や "83.5" 形式の時刻 (秒)
+    seconds = 0.0
+    for part in text.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_range(text):
+    # "開始-終了" 形式の範囲。終了を省略するとNone (最後まで)
+    start, _, end = text.partition("-")
+    start = parse_time(start) if start.strip() else 0.0
+    end = parse_time(end) if end.strip() else None
+    if end is not None and end <= start:
+        raise ValueError(f"empty range: {text}")
+    return start, end
+
+
+def parse_grid(text):
+    # "2x2" 形式の (行数, 列数)
+    rows, _, cols = text.lower().partition("x")
+    return int(rows), int(cols)
+
+
+def parse_sizes(text):
+    # "640x360,1920x1080" 形式の (幅, 高さ) のリスト
+    sizes = [parse_grid(part) for part in text.split(",")]
+    if any(w < 16 or h < 16 for w, h in sizes):
+        raise ValueError(f"invalid size: {text}")
+    return sizes
+
+
+def parse_counts(text):
+    # "1,4,9" 形式の正の整数のリスト
+    counts = [int(part) for part in text.split(",")]
+    if any(count < 1 for count in counts):
+        raise ValueError(f"invalid count: {text}")
+    return counts
+
+
+class DriftStats:
+    # 1プレーヤー分のドリフト統計 (秒単位)
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.sum_abs = 0.0
+        self.sum_sq = 0.0
+        self.max_abs = 0.0
+        self.within_frame = 0
+        self.speed_corrections = 0
+        self.hard_seeks = 0
+        self.last_drift = 0.0
+
+    def add(self, drift, frame_duration):
+        a = abs(drift)
+        self.samples += 1
+        self.sum_abs += a
+        self.sum_sq += drift * drift
+        self.max_abs = max(self.max_abs, a)
+        if a <= frame_duration:
+            self.within_frame += 1
+        self.last_drift = drift
+
+    def summary(self):
+        if not self.samples:
+            return "no samples"
+        mean_ms = self.sum_abs / self.samples * 1000
+        rms_ms = math.sqrt(self.sum_sq / self.samples) * 1000
+        within = self.within_frame / self.samples * 100
+        return (f"mean={mean_ms:.1f}ms rms={rms_ms:.1f}ms max={self.max_abs * 1000:.1f}ms "
+                f"within-1-frame={within:.1f}% speed-corrections={self.speed_corrections} "
+                f"hard-seeks={self.hard_seeks} samples={self.samples}")
+
+
+class SyncEngine:
+    # マスタークロック(壁時計または1つのプレーヤー)に対してフォロワーのtime-posを高頻度でサンプリングし、
+    # 小さなずれはspeedの微調整、大きなずれはハードシークで補正する。
+    # Tkには一切触れないので、専用スレッドから動かしてよい。
+    MASTER_CLOCK = "clock"
+
+    def __init__(self, get_targets, interval=0.02, horizon=1.0, max_speed_delta=0.05,
+                 seek_threshold=0.5, smoothing=0.3):
+        self.get_targets = get_targets  # () -> [(index, player), ...] 同期対象のプレーヤー
+        self.interval = interval  # サンプリング周期 (50Hz)
+        self.horizon = horizon  # この秒数でずれを解消する速度に補正する
+        self.max_speed_delta = max_speed_delta  # speedの補正幅の上限 (±5%)
+        self.seek_threshold = seek_threshold  # これ以上ずれたらハードシーク
+        self.smoothing = smoothing  # ドリフトの指数移動平均の係数 (time-posはフレーム単位で量子化されるため)
+        self.master = self.MASTER_CLOCK
+        self.rate = 1.0
+        self.loop = False
+        self.stats = {}
+        self._smoothed = {}
+        self._speeds = {}
+        self._media_info = {}
+        self._cooldown_until = {}
+        self._seek_lead = 0.05  # ハードシーク時に先読みする秒数 (実測値で更新)
+        self._clock_base_pos = 0.0
+        self._clock_base_t = time.perf_counter()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="SyncEngine", daemon=True)
+            self._thread.start()
+
+    def stop_thread(self):
+        self._stop.set()
+        self._active.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def set_master(self, master):
+        # master: "clock" または プレーヤーのindex
+        with self._lock:
+            self.master = master
+            self._smoothed.clear()
+        sync_log.info("Sync master set to %s", 'wall clock' if master == self.MASTER_CLOCK else f'player {master}')
+
+    def resume(self, position):
+        # 再生開始時に呼ぶ。壁時計の基準位置を設定して補正を開始する
+        with self._lock:
+            self._clock_base_pos = position
+            self._clock_base_t = time.perf_counter()
+            self._smoothed.clear()
+            self._cooldown_until.clear()
+        self._active.set()
+
+    def pause(self):
+        self._active.clear()
+        with self._lock:
+            self._restore_speeds()
+
+    def rebase(self, position):
+        # ユーザー操作でシークされた場合、壁時計をその位置に合わせる
+        with self._lock:
+            self._clock_base_pos = position
+            self._clock_base_t = time.perf_counter()
+            self._smoothed.clear()
+
+    def forget(self, index):
+        # ファイル変更やプレーヤー再生成時にキャッシュを破棄する
+        with self._lock:
+            self._media_info.pop(index, None)
+            self._speeds.pop(index, None)
+            self._smoothed.pop(index, None)
+            self._cooldown_until.pop(index, None)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {}
+
+    def report(self):
+        with self._lock:
+            lines = [f"Player {i}: {s.summary()}" for i, s in sorted(self.stats.items())]
+        return lines or ["No drift samples"]
+
+    def clock_position(self, now=None):
+        now = time.perf_counter() if now is None else now
+        return self._clock_base_pos + (now - self._clock_base_t) * self.rate
+
+    def _media(self, index, player):
+        # (1フレームの長さ, 動画の長さ) をファイルごとに一度だけ読み取る
+        info = self._media_info.get(index)
+        if info is None:
+            try:
+                fps = player.container_fps or player.estimated_vf_fps
+                duration = player.duration
+            except Exception:
+                fps, duration = None, None
+            info = (1.0 / fps if fps and fps > 0 else 1.0 / 30, duration or 0.0)
+            self._media_info[index] = info
+        return info
+
+    def _restore_speeds(self):
+        for i, player in self.get_targets():
+            if self._speeds.get(i, self.rate) != self.rate:
+                try:
+                    player.speed = self.rate
+                except Exception as e:
+                    sync_log.error("Error restoring speed for player %s: %s", i, e)
+            self._speeds[i] = self.rate
+
+    def _sample(self, targets):
+        # 全プレーヤーのtime-posをできるだけ連続して読み取り、読み取り時刻のずれを補間して同一時刻にそろえる
+        readings = []
+        for i, player in targets:
+            try:
+                pos = player.time_pos
+                t = time.perf_counter()
+            except Exception:
+                continue
+            if pos is not None:
+                readings.append((i, player, pos, t))
+        if not readings:
+            return None, []
+        t_ref = readings[-1][3]
+        aligned = [(i, player, pos + (t_ref - t) * self._speeds.get(i, self.rate))
+                   for i, player, pos, t in readings]
+        return t_ref, aligned
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._active.wait(timeout=0.5):
+                continue
+            started = time.perf_counter()
+            try:
+                self._step()
+            except Exception as e:
+                sync_log.error("Error in sync engine: %s", e, exc_info=True)
+            elapsed = time.perf_counter() - started
+            self._stop.wait(max(0.0, self.interval - elapsed))
+
+    def _step(self):
+        targets = self.get_targets()
+        if len(targets) < 2 and self.master != self.MASTER_CLOCK:
+            return
+        t_ref, aligned = self._sample(targets)
+        if not aligned:
+            return
+        with self._lock:
+            if not self._active.is_set():
+                return
+            if self.master == self.MASTER_CLOCK:
+                master_index = None
+                master_pos = self.clock_position(t_ref)
+                longest = max(self._media(i, player)[1] for i, player, _ in aligned)
+                if self.loop and longest and master_pos > longest:
+                    # ループ再生時は壁時計も最長の動画の長さで折り返す
+                    self._clock_base_pos -= longest
+                    master_pos -= longest
+            else:
+                master_index = self.master
+                master_pos = next((pos for i, _, pos in aligned if i == master_index), None)
+                if master_pos is None:
+                    # マスターが再生していない場合は先頭のプレーヤーを代わりに使う
+                    master_index, _, master_pos = aligned[0]
+            for i, player, pos in aligned:
+                if i == master_index:
+                    continue
+                self._correct(i, player, pos - master_pos, master_pos, t_ref)
+
+    def _correct(self, index, player, drift, master_pos, now):
+        frame_duration, duration = self._media(index, player)
+        if self.loop and duration and abs(drift) > duration / 2:
+            # ループの折り返し直後は1周分ずれて見えるので補正する
+            drift -= math.copysign(duration, drift)
+        stats = self.stats.setdefault(index, DriftStats())
+        stats.add(drift, frame_duration)
+        if now < self._cooldown_until.get(index, 0.0):
+            return
+
+        if abs(drift) > self.seek_threshold:
+            # 大きなずれ: シーク完了までの時間を見込んで少し先の位置へ正確にシークする
+            target = master_pos + self._seek_lead * self.rate
+            seek_started = time.perf_counter()
+            try:
+                player.seek(target, reference="absolute", precision="exact")
+            except Exception as e:
+                sync_log.error("Error hard-seeking player %s: %s", index, e)
+                return
+            seek_cost = time.perf_counter() - seek_started
+            self._seek_lead = 0.8 * self._seek_lead + 0.2 * max(seek_cost, 0.02)
+            self._cooldown_until[index] = now + max(0.3, self._seek_lead * 4)
+            self._smoothed.pop(index, None)
+            stats.hard_seeks += 1
+            sync_log.info("Player %s hard-seeked to %.3f (drift %.0fms)", index, target, drift * 1000)
+            return
+
+        smoothed = self._smoothed.get(index, drift)
+        smoothed += self.smoothing * (drift - smoothed)
+        self._smoothed[index] = smoothed
+        if abs(smoothed) <= frame_duration / 2:
+            speed = self.rate
+        else:
+            # horizon秒でずれが解消する速度に設定する (進んでいれば遅く、遅れていれば速く)
+            delta = max(-self.max_speed_delta, min(self.max_speed_delta, -smoothed / self.horizon))
+            speed = self.rate * (1.0 + delta)
+        if abs(speed - self._speeds.get(index, self.rate)) > 0.001:
+            try:
+                player.speed = speed
+            except Exception as e:
+                sync_log.error("Error setting speed for player %s: %s", index, e)
+                return
+            self._speeds[index] = speed
+            if speed != self.rate:
+                stats.speed_corrections += 1
+
+
+class LoadRequest:
+    # 1回分のloadfile要求の状態
+    def __init__(self, index, player, path, on_loaded, on_failed, start):
+        self.index = index
+        self.player = player
+        self.path = path
+        self.on_loaded = on_loaded
+        self.on_failed = on_failed
+        self.start = start
+        self.started = False  # start-fileイベントを受け取ったか (それ以前のイベントは前のファイルのもの)
+        self.loaded = False
+        self.duration = None
+        self.error = None
+        self.issued_at = time.perf_counter()
+        self.latency = None
+        self.timer = None
+
+
+class FileLoader:
+    # loadfileを発行した後はブロックせず、file-loaded / playback-restart イベントを待って
+    # 完了コールバックをUIスレッドで呼び出す。各プレーヤーの読み込みはmpv側で並行に進む。
+    def __init__(self, dispatch, timeout=10.0, restart_grace=2.0):
+        self.dispatch = dispatch  # (func, *args) をUIスレッドで実行する関数
+        self.timeout = timeout  # 読み込み全体のタイムアウト
+        self.restart_grace = restart_grace  # file-loaded後にplayback-restartを待つ時間
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def attach(self, index, player):
+        # プレーヤー作成時にイベントコールバックを登録する
+        def handler(event):
+            self._on_event(index, player, event)
+        player.register_event_callback(handler)
+        return handler
+
+    def load(self, index, player, path, on_loaded=None, on_failed=None, start=None, pause=True, options=None):
+        # optionsはこのファイルだけに適用するmpvオプション
+        request = LoadRequest(index, player, path, on_loaded, on_failed, start)
+        with self._lock:
+            previous = self._pending.get(index)
+            if previous and previous.timer:
+                previous.timer.cancel()
+            self._pending[index] = request
+        self._arm_timer(request, self.timeout)
+        options = dict(options or {}, pause='yes' if pause else 'no')
+        if start is not None:
+            options['start'] = f"{start:.3f}"
+        try:
+            player.loadfile(path, **options)
+        except Exception:
+            self._discard(request)
+            raise
+        return request
+
+    def cancel(self, index):
+        with self._lock:
+            request = self._pending.pop(index, None)
+        if request and request.timer:
+            request.timer.cancel()
+
+    def _arm_timer(self, request, seconds):
+        if request.timer:
+            request.timer.cancel()
+        request.timer = threading.Timer(seconds, self._on_timeout, (request,))
+        request.timer.daemon = True
+        request.timer.start()
+
+    def _discard(self, request):
+        with self._lock:
+            if self._pending.get(request.index) is request:
+                del self._pending[request.index]
+                return True
+        return False
+
+    def _on_event(self, index, player, event):
+        # mpvのイベントスレッドから呼ばれる
+        eid = event.event_id.value
+        if eid not in (mpv.MpvEventID.START_FILE, mpv.MpvEventID.FILE_LOADED,
+                       mpv.MpvEventID.PLAYBACK_RESTART, mpv.MpvEventID.END_FILE):
+            return
+        request = self._pending.get(index)
+        if request is None or request.player is not player:
+            return  # 差し替え前のプレーヤーのイベント
+        if eid == mpv.MpvEventID.START_FILE:
+            request.started = True
+        elif not request.started:
+            return
+        elif eid == mpv.MpvEventID.FILE_LOADED:
+            request.loaded = True
+            try:
+                request.duration = player.duration
+            except Exception as e:
+                load_log.error("Error reading duration for player %s: %s", index, e)
+            self._arm_timer(request, self.restart_grace)
+        elif eid == mpv.MpvEventID.PLAYBACK_RESTART and request.loaded:
+            self._finish(request)
+        elif eid == mpv.MpvEventID.END_FILE and event.data.reason == mpv.MpvEventEndFile.ERROR:
+            request.error = f"end-file error {event.data.error}"
+            self._finish(request)
+
+    def _on_timeout(self, request):
+        if not request.loaded:
+            request.error = "timeout"
+        self._finish(request)
+
+    def _finish(self, request):
+        if not self._discard(request):
+            return
+        if request.timer:
+            request.timer.cancel()
+        request.latency = time.perf_counter() - request.issued_at
+        callback = request.on_failed if request.error else request.on_loaded
+        if callback:
+            self.dispatch(callback, request.index, request)
+
+
+class SeekGroup:
+    # 1回のグループシーク。各プレーヤーのシーク発行から最初のフレーム表示 (playback-restart) までの時間を記録する
+    def __init__(self, position, on_done):
+        self.position = position
+        self.on_done = on_done
+        self.issued = {}  # index -> シーク発行時刻
+        self.latencies = {}  # index -> 秒
+        self.errors = {}  # index -> 理由
+        self.started = time.perf_counter()
+        self.timer = None
+
+    def waiting(self):
+        return [i for i in self.issued if i not in self.latencies and i not in self.errors]
+
+    def summary(self):
+        parts = [f"P{i + 1} {self.latencies[i] * 1000:.0f}ms" for i in sorted(self.latencies)]
+        parts += [f"P{i + 1} {reason}" for i, reason in sorted(self.errors.items())]
+        return f"to {format_time(self.position)} ({self.position:.3f}s): " + ", ".join(parts)
+
+
+class SeekBarrier:
+    # 全プレーヤーへ同時にシークを発行し、全員のplayback-restartが揃った時点でon_done(group)をUIスレッドで呼ぶ。
+    # 新しいグループシークが始まると前のグループは破棄する (最後の操作を優先)
+    def __init__(self, dispatch, timeout=5.0):
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self._group = None
+        self._lock = threading.Lock()
+
+    def attach(self, index, player):
+        def handler(event):
+            self._on_event(index, event)
+        player.register_event_callback(handler)
+        return handler
+
+    def seek(self, targets, position, on_done=None):
+        # targets: [(index, player, そのプレーヤーでのシーク位置)]
+        group = SeekGroup(position, on_done)
+        with self._lock:
+            if self._group and self._group.timer:
+                self._group.timer.cancel()
+            self._group = group
+            for index, player, target in targets:
+                group.issued[index] = time.perf_counter()
+                try:
+                    player.command_async('seek', f"{target:.3f}", 'absolute', 'exact')
+                except Exception as e:
+                    group.errors[index] = f"error: {e}"
+            finished = not group.waiting()
+            if not finished:
+                group.timer = threading.Timer(self.timeout, self._on_timeout, (group,))
+                group.timer.daemon = True
+                group.timer.start()
+        if finished:
+            self._finish(group)
+        return group
+
+    def forget(self, index):
+        # プレーヤーを差し替えた場合は待つのをやめる
+        with self._lock:
+            group = self._group
+            if group is None or index not in group.waiting():
+                return
+            group.errors[index] = "replaced"
+            finished = not group.waiting()
+        if finished:
+            self._finish(group)
+
+    def _on_event(self, index, event):
+        # mpvのイベントスレッドから呼ばれる
+        eid = event.event_id.value
+        if eid not in (mpv.MpvEventID.PLAYBACK_RESTART, mpv.MpvEventID.END_FILE):
+            return
+        with self._lock:
+            group = self._group
+            if group is None or index not in group.waiting():
+                return
+            if eid == mpv.MpvEventID.PLAYBACK_RESTART:
+                group.latencies[index] = time.perf_counter() - group.issued[index]
+            else:
+                group.errors[index] = "file ended"
+            finished = not group.waiting()
+        if finished:
+            self._finish(group)
+
+    def _on_timeout(self, group):
+        with self._lock:
+            for index in group.waiting():
+                group.errors[index] = "timeout"
+        self._finish(group)
+
+    def _finish(self, group):
+        with self._lock:
+            if self._group is not group:
+                return  # 新しいグループシークに置き換えられた
+            self._group = None
+            if group.timer:
+                group.timer.cancel()
+        if group.on_done:
+            self.dispatch(group.on_done, group)
+
+
+class Scrubber:
+    # スライダーのドラッグ中はキーフレーム単位の高速シークを1プレーヤーにつき1つだけ実行し、
+    # 実行中に来た要求は最新のものだけを残す。離した時点で正確な位置へシークする
+    def __init__(self, settle_timeout=0.5):
+        self.settle_timeout = settle_timeout  # playback-restartが来ない場合に次のシークを許可するまでの時間
+        self._in_flight = {}  # index -> シーク発行時刻
+        self._pending = {}  # index -> (player, 位置)
+        self._lock = threading.Lock()
+
+    def attach(self, index, player):
+        def handler(event):
+            if event.event_id.value == mpv.MpvEventID.PLAYBACK_RESTART:
+                self._on_restart(index)
+        player.register_event_callback(handler)
+        return handler
+
+    def request(self, index, player, position):
+        # ドラッグ中の位置。前のシークが終わっていなければ最新の位置だけを覚えておく
+        with self._lock:
+            started = self._in_flight.get(index)
+            if started is not None and time.perf_counter() - started < self.settle_timeout:
+                self._pending[index] = (player, position)
+                return False
+            self._in_flight[index] = time.perf_counter()
+            self._pending.pop(index, None)
+        self._seek(player, position, 'keyframes')
+        return True
+
+    def finish(self, index, player, position):
+        # ドラッグ終了。残っている要求を捨てて正確な位置へシークする
+        with self._lock:
+            self._pending.pop(index, None)
+            self._in_flight[index] = time.perf_counter()
+        self._seek(player, position, 'exact')
+
+    def forget(self, index):
+        with self._lock:
+            self._pending.pop(index, None)
+            self._in_flight.pop(index, None)
+
+    def _on_restart(self, index):
+        # mpvのイベントスレッドから呼ばれる
+        with self._lock:
+            pending = self._pending.pop(index, None)
+            if pending is None:
+                self._in_flight.pop(index, None)
+                return
+            self._in_flight[index] = time.perf_counter()
+        self._seek(pending[0], pending[1], 'keyframes')
+
+    def _seek(self, player, position, precision):
+        try:
+            player.command_async('seek', f"{position:.3f}", 'absolute', precision)
+        except Exception as e:
+            seek_log.error("Error scrubbing to %s: %s", position, e)
+
+
+def compositor_graph(inputs, rows, cols, visible, volumes, size=(1920, 1080), ffmpeg=False):
+    # 合成モードのlavfi-complex。inputs: 読み込み順の [(タイル番号, (映像トラック数, 音声トラック数))]。
+    # mpvは1番目を本体、残りを外部ファイルとして読み込み、全ファイルのトラックに読み込み順でvid1, aid1から通し番号を付けるので、
+    # 各ファイルの最初のトラックの番号はそれより前のファイルのトラック数から決まる。
+    # ffmpegの-filter_complexに使う場合は入力ファイルの番号とファイル内の番号で指定する
+    # 各タイルはsizeと同じ縦横比にし、行と列の多い方がsizeに収まる大きさにする (1x4なら1920x270)
+    cells_across = max(rows, cols)
+    cell_w, cell_h = size[0] // cells_across // 2 * 2, size[1] // cells_across // 2 * 2
+    width, height = cell_w * cols, cell_h * rows
+    chains, cells, mixed = [], [], []
+    vid = aid = 0  # それまでのファイルの映像・音声トラック数
+    for number, (index, (videos, audios)) in enumerate(inputs):
+        first_vid, first_aid = vid + 1, aid + 1
+        vid += videos
+        aid += audios
+        if audios:
+            source = f"[{number}:a:0]" if ffmpeg else f"[aid{first_aid}]"
+            chains.append(f"{source}volume={volumes.get(index, 100) / 100:.3f}[a{index}]")
+            mixed.append(f"[a{index}]")
+        if index >= visible or not videos:
+            continue  # 表示しないタイルの映像は使わない (音声は鳴らし続ける)
+        row, col = divmod(index, cols)
+        source = f"[{number}:v:0]" if ffmpeg else f"[vid{first_vid}]"
+        chains.append(f"{source}scale={cell_w}:{cell_h}:force_original_aspect_ratio=decrease,"
+                      f"pad={cell_w}:{cell_h}:-1:-1,setsar=1[v{index}]")
+        cells.append((f"[v{index}]", col * cell_w, row * cell_h))
+    if len(cells) > 1:
+        layout = "|".join(f"{x}_{y}" for _, x, y in cells)
+        chains.append("".join(label for label, _, _ in cells)
+                      + f"xstack=inputs={len(cells)}:layout={layout}:fill=black,pad={width}:{height}:0:0[vo]")
+    elif cells:
+        label, x, y = cells[0]
+        chains.append(f"{label}pad={width}:{height}:{x}:{y}[vo]")
+    if len(mixed) > 1:
+        chains.append("".join(mixed) + f"amix=inputs={len(mixed)}:duration=longest:normalize=0[ao]")
+    elif mixed:
+        chains.append(f"{mixed[0]}anull[ao]")
+    return ";".join(chains)
+
+
+class Compositor:
+    # 合成モードの1台のmpvと、その入力・フィルタグラフ。時計・GPUコンテキスト・音声出力が1つになるので、
+    # タイル間のずれが原理的に生じない。Tkには依存しない
+    def __init__(self, player, inputs):
+        self.player = player
+        self.inputs = inputs  # 読み込み順の [(タイル番号, パス, (映像トラック数, 音声トラック数))]
+        self.graph = None
+        self.position = None
+
+    def configure(self, rows, cols, visible, volumes):
+        # 並びや音量が変わったらフィルタグラフを設定し直す。再生中に変更してもフィルタだけが作り直される
+        graph = compositor_graph([(index, tracks) for index, _, tracks in self.inputs], rows, cols, visible, volumes)
+        if graph == self.graph:
+            return False
+        self.graph = graph
+        self.player['lavfi-complex'] = graph
+        return True
+
+    def load(self, loader, start, on_loaded, on_failed):
+        # フィルタグラフはloadfileのオプションに書けない (カンマを含む) ので、事前にオプションとして設定しておく
+        self.player['external-files'] = [path for _, path, _ in self.inputs[1:]]
+        return loader.load(0, self.player, self.inputs[0][1], on_loaded, on_failed, start=start, pause=True)
+
+
+class GridExporter:
+    # タイルの並びのまま1本の動画に書き出す。デコード・合成 (合成モードと同じフィルタグラフ)・エンコードはffmpegの中で
+    # フレーム単位に流れ、段の間のキューにも上限があるので、クリップ全体がメモリに載ることはない。
+    # 画面に表示しないので実時間より速く書き出せる。Tkには依存しない
+    def __init__(self):
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.available = bool(self.ffmpeg)
+        self._running = set()
+        self._cancel = threading.Event()
+
+    def command(self, inputs, rows, cols, visible, volumes, start, end, output):
+        # inputs: [(タイル番号, パス, オフセット秒, (映像トラック数, 音声トラック数))]。各タイルはstart+オフセットの位置から読む
+        args = [self.ffmpeg, "-v", "error", "-nostdin", "-y"]
+        for _, path, offset, _ in inputs:
+            args += ["-ss", f"{max(0.0, start + offset):.3f}", "-t", f"{end - start:.3f}", "-i", path]
+        graph = compositor_graph([(index, tracks) for index, _, _, tracks in inputs], rows, cols, visible, volumes,
+                                 ffmpeg=True)
+        args += ["-filter_complex", graph, "-map", "[vo]"]
+        if "[ao]" in graph:
+            args += ["-map", "[ao]", "-c:a", "aac", "-b:a", "192k"]
+        # libx264はフレーム単位とスライス単位のスレッドで全コアを使う
+        args += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p", "-threads", "0",
+                 "-t", f"{end - start:.3f}", "-movflags", "+faststart", "-progress", "pipe:1", "-nostats", output]
+        return args
+
+    def run(self, args, on_progress=None):
+        # 書き出しが終わるまで戻らず、かかった秒数を返す。on_progress(書き出した秒数, エンコードのfps, 実時間に対する倍率) を
+        # ffmpegの-progressの更新ごと (約0.5秒ごと) に呼ぶ
+        self._cancel.clear()
+        started = time.perf_counter()
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True, **tool_priority())
+        self._running.add(process)
+        errors = collections.deque(maxlen=20)
+        reader = threading.Thread(target=lambda: errors.extend(process.stderr), name="ExportErrors", daemon=True)
+        reader.start()
+        try:
+            values = {}
+            for line in process.stdout:
+                key, _, value = line.strip().partition("=")
+                values[key] = value
+                if key != "progress" or on_progress is None:
+                    continue
+                try:
+                    done = int(values.get("out_time_us", 0)) / 1e6
+                except ValueError:
+                    done = 0.0  # 最初のフレームが出るまでは"N/A"
+                try:
+                    fps = float(values.get("fps", 0))
+                except ValueError:
+                    fps = 0.0
+                on_progress(done, fps, done / max(time.perf_counter() - started, 1e-6))
+            process.wait()
+            reader.join(timeout=1.0)
+        finally:
+            self._running.discard(process)
+        if self._cancel.is_set():
+            raise RuntimeError("cancelled")
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {''.join(errors).strip()[-300:]}")
+        return time.perf_counter() - started
+
+    def cancel(self):
+        self._cancel.set()
+        stop_tools(self._running)
+
+
+def export_files(paths, output, grid=None, time_range=None):
+    # --export: ウィンドウを作らずに、指定したファイルを並べて書き出す。終了コードを返す
+    exporter = GridExporter()
+    if not exporter.available:
+        export_log.error("ffmpeg not found on PATH")
+        return 1
+    probe = MediaProbe(None)
+    media = [probe.probe(path) or {} for path in paths]
+    probe.close()
+    rows, cols = grid or compute_grid(len(paths), 1920, 1080)
+    start, end = time_range or (0.0, None)
+    end = end or max(m.get('duration') or 0.0 for m in media)
+    if end <= start:
+        export_log.error("Nothing to export: range %.3f-%.3f", start, end)
+        return 1
+    inputs = [(index, path, 0.0, track_counts(m)) for index, (path, m) in enumerate(zip(paths, media))]
+    args = exporter.command(inputs, rows, cols, min(len(paths), rows * cols), {}, start, end, output)
+    export_log.info("Exporting %d videos as %dx%d, %s-%s to %s", len(paths), rows, cols,
+                    format_time(start), format_time(end), output)
+    reported = [0.0]
+
+    def progress(done, fps, speed):
+        if time.perf_counter() - reported[0] >= 2.0:
+            reported[0] = time.perf_counter()
+            export_log.info("Exported %s / %s (%.0f fps, %.1fx real time)",
+                            format_time(done), format_time(end - start), fps, speed)
+
+    try:
+        elapsed = exporter.run(args, progress)
+    except (OSError, RuntimeError) as e:
+        export_log.error("Export failed: %s", e)
+        return 1
+    export_log.info("Exported %s in %.1fs (%.1fx real time)", output, elapsed, (end - start) / elapsed)
+    return 0
+
+
+class BenchmarkLoop:
+    # ベンチマークでTkのafterループの代わりに使うUIスレッド。process_ui_queueと同じく15ms周期でキューを処理し、
+    # 周期の遅れ (他のスレッドのコールバックとのGILの取り合いなど) と、依頼から実行までの待ち時間を記録する
+    def __init__(self, interval=0.015):
+        self.interval = interval
+        self.lags = []  # 予定時刻からの遅れ (秒)
+        self.waits = []  # call_in_uiから実行までの時間 (秒)
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="BenchmarkLoop", daemon=True)
+        self._thread.start()
+
+    def call_in_ui(self, func, *args):
+        self._queue.put((time.perf_counter(), func, args))
+
+    def reset(self):
+        self.lags, self.waits = [], []
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def _run(self):
+        due = time.perf_counter() + self.interval
+        while not self._stop.wait(max(0.0, due - time.perf_counter())):
+            self.lags.append(time.perf_counter() - due)
+            while True:
+                try:
+                    queued, func, args = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.waits.append(time.perf_counter() - queued)
+                try:
+                    func(*args)
+                except Exception as e:
+                    benchmark_log.error("Error in callback %s: %s", getattr(func, '__name__', func), e, exc_info=True)
+            due = time.perf_counter() + self.interval  # Tkのafterと同じく処理の後に次を予約する
+
+
+def benchmark_source(width, height, seconds=60):
+    # ベンチマーク用の合成映像。ffmpegがあればtestsrc2を1秒GOPのH.264/AACに書き出して使い回す (毎回同じ入力で比べられ、
+    # シークも実際のファイルと同じように測れる)。無ければmpvのlavfiソースを直接開く (シークは遅いか失敗する)
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        benchmark_log.warning("ffmpeg not found, playing lavfi sources directly; seek times are not comparable")
+        return f"av://lavfi:testsrc2=size={width}x{height}:rate=30"
+    path = os.path.join(cache_dir(), "benchmark", f"testsrc2_{width}x{height}_30fps_{seconds}s.mp4")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        started = time.perf_counter()
+        partial = path[:-4] + ".part.mp4"
+        run_tool([ffmpeg, "-v", "error", "-y",
+                  "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+                  "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                  "-c:v", "libx264", "-preset", "veryfast", "-g", "30", "-pix_fmt", "yuv420p",
+                  "-c:a", "aac", "-shortest", partial], timeout=600)
+        os.replace(partial, path)
+        benchmark_log.info("Generated %s in %.1fs", path, time.perf_counter() - started)
+    return path
+
+
+def latency_summary(prefix, values):
+    # 秒のリストをミリ秒のp50/p99/maxにする
+    if not values:
+        return {}
+    return {f"{prefix}_p50": percentile(values, 0.5) * 1000, f"{prefix}_p99": percentile(values, 0.99) * 1000,
+            f"{prefix}_max": max(values) * 1000}
+
+
+def wait_all(count, issue, timeout):
+    # issue(done)で非同期の処理を始め、done(key, value)がcount回呼ばれるまで待つ。{key: value}を返す
+    results = {}
+    finished = threading.Event()
+
+    def done(key, value):
+        results[key] = value
+        if len(results) >= count:
+            finished.set()
+
+    issue(done)
+    finished.wait(timeout)
+    return dict(results)
+
+
+def benchmark_scenario(loop, path, tiles, mode, seconds, seek_count=5):
+    # 1つの組み合わせを測る。separateはタイルごとのmpv、compositorは合成モードの1台のmpv。
+    # 全てvo=null/ao=nullで、再生中のタイル間のずれはSyncEngine (壁時計マスター) の統計から取る
+    metrics = {}
+    options = dict(vo='null', ao='null', hwdec='no',  # 結果がGPUやドライバーに左右されないようソフトウェアデコード
+                   keep_open='yes', idle=True, hr_seek='yes', cache='yes', demuxer_seekable_cache='yes',
+                   loglevel=mpv_loglevel(), log_handler=mpv_log_handler)
+    started = time.perf_counter()
+    players = [load_mpv().MPV(**options) for _ in range(tiles if mode == "separate" else 1)]
+    metrics["startup_ms"] = (time.perf_counter() - started) * 1000
+    targets = list(enumerate(players))
+    loader = FileLoader(loop.call_in_ui, timeout=30)
+    barrier = SeekBarrier(loop.call_in_ui, timeout=10)
+    sync_engine = SyncEngine(lambda: targets)
+    for index, player in targets:
+        loader.attach(index, player)
+        barrier.attach(index, player)
+    try:
+        # 読み込み: loadfileの発行からUIスレッドに完了が届くまで
+        started = time.perf_counter()
+        if mode == "separate":
+            def issue(done):
+                for index, player in targets:
+                    loader.load(index, player, path, lambda i, request: done(i, request),
+                                lambda i, request: done(i, None))
+        else:
+            tracks = (1, 0) if path.startswith("av://") else (1, 1)
+            compositor = Compositor(players[0], [(index, path, tracks) for index in range(tiles)])
+            rows, cols = compute_grid(tiles, 1920, 1080)
+            compositor.configure(rows, cols, tiles, {})
+
+            def issue(done):
+                compositor.load(loader, 0.0, lambda i, request: done(i, request), lambda i, request: done(i, None))
+        loaded = wait_all(len(targets), issue, 40)
+        if len(loaded) < len(targets) or not all(loaded.values()):
+            raise RuntimeError("load failed or timed out")
+        metrics.update(latency_summary("load_ms", [request.latency for request in loaded.values()]))
+        metrics["load_all_ms"] = (time.perf_counter() - started) * 1000
+        duration = min(request.duration or 60.0 for request in loaded.values())
+
+        # 全タイル同時シーク: 発行から全員の最初のフレームがUIスレッドに揃うまで
+        seek_times, seek_errors = [], 0
+        for k in range(seek_count):
+            position = duration * (0.15 + 0.7 * ((k * 0.618) % 1.0))  # 前後に散らばる決まった位置
+            started = time.perf_counter()
+            group = wait_all(1, lambda done: barrier.seek([(i, player, position) for i, player in targets], position,
+                                                          lambda group: done(0, group)), 15).get(0)
+            if group is None or group.errors:
+                seek_errors += 1
+            else:
+                seek_times.append(time.perf_counter() - started)
+        metrics.update(latency_summary("seek_ms", seek_times))
+        metrics["seek_errors"] = seek_errors
+
+        # 再生: フレーム落ち、CPU使用率、UIループの遅れ、タイル間のずれ
+        position = min(duration * 0.1, max(0.0, duration - seconds - 1))
+        wait_all(1, lambda done: barrier.seek([(i, player, position) for i, player in targets], position,
+                                              lambda group: done(0, group)), 15)
+
+        def drops():
+            total = 0
+            for _, player in targets:
+                for prop in ("frame-drop-count", "decoder-frame-drop-count"):
+                    try:
+                        total += player[prop] or 0
+                    except Exception:
+                        pass
+            return total
+
+        dropped = drops()
+        loop.reset()
+        sync_engine.resume(position)
+        if mode == "separate":
+            sync_engine.start_thread()
+        cpu_started, started = time.process_time(), time.perf_counter()
+        for _, player in targets:
+            player.pause = False
+        time.sleep(seconds)
+        for _, player in targets:
+            player.pause = True
+        elapsed = time.perf_counter() - started
+        sync_engine.stop_thread()
+        metrics["cpu_percent"] = (time.process_time() - cpu_started) / elapsed * 100
+        metrics["dropped_frames"] = drops() - dropped
+        metrics.update(latency_summary("ui_lag_ms", loop.lags))
+        metrics.update(latency_summary("dispatch_ms", loop.waits))
+        stats = list(sync_engine.stats.values())
+        samples = sum(stat.samples for stat in stats)
+        if samples:
+            metrics["drift_mean_ms"] = sum(stat.sum_abs for stat in stats) / samples * 1000
+            metrics["drift_max_ms"] = max(stat.max_abs for stat in stats) * 1000
+            metrics["sync_seeks"] = sum(stat.hard_seeks for stat in stats)
+        mpv_version = players[0].mpv_version
+    finally:
+        sync_engine.stop_thread()
+        for index, _ in targets:
+            loader.cancel(index)
+        for player in players:
+            player.terminate()
+    return metrics, mpv_version
+
+
+def compare_benchmark(report, baseline, tolerance=0.2, floor=1.0):
+    # 同じ名前の組み合わせの各値をベースラインと比べる。全て小さいほど良い値なので、
+    # tolerance (割合) とfloor (絶対値) の両方を超えて大きくなったものを悪化とする。悪化した数を返す
+    previous = {scenario["name"]: scenario.get("metrics", {}) for scenario in baseline.get("scenarios", [])}
+    regressions = 0
+    for scenario in report["scenarios"]:
+        base = previous.get(scenario["name"])
+        if base is None:
+            continue
+        comparison = scenario["comparison"] = {}
+        for key, value in scenario.get("metrics", {}).items():
+            if not isinstance(base.get(key), (int, float)):
+                continue
+            regressed = value > base[key] * (1 + tolerance) and value - base[key] > floor
+            comparison[key] = {"baseline": base[key], "change": value - base[key], "regressed": regressed}
+            if regressed:
+                regressions += 1
+                benchmark_log.warning("%s: %s %.1f -> %.1f", scenario["name"], key, base[key], value)
+    return regressions
+
+
+def run_benchmark(output, baseline_path=None, sizes=((640, 360), (1280, 720), (1920, 1080)), tile_counts=(1, 4, 9),
+                  seconds=10.0):
+    # --benchmark: ウィンドウを作らずに各組み合わせを測り、JSONに書き出す。
+    # 終了コードを返す (ベースラインより悪化した値があれば1)
+    started = time.perf_counter()
+    load_mpv()
+    report = {"version": version, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "platform": platform.platform(),
+              "python": platform.python_version(), "mpv": None,
+              "import_mpv_ms": (time.perf_counter() - started) * 1000, "seconds": seconds, "scenarios": []}
+    loop = BenchmarkLoop()
+    try:
+        for width, height in sizes:
+            path = benchmark_source(width, height)
+            for tiles in tile_counts:
+                for mode in ("separate", "compositor") if tiles > 1 else ("separate",):
+                    scenario = {"name": f"{width}x{height} x{tiles} {mode}", "size": [width, height],
+                                "tiles": tiles, "mode": mode}
+                    try:
+                        scenario["metrics"], report["mpv"] = benchmark_scenario(loop, path, tiles, mode, seconds)
+                        benchmark_log.info("%s: %s", scenario["name"], ", ".join(
+                            f"{key} {value:.1f}" for key, value in scenario["metrics"].items()))
+                    except Exception as e:
+                        scenario["error"] = str(e)
+                        benchmark_log.error("%s failed: %s", scenario["name"], e)
+                    report["scenarios"].append(scenario)
+    finally:
+        loop.close()
+    status = 1 if any("error" in scenario for scenario in report["scenarios"]) else 0
+    if baseline_path:
+        try:
+            with open(baseline_path, encoding="utf-8") as f:
+                regressions = compare_benchmark(report, json.load(f))
+        except (OSError, ValueError) as e:
+            benchmark_log.error("Cannot read baseline %s: %s", baseline_path, e)
+            return 1
+        report["baseline"] = {"path": baseline_path, "regressions": regressions}
+        benchmark_log.info("%d regressions against %s", regressions, baseline_path)
+        status = status or (1 if regressions else 0)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    benchmark_log.info("Benchmark written to %s in %.0fs", output, time.perf_counter() - started)
+    return status
+
+
+class StreamInfo:
+    # デコード負荷の見積もりに使う動画ストリームの情報
+    def __init__(self, width=None, height=None, fps=None, codec=None):
+        self.width = width or 1920
+        self.height = height or 1080
+        self.fps = fps or 30.0
+        self.codec = codec or ""
+
+    @classmethod
+    def from_player(cls, player):
+        # file-loaded以降に呼ぶ。取得できない値は1080p30とみなす
+        def read(name):
+            try:
+                return player[name]
+            except Exception:
+                return None
+        return cls(read('width'), read('height'), read('container-fps'), read('video-format'))
+
+    @classmethod
+    def from_media(cls, media):
+        # MediaProbeの結果から作る
+        return cls(media.get('width'), media.get('height'), media.get('fps'), media.get('codec'))
+
+    def cost(self):
+        # 1秒あたりの画素数をコーデックごとの重みで補正した値 (1080p30のH.264を1とする)
+        weight = DecodeScheduler.CODEC_WEIGHTS.get(self.codec, 1.0)
+        return self.width * self.height * self.fps * weight / (1920 * 1080 * 30)
+
+
+class DecodePlan:
+    # 1タイル分のデコーダー設定
+    def __init__(self, threads=0, hwdec='auto', framedrop='vo'):
+        self.threads = threads  # vd-lavc-threads (0は自動)
+        self.hwdec = hwdec
+        self.framedrop = framedrop
+
+    def options(self):
+        return {'vd-lavc-threads': str(self.threads), 'hwdec': self.hwdec, 'framedrop': self.framedrop}
+
+    def __eq__(self, other):
+        return isinstance(other, DecodePlan) and self.options() == other.options()
+
+
+class DecodeScheduler:
+    # CPUコア数と各ファイルの解像度/コーデックから、タイルごとのデコードスレッド数・hwdec・フレームドロップを決める。
+    # mpvへの反映は呼び出し側で行う (Tkにもmpvにも依存しない)
+    HW_CODECS = {"h264", "hevc", "vp9", "av1", "mpeg2video", "vc1"}
+    CODEC_WEIGHTS = {"h264": 1.0, "hevc": 1.6, "vp9": 1.4, "av1": 2.0, "prores": 1.5, "mpeg2video": 0.6}
+    MAX_THREADS = 16  # これ以上増やしてもlibavcodecのスレッド効率はほとんど上がらない
+
+    def __init__(self, cores=None, hw_slots=4, core_capacity=1.5):
+        self.cores = cores or os.cpu_count() or 4
+        self.hw_slots = hw_slots  # 同時にハードウェアデコードするストリーム数の上限
+        self.core_capacity = core_capacity  # 1コアで実時間デコードできるコスト (1080p30 H.264 = 1)
+        self._streams = {}
+        self._visible = {}
+        self._boost = {}  # フレームを落とし続けるタイルの負荷補正
+        self._hw_failed = set()  # ハードウェアデコードを要求したが使われなかったタイル
+        self._drops = {}
+        self._lock = threading.Lock()
+
+    def set_stream(self, index, info):
+        with self._lock:
+            self._streams[index] = info
+            self._boost.pop(index, None)
+            self._drops.pop(index, None)
+            self._hw_failed.discard(index)
+
+    def set_visible(self, index, visible):
+        with self._lock:
+            self._visible[index] = visible
+
+    def forget(self, index):
+        with self._lock:
+            for table in (self._streams, self._boost, self._drops):
+                table.pop(index, None)
+            self._hw_failed.discard(index)
+
+    def hwdec_unavailable(self, index):
+        # hwdec-currentが"no"だった場合に呼ぶ。以降このファイルはソフトウェアデコードの前提で割り当てる
+        with self._lock:
+            if index in self._hw_failed:
+                return False
+            self._hw_failed.add(index)
+            return True
+
+    def note_drops(self, index, count):
+        # mpvのスレッドから呼ばれる。デコーダーがフレームを落とし始めたら負荷を高めに見積もり直す
+        if count is None:
+            return False
+        with self._lock:
+            previous = self._drops.get(index)
+            self._drops[index] = count
+            if previous is None or count - previous < 10:
+                return False
+            boost = self._boost.get(index, 1.0)
+            if boost >= 4.0:
+                return False
+            self._boost[index] = boost * 1.25
+            return True
+
+    def plan(self):
+        # {index: DecodePlan} を返す
+        with self._lock:
+            streams = dict(self._streams)
+            visible = {i: self._visible.get(i, True) for i in streams}
+            boost = dict(self._boost)
+            hw_failed = set(self._hw_failed)
+        plans = {}
+        costs = {i: info.cost() * boost.get(i, 1.0) for i, info in streams.items()}
+        # 重いストリームから順にハードウェアデコードを割り当て、残りをCPUで分担する
+        hw = set()
+        for i in sorted(costs, key=costs.get, reverse=True):
+            if len(hw) >= self.hw_slots:
+                break
+            if visible[i] and i not in hw_failed and streams[i].codec in self.HW_CODECS:
+                hw.add(i)
+        software = [i for i in streams if i not in hw]
+        # ハードウェアデコードでもコピーや変換にCPUを使うので、1タイルにつき1スレッド分を確保しておく
+        cpu_threads = max(self.cores - len(hw), len(software))
+        soft_cost = sum(costs[i] for i in software if visible[i]) or 1.0
+        overloaded = soft_cost > (self.cores - len(hw)) * self.core_capacity
+        for i in streams:
+            if i in hw:
+                plans[i] = DecodePlan(threads=1, hwdec='auto', framedrop='vo')
+            elif not visible[i]:
+                # 非表示のタイルは再生位置だけ進めばよいので最小限の資源で動かす
+                plans[i] = DecodePlan(threads=1, hwdec='no', framedrop='decoder+vo')
+            else:
+                share = round(cpu_threads * costs[i] / soft_cost)
+                threads = max(1, min(self.MAX_THREADS, share))
+                plans[i] = DecodePlan(threads=threads, hwdec='no', framedrop='decoder+vo' if overloaded else 'vo')
+        return plans
+
+
+def parse_size(text):
+    # "512M" や "2G" 形式のバイト数 (単位は1024倍)
+    text = str(text).strip().upper().rstrip("B").rstrip("I")
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+class CachePlan:
+    # 1タイル分のデマルチプレクサキャッシュの上限 (先読み / 再生済みの保持)
+    def __init__(self, forward, back):
+        self.forward = forward
+        self.back = back
+
+    def options(self):
+        return {'demuxer-max-bytes': str(self.forward), 'demuxer-max-back-bytes': str(self.back)}
+
+    def __eq__(self, other):
+        return isinstance(other, CachePlan) and self.options() == other.options()
+
+
+class CacheBudget:
+    # 全プレーヤーのデマルチプレクサキャッシュの合計がtotal_bytesに収まるよう、ビットレートと表示状態に応じて配分する。
+    # ビットレートに比例させるので、どのタイルも同じ秒数分を先読みできる。各タイルの配分のうちback_seconds秒分
+    # (最大で半分) は後方シーク用に残す。ファイル全体が配分に2つ分収まる場合はファイルごと保持するので、
+    # ループ再生の先頭への戻りもメモリから読める。Tkにもmpvにも依存しない
+    HIDDEN_WEIGHT = 0.25  # 非表示のタイルは再生位置を保てる程度でよい
+    MIN_BYTES = 8 << 20
+    STANDBY_BYTES = 32 << 20  # 先読み用の待機プレーヤーは最初の数秒分だけあればよい
+    DEFAULT_BITRATE = 8_000_000  # ビットレートが分からないファイルは8Mbpsとみなす
+
+    def __init__(self, total_bytes, back_seconds=10.0):
+        self.total_bytes = total_bytes
+        self.back_seconds = back_seconds
+        self._streams = {}  # index -> (ビットレート, ファイルサイズ)
+        self._visible = {}
+        self._lock = threading.Lock()
+
+    def set_stream(self, index, bitrate, size=None):
+        with self._lock:
+            self._streams[index] = (bitrate or self.DEFAULT_BITRATE, size)
+
+    def set_visible(self, index, visible):
+        with self._lock:
+            self._visible[index] = visible
+
+    def forget(self, index):
+        with self._lock:
+            self._streams.pop(index, None)
+
+    def plan(self):
+        # {index: CachePlan} を返す。各プランの先読みと保持の上限の合計はtotal_bytesを超えない
+        with self._lock:
+            streams = dict(self._streams)
+            visible = {i: self._visible.get(i, True) for i in streams}
+        weights = {i: bitrate * (1.0 if visible[i] else self.HIDDEN_WEIGHT) for i, (bitrate, _) in streams.items()}
+        plans = {}
+        budget = self.total_bytes
+        remaining = set(streams)
+
+        def shares():
+            # 最低限の分を先に確保し、残りを重みで分ける (予算が最低限にも足りなければ等分する)
+            if not remaining:
+                return {}
+            floor = min(self.MIN_BYTES, budget // len(remaining))
+            spare = budget - floor * len(remaining)
+            total_weight = sum(weights[i] for i in remaining) or 1.0
+            return {i: floor + int(spare * weights[i] / total_weight) for i in remaining}
+
+        # 配分に収まる小さいファイルから丸ごと保持し、余った分を残りのタイルで分け直す。
+        # 丸ごと保持するには先読みと保持の上限をどちらもファイルサイズにするので、配分からは両方の分を引く
+        changed = True
+        while changed:
+            changed = False
+            share = shares()
+            for i in sorted(remaining, key=lambda i: streams[i][1] or float('inf')):
+                size = streams[i][1]
+                if size and 2 * size <= share[i]:
+                    plans[i] = CachePlan(size, size)
+                    budget -= 2 * size
+                    remaining.discard(i)
+                    changed = True
+                    break
+        for i, share in shares().items():
+            back = min(share // 2, int(streams[i][0] / 8 * self.back_seconds))
+            plans[i] = CachePlan(share - back, back)
+        return plans
+
+
+def cache_fw_bytes(value):
+    # demuxer-cache-stateから先読み済みのバイト数を取り出す
+    return value.get('fw-bytes') if isinstance(value, dict) else None
+
+
+def cache_total_bytes(value):
+    # demuxer-cache-stateから、再生済みの保持分も含めたキャッシュ全体のバイト数を取り出す
+    return value.get('total-bytes') if isinstance(value, dict) else None
+
+
+class MetricsCollector:
+    # 各プレーヤーの再生状況を一定間隔で読み取り、履歴として保持する。必要ならCSV (追記) と
+    # Prometheusのテキスト形式 (最新値で上書き) のファイルに書き出す。Tkには依存しない
+    # (キー, mpvのプロパティ, 値の変換, Prometheusの名前, 種類, 説明)
+    METRICS = [
+        ("vo_drops", "frame-drop-count", None, "simul_pb_vo_dropped_frames_total", "counter",
+         "Frames dropped by the video output"),
+        ("decoder_drops", "decoder-frame-drop-count", None, "simul_pb_decoder_dropped_frames_total", "counter",
+         "Frames dropped by the decoder"),
+        ("delayed", "vo-delayed-frame-count", None, "simul_pb_vo_delayed_frames_total", "counter",
+         "Frames shown later than scheduled"),
+        ("output_fps", "estimated-vf-fps", None, "simul_pb_output_fps", "gauge",
+         "Estimated frame rate after the video filters"),
+        ("container_fps", "container-fps", None, "simul_pb_container_fps", "gauge",
+         "Nominal frame rate of the file"),
+        ("avsync", "avsync", None, "simul_pb_avsync_seconds", "gauge",
+         "Audio minus video position"),
+        ("cache_seconds", "demuxer-cache-duration", None, "simul_pb_demuxer_cache_seconds", "gauge",
+         "Seconds of media buffered ahead by the demuxer"),
+        ("cache_bytes", "demuxer-cache-state", cache_fw_bytes, "simul_pb_demuxer_cache_bytes", "gauge",
+         "Bytes buffered ahead by the demuxer"),
+        ("cache_total", "demuxer-cache-state", cache_total_bytes, "simul_pb_demuxer_cache_total_bytes", "gauge",
+         "Bytes held by the demuxer cache including the back buffer"),
+        ("speed", "speed", None, "simul_pb_speed", "gauge",
+         "Current playback speed"),
+        ("position", "time-pos", None, "simul_pb_position_seconds", "gauge",
+         "Current playback position"),
+    ]
+    KEYS = [m[0] for m in METRICS]
+
+    def __init__(self, get_targets, interval=1.0, history=600, csv_path=None, prom_path=None):
+        self.get_targets = get_targets  # () -> [(index, player)]
+        self.interval = interval
+        self.csv_path = csv_path
+        self.prom_path = prom_path
+        self.history = collections.defaultdict(lambda: collections.deque(maxlen=history))  # index -> [(時刻, dict)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._csv = None
+
+    def exporting(self):
+        return bool(self.csv_path or self.prom_path)
+
+    def start_thread(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="Metrics", daemon=True)
+            self._thread.start()
+
+    def stop_thread(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._csv is not None:
+            self._csv.close()
+            self._csv = None
+
+    def latest(self):
+        # {index: (値, 1秒あたりのフレーム落ち)} を返す
+        result = {}
+        with self._lock:
+            for index, samples in self.history.items():
+                if not samples:
+                    continue
+                t, values = samples[-1]
+                rates = {}
+                if len(samples) >= 2:
+                    t0, previous = samples[-2]
+                    for key in ("vo_drops", "decoder_drops", "delayed"):
+                        if values.get(key) is not None and previous.get(key) is not None and t > t0:
+                            rates[key] = (values[key] - previous[key]) / (t - t0)
+                result[index] = (values, rates)
+        return result
+
+    def forget(self, index):
+        # ファイル変更やプレーヤー差し替えでカウンターが0に戻るので履歴を捨てる
+        with self._lock:
+            self.history.pop(index, None)
+
+    def sample(self):
+        now = time.time()
+        rows = []
+        for index, player in self.get_targets():
+            values = {}
+            for key, prop, convert, *_ in self.METRICS:
+                try:
+                    value = player[prop]
+                except Exception:
+                    value = None
+                values[key] = convert(value) if convert and value is not None else value
+            rows.append((index, values))
+        with self._lock:
+            for index, values in rows:
+                self.history[index].append((now, values))
+        if self.csv_path:
+            self._write_csv(now, rows)
+        if self.prom_path:
+            self._write_prometheus(rows)
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            try:
+                self.sample()
+            except Exception as e:
+                metrics_log.error("Error sampling metrics: %s", e, exc_info=True)
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def _write_csv(self, now, rows):
+        if self._csv is None:
+            new_file = not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0
+            self._csv = open(self.csv_path, "a", encoding="utf-8", newline="")
+            if new_file:
+                self._csv.write(",".join(["timestamp", "tile"] + self.KEYS) + "\n")
+        for index, values in rows:
+            fields = [f"{now:.3f}", str(index + 1)] + ["" if values[k] is None else str(values[k]) for k in self.KEYS]
+            self._csv.write(",".join(fields) + "\n")
+        self._csv.flush()
+
+    def _write_prometheus(self, rows):
+        lines = []
+        for key, prop, convert, name, kind, help_text in self.METRICS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for index, values in rows:
+                if values[key] is not None:
+                    lines.append(f'{name}{{tile="{index + 1}"}} {float(values[key])}')
+        # 読み取り側が書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        tmp_path = self.prom_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+
+class QualityController:
+    # 処理が追いつかずフレームが落ち始めたら、フォーカスしていないタイルから段階的に画質を下げ、
+    # 負荷が下がったら1段階ずつ戻す。フォーカス中のタイルは常に最高画質のまま。Tkにもmpvにも依存しない
+    # 段階ごとのデコーダー設定 (ループフィルタの省略、参照されないフレームのデコード省略) と表示レートの上限
+    LEVELS = [
+        dict(options={'vd-lavc-skiploopfilter': 'default', 'vd-lavc-skipframe': 'default'}, fps_divisor=1),
+        dict(options={'framedrop': 'decoder+vo', 'vd-lavc-skiploopfilter': 'nonref', 'vd-lavc-skipframe': 'default'}, fps_divisor=1),
+        dict(options={'framedrop': 'decoder+vo', 'vd-lavc-skiploopfilter': 'all', 'vd-lavc-skipframe': 'default'}, fps_divisor=2),
+        dict(options={'framedrop': 'decoder+vo', 'vd-lavc-skiploopfilter': 'all', 'vd-lavc-skipframe': 'nonref'}, fps_divisor=2),
+    ]
+
+    def __init__(self, drop_threshold=2.0, recover_threshold=0.5, degrade_interval=2.0, recover_after=5.0):
+        self.drop_threshold = drop_threshold  # 1秒あたりこれ以上フレームが落ちたら負荷が高いとみなす
+        self.recover_threshold = recover_threshold  # これを下回る状態が続いたら画質を戻す
+        self.degrade_interval = degrade_interval
+        self.recover_after = recover_after
+        self.levels = {}  # index -> 段階
+        self._last_change = 0.0
+        self._last_recover = None
+        self._calm_since = None
+        self._backoff = 1  # 戻した直後にまた下げることになった場合は、次に戻すまでの時間を延ばす
+
+    def level(self, index):
+        return self.levels.get(index, 0)
+
+    def forget(self, index):
+        self.levels.pop(index, None)
+
+    def pressure(self, latest, focus):
+        # 画質を下げていないタイルとフォーカス中のタイルのフレーム落ち (秒あたり) の最大値。
+        # 画質を下げたタイルは意図的にフレームを捨てているので数えない
+        worst = 0.0
+        for index, (values, rates) in latest.items():
+            if self.level(index) and index != focus:
+                continue
+            worst = max(worst, sum(rates.get(k) or 0.0 for k in ("vo_drops", "decoder_drops", "delayed")))
+        return worst
+
+    def update(self, now, latest, focus, active):
+        # latest: MetricsCollector.latest()、active: 再生対象のタイル。変更した {index: 段階} を返す
+        changes = {}
+        for index in list(self.levels):
+            if index not in active or index == focus:
+                if self.levels.pop(index):
+                    changes[index] = 0
+        pressure = self.pressure(latest, focus)
+        secondary = [i for i in active if i != focus]
+        if pressure >= self.drop_threshold:
+            self._calm_since = None
+            if now - self._last_change >= self.degrade_interval:
+                # 最も画質の高いフォーカス外のタイルを1段階下げる
+                candidates = [i for i in secondary if self.level(i) < len(self.LEVELS) - 1]
+                if candidates:
+                    index = min(candidates, key=lambda i: (self.level(i), -i))
+                    self.levels[index] = changes[index] = self.level(index) + 1
+                    if self._last_recover is not None and now - self._last_recover < self.recover_after * 2:
+                        self._backoff = min(self._backoff * 2, 12)
+                    self._last_change = now
+                    decode_log.info("Overload (%.1f drops/s): degraded P%d to quality level %d",
+                                    pressure, index + 1, self.levels[index])
+        elif pressure < self.recover_threshold:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif min(now - self._calm_since, now - self._last_change) >= self.recover_after * self._backoff:
+                # 最も画質を下げたタイルを1段階戻す
+                degraded = [i for i in self.levels if self.levels[i] > 0]
+                if degraded:
+                    index = max(degraded, key=lambda i: (self.levels[i], i))
+                    self.levels[index] -= 1
+                    changes[index] = self.levels[index]
+                    if not self.levels[index]:
+                        del self.levels[index]
+                    self._last_change = self._last_recover = now
+                    decode_log.info("Load subsided (%.1f drops/s for %.0fs): restored P%d to quality level %d",
+                                    pressure, now - self._calm_since, index + 1, changes[index])
+                elif now - self._calm_since >= self.recover_after * 12:
+                    self._backoff = 1  # 長く安定していたら待ち時間を元に戻す
+        else:
+            self._calm_since = None
+        return changes
+
+
+class PlayerSnapshot:
+    # プレーヤー差し替え時に引き継ぐ状態
+    def __init__(self, path, position, paused, volume, loop):
+        self.path = path
+        self.position = position
+        self.paused = paused
+        self.volume = volume
+        self.loop = loop
+
+
+class PlayerPool:
+    # タイルと同じ設定で初期化済みの待機用mpvインスタンスを保持し、復旧時に即座に差し替えられるようにする。
+    # ファイルを読み込んでいないmpvはデコーダーもGPUコンテキストも持たないので、待機中の負荷はほぼない。
+    def __init__(self, factory, size=1):
+        self.factory = factory  # () -> mpv.MPV (widなし)
+        self.size = size
+        self._standby = []
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._closed = False
+
+    def acquire(self):
+        with self._lock:
+            player = self._standby.pop() if self._standby else None
+        self.refill()
+        return player
+
+    def refill(self):
+        with self._lock:
+            if self._refilling or self._closed or len(self._standby) >= self.size:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name="PlayerPool", daemon=True).start()
+
+    def _refill(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or len(self._standby) >= self.size:
+                        break
+                started = time.perf_counter()
+                try:
+                    player = self.factory()
+                except Exception as e:
+                    player_log.warning("Failed to create standby player: %s", e)
+                    break
+                with self._lock:
+                    closed = self._closed
+                    if not closed:
+                        self._standby.append(player)
+                if closed:
+                    player.terminate()
+                    break
+                player_log.info("Standby player ready in %.0fms", (time.perf_counter() - started) * 1000)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            players, self._standby = self._standby, []
+        for player in players:
+            player.terminate()
+
+
+def bind_window(player, wid):
+    # 作成済みのmpv (待機用・先読み用) の描画先を設定する。widはVOの初期化時にしか読まれないので、
+    # 既にVOがある場合は映像トラックを一度外して付け直し、新しいウィンドウでVOを作り直させる
+    player['wid'] = str(wid)
+    if player['vo-configured']:
+        vid = player.vid
+        if vid not in (None, False, 'no'):
+            player.vid = 'no'
+            player.vid = vid
+        player_log.debug("Reinitialized video output for window %s", wid)
+
+
+class SharedState:
+    # ワーカーモードで全プロセスが共有するメモリ。ワーカーごとのスロットに、ワーカーが書く状態 (ハートビート、
+    # 観測時刻付きのtime-pos、duration、フラグ) と、アプリが書くコマンド (pause/speed) を置く。
+    # どちらも書き込むのは1プロセスだけなので、ロックの代わりにシーケンス番号で書き込み途中の読み取りを防ぐ (seqlock)。
+    # 時刻はtime.monotonic()で、全プロセスに共通の時計として比べられる
+    STATE = struct.Struct("<QQQQdddd")  # seq, flags, pause_ack, speed_ack, heartbeat, observed, time_pos, duration
+    COMMAND = struct.Struct("<QQQdQQd")  # seq, pause_seq, pause_after, pause, speed_seq, speed_after, speed
+    SLOT_SIZE = 128
+    POSITION, DURATION, PAUSED, IDLE, EOF = 1, 2, 4, 8, 16
+    HEARTBEAT = 0.5  # 状態が変わらなくてもワーカーがハートビートを書き直す間隔 (秒)
+
+    def __init__(self, slots=0, name=None):
+        if name:
+            self.shm = multiprocessing.shared_memory.SharedMemory(name=name, track=False)  # ワーカー側は削除しない
+        else:
+            self.shm = multiprocessing.shared_memory.SharedMemory(create=True, size=slots * self.SLOT_SIZE)
+        self.name = self.shm.name
+        self._free = list(range(slots))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if not self._free:
+                raise RuntimeError("no free player worker slot")
+            slot = self._free.pop(0)
+        self.write_state(slot, 0, 0, 0, time.monotonic(), 0.0, 0.0, 0.0)
+        self.write_commands(slot, 0, 0, 0.0, 0, 0, 0.0)
+        return slot
+
+    def release(self, slot):
+        with self._lock:
+            if slot not in self._free:
+                self._free.append(slot)
+
+    def _write(self, offset, layout, values):
+        seq = struct.unpack_from("<Q", self.shm.buf, offset)[0] | 1  # 奇数の間は書き込み中
+        struct.pack_into("<Q", self.shm.buf, offset, seq)
+        layout.pack_into(self.shm.buf, offset, seq, *values)
+        struct.pack_into("<Q", self.shm.buf, offset, seq + 1)
+
+    def _read(self, offset, layout):
+        for _ in range(1000):  # 書き込み中に終了したワーカーのスロットで止まらないよう回数を限る
+            values = layout.unpack_from(self.shm.buf, offset)
+            if not values[0] & 1 and struct.unpack_from("<Q", self.shm.buf, offset)[0] == values[0]:
+                break
+        return values[1:]
+
+    def write_state(self, slot, *values):
+        self._write(slot * self.SLOT_SIZE, self.STATE, values)
+
+    def read_state(self, slot):
+        return self._read(slot * self.SLOT_SIZE, self.STATE)
+
+    def write_commands(self, slot, *values):
+        self._write(slot * self.SLOT_SIZE + self.STATE.size, self.COMMAND, values)
+
+    def read_commands(self, slot):
+        return self._read(slot * self.SLOT_SIZE + self.STATE.size, self.COMMAND)
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def run_player_worker(conn, state_name, slot, options):
+    # ワーカーモードで1台のmpvを動かす子プロセス。パイプで受けた設定・コマンドを順に実行し、
+    # 状態は共有メモリのスロットに書き、監視を頼まれたプロパティとイベントはパイプで送り返す
+    state = SharedState(name=state_name)
+    send_lock = threading.Lock()
+    state_lock = threading.Lock()
+    status = {'flags': 0, 'acks': [0, 0], 'observed': 0.0, 'time-pos': 0.0, 'duration': 0.0}
+    shutdown = threading.Event()
+
+    def send(*message):
+        with send_lock:
+            conn.send(message)
+
+    def publish():
+        with state_lock:
+            state.write_state(slot, status['flags'], status['acks'][0], status['acks'][1], time.monotonic(),
+                              status['observed'], status['time-pos'], status['duration'])
+
+    def on_property(name, value):
+        bit = {'time-pos': SharedState.POSITION, 'duration': SharedState.DURATION, 'pause': SharedState.PAUSED,
+               'idle-active': SharedState.IDLE, 'eof-reached': SharedState.EOF}[name]
+        with state_lock:
+            status['flags'] = status['flags'] | bit if value not in (None, False) else status['flags'] & ~bit
+            if name in ('time-pos', 'duration') and value is not None:
+                status[name] = value
+                status['observed'] = time.monotonic()
+        publish()
+
+    def on_event(event):
+        eid = event.event_id.value
+        if eid == mpv.MpvEventID.SHUTDOWN:
+            shutdown.set()
+        elif eid in (mpv.MpvEventID.START_FILE, mpv.MpvEventID.FILE_LOADED, mpv.MpvEventID.PLAYBACK_RESTART,
+                     mpv.MpvEventID.END_FILE):
+            data = event.data
+            send("event", eid, (data.reason, data.error) if eid == mpv.MpvEventID.END_FILE else None)
+
+    try:
+        player = load_mpv().MPV(log_handler=lambda level, component, message: send("log", level, component, message),
+                                **options)
+    except Exception as e:
+        send("failed", str(e))
+        state.close()
+        return
+    for name in ('time-pos', 'duration', 'pause', 'idle-active', 'eof-reached'):
+        player.observe_property(name, on_property)
+    player.register_event_callback(on_event)
+    send("ready", player.mpv_version)
+
+    observers = {}
+    handled = 0  # 処理したパイプのメッセージ数。共有メモリのコマンドはこれより前に送られたメッセージの後に適用する
+    applied = [0, 0]
+    published = 0.0
+    try:
+        while not shutdown.is_set():
+            pause_seq, pause_after, pause, speed_seq, speed_after, speed = state.read_commands(slot)
+            changed = False
+            for k, (seq, after, name, value) in enumerate(((pause_seq, pause_after, 'pause', bool(pause)),
+                                                            (speed_seq, speed_after, 'speed', speed))):
+                if seq != applied[k] and after <= handled:
+                    try:
+                        setattr(player, name, value)
+                    except Exception as e:
+                        send("error", f"set {name}: {e}")
+                    applied[k] = status['acks'][k] = seq
+                    changed = True
+            # 状態はプロパティが変わるたびにon_propertyが書くので、ここではコマンドの受理とハートビートだけを書く
+            now = time.monotonic()
+            if changed or now - published >= SharedState.HEARTBEAT:
+                publish()
+                published = now
+            # 共有メモリのコマンドを書いたアプリは"wake"を送るので、パイプを待つだけでよい (待機中のワーカーは起きない)
+            if not conn.poll(max(0.0, published + SharedState.HEARTBEAT - time.monotonic())):
+                continue
+            kind, *args = conn.recv()
+            handled += 1
+            if kind == "terminate":
+                break
+            if kind == "wake":
+                continue
+            request_id = None
+            try:
+                if kind == "set":
+                    setattr(player, *args)
+                elif kind == "setitem":
+                    player[args[0]] = args[1]
+                elif kind == "get":
+                    request_id, name = args
+                    send("reply", request_id, True, getattr(player, name))
+                elif kind == "getitem":
+                    request_id, name = args
+                    send("reply", request_id, True, player[name])
+                elif kind == "call":
+                    method, call_args, call_kwargs = args
+                    getattr(player, method)(*call_args, **call_kwargs)
+                elif kind == "observe":
+                    observers[args[0]] = lambda name, value: send("property", name, value)
+                    player.observe_property(args[0], observers[args[0]])
+                elif kind == "unobserve" and args[0] in observers:
+                    player.unobserve_property(args[0], observers.pop(args[0]))
+            except Exception as e:
+                if request_id is not None:
+                    send("reply", request_id, False, str(e))
+                else:
+                    send("error", f"{kind} {args[0] if args else ''}: {e}")
+                if getattr(player, 'core_shutdown', False):
+                    break
+    except (EOFError, OSError):
+        pass  # アプリが終了した
+    finally:
+        player.terminate()
+        state.close()
+
+
+class RemotePlayer:
+    # ワーカーモードでmpv.MPVの代わりに使う代理オブジェクト。mpvは別プロセスのrun_player_workerで動き、
+    # タイルのウィンドウIDに描画する。time-pos/duration/pause/idle-active/eof-reachedは共有メモリから読み、
+    # それ以外の読み取りはパイプで問い合わせる (timeoutで打ち切るので、止まったワーカーがUIを止めない)。
+    # pause/speedは共有メモリのコマンドとして、その他の設定やコマンドはパイプで応答を待たずに送る
+    SHARED = {'time_pos': SharedState.POSITION, 'duration': SharedState.DURATION,
+              'idle_active': SharedState.IDLE, 'eof_reached': SharedState.EOF}
+
+    def __init__(self, state, options, on_exit=None, timeout=1.0, start_timeout=15.0):
+        options = dict(options)
+        self._log_handler = options.pop('log_handler', None)
+        self._state = state
+        self._slot = state.acquire()
+        self._on_exit = on_exit  # ワーカーが予期せず終了した時に呼ぶ (受信スレッドから)
+        self._timeout = timeout
+        self._send_lock = threading.Lock()
+        self._command_lock = threading.Lock()
+        self._commands = [0, 0, 0.0, 0, 0, 0.0]  # SharedState.COMMANDのseq以外
+        self._sent = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()  # _repliesと_observers (受信スレッドと呼び出し側のスレッドの両方が触る)
+        self._replies = {}
+        self._observers = collections.defaultdict(list)
+        self._event_callbacks = []
+        self._closing = False
+        self._dead = False
+        context = multiprocessing.get_context("spawn")  # Tkやmpvのスレッドを抱えたままforkしない
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=run_player_worker, args=(child_conn, state.name, self._slot, options),
+                                        name=f"PlayerWorker-{self._slot}", daemon=True)
+        started = time.perf_counter()
+        self._process.start()
+        child_conn.close()
+        try:
+            if not self._conn.poll(start_timeout):
+                raise TimeoutError("player worker did not start")
+            kind, detail = self._conn.recv()
+            if kind != "ready":
+                raise RuntimeError(detail)
+        except Exception as e:
+            self._dead = True
+            self._process.kill()
+            self._conn.close()
+            state.release(self._slot)
+            raise RuntimeError(f"player worker failed: {e or 'exited'}") from None
+        self._mpv_version = detail
+        threading.Thread(target=self._receive, name=f"PlayerWorker-{self._slot}", daemon=True).start()
+        player_log.debug("Player worker %s (pid %s) started in %.0fms",
+                         self._slot, self._process.pid, (time.perf_counter() - started) * 1000)
+
+    @property
+    def core_shutdown(self):
+        return self._dead
+
+    @property
+    def mpv_version(self):
+        return self._mpv_version
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._request("get", name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        elif name in ('pause', 'speed'):
+            self._command(name, value)
+        else:
+            self._post("set", name, value)
+
+    def __getitem__(self, name):
+        return self._request("getitem", name)
+
+    def __setitem__(self, name, value):
+        self._post("setitem", name, value)
+
+    @property
+    def time_pos(self):
+        return self._shared('time_pos')
+
+    @property
+    def duration(self):
+        return self._shared('duration')
+
+    @property
+    def idle_active(self):
+        return self._shared('idle_active')
+
+    @property
+    def eof_reached(self):
+        return self._shared('eof_reached')
+
+    @property
+    def pause(self):
+        flags, pause_ack, *_ = self._state.read_state(self._slot)
+        if pause_ack != self._commands[0]:
+            return bool(self._commands[2])  # ワーカーがまだ適用していない
+        return bool(flags & SharedState.PAUSED)
+
+    @property
+    def speed(self):
+        # speedはこのオブジェクトからしか変えないので、設定済みならその値を返す
+        return self._commands[5] if self._commands[3] else self._request("get", "speed")
+
+    def _shared(self, name):
+        if self._dead:
+            raise RuntimeError("player worker has exited")
+        flags, _, _, _, _, time_pos, duration = self._state.read_state(self._slot)
+        if not flags & self.SHARED[name]:
+            return None if name in ('time_pos', 'duration') else False
+        return {'time_pos': time_pos, 'duration': duration}.get(name, True)
+
+    def observed_at(self):
+        # time-posを観測した時刻 (time.monotonic)
+        return self._state.read_state(self._slot)[4]
+
+    def stalled(self, limit):
+        # ワーカーのループがlimit秒以上止まっている
+        return not self._dead and time.monotonic() - self._state.read_state(self._slot)[3] > limit
+
+    def _command(self, name, value):
+        with self._command_lock:
+            with self._send_lock:
+                after = self._sent
+            base = 0 if name == 'pause' else 3
+            self._commands[base:base + 3] = [self._commands[base] + 1, after, float(value)]
+            self._state.write_commands(self._slot, *self._commands)
+        self._post("wake")  # パイプで待っているワーカーを起こす
+
+    def _post(self, kind, *args):
+        if self._dead:
+            raise RuntimeError("player worker has exited")
+        with self._send_lock:
+            self._conn.send((kind, *args))
+            self._sent += 1
+
+    def _request(self, kind, name):
+        request_id = next(self._ids)
+        reply = [threading.Event(), False, None]
+        with self._lock:
+            self._replies[request_id] = reply
+        try:
+            self._post(kind, request_id, name)
+            if not reply[0].wait(self._timeout):
+                raise TimeoutError(f"player worker {self._slot} did not answer {name}")
+        finally:
+            with self._lock:
+                self._replies.pop(request_id, None)
+        if not reply[1]:
+            raise RuntimeError(reply[2] or "player worker has exited")
+        return reply[2]
+
+    def _call(self, method, *args, **kwargs):
+        self._post("call", method, args, kwargs)
+
+    def loadfile(self, *args, **kwargs):
+        self._call("loadfile", *args, **kwargs)
+
+    def seek(self, *args, **kwargs):
+        self._call("seek", *args, **kwargs)
+
+    def command(self, *args):
+        self._call("command", *args)
+
+    def command_async(self, *args):
+        self._call("command_async", *args)
+
+    def observe_property(self, name, handler):
+        with self._lock:
+            first = not self._observers[name]
+            self._observers[name].append(handler)
+        if first:
+            self._post("observe", name)
+
+    def unobserve_property(self, name, handler):
+        with self._lock:
+            self._observers[name].remove(handler)
+            last = not self._observers[name]
+        if last and not self._dead:
+            self._post("unobserve", name)
+
+    def register_event_callback(self, callback):
+        self._event_callbacks.append(callback)
+
+    def kill(self):
+        # 応答しなくなったワーカーを強制終了する。受信スレッドが終了を検出してon_exitを呼ぶ
+        self._process.kill()
+
+    def terminate(self):
+        self._closing = True
+        if not self._dead:
+            try:
+                self._post("terminate")
+            except Exception:
+                pass
+        self._process.join(timeout=3.0)
+        if self._process.is_alive():
+            player_log.warning("Player worker %s did not exit, killing it", self._slot)
+            self._process.kill()
+            self._process.join(timeout=1.0)
+
+    def _receive(self):
+        try:
+            while True:
+                kind, *args = self._conn.recv()
+                if kind == "reply":
+                    with self._lock:
+                        reply = self._replies.get(args[0])
+                    if reply:
+                        reply[1:] = args[1:]
+                        reply[0].set()
+                elif kind == "property":
+                    with self._lock:
+                        handlers = list(self._observers.get(args[0], ()))
+                    for handler in handlers:
+                        handler(*args)
+                elif kind == "event":
+                    eid, end = args
+                    event = types.SimpleNamespace(event_id=types.SimpleNamespace(value=eid), data=end and
+                                                  types.SimpleNamespace(reason=end[0], error=end[1]))
+                    for callback in list(self._event_callbacks):
+                        callback(event)
+                elif kind == "log" and self._log_handler:
+                    self._log_handler(*args)
+                elif kind == "error":
+                    player_log.warning("Player worker %s: %s", self._slot, args[0])
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            player_log.error("Error in player worker %s receiver: %s", self._slot, e, exc_info=True)
+        self._dead = True
+        with self._lock:
+            replies = list(self._replies.values())
+        for reply in replies:
+            reply[0].set()
+        self._process.join(timeout=3.0)
+        self._conn.close()
+        self._state.release(self._slot)
+        if not self._closing:
+            player_log.error("Player worker %s (pid %s) exited with code %s",
+                             self._slot, self._process.pid, self._process.exitcode)
+            if self._on_exit:
+                self._on_exit(self)
+
+
+def parse_rate(text):
+    # ffprobeの "30000/1001" 形式のフレームレート
+    try:
+        num, _, den = str(text).partition("/")
+        rate = float(num) / float(den or 1)
+        return rate if rate > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def track_counts(media):
+    # 合成モード・書き出しで使う (映像トラック数, 音声トラック数)。ffprobeで調べていない情報 (以前のキャッシュや
+    # プレーヤーから得たもの) は映像1本とみなし、音声は使わない
+    media = media or {}
+    videos = media.get('video_tracks')
+    return (1 if videos is None else videos), len(media.get('audio') or [])
+
+
+def media_summary(media):
+    # タイルのラベルに表示する1行の説明
+    parts = []
+    if media.get('width') and media.get('height'):
+        parts.append(f"{media['width']}x{media['height']}")
+    if media.get('codec'):
+        parts.append(media['codec'])
+    if media.get('fps'):
+        parts.append(f"{media['fps']:.3g}fps")
+    if media.get('audio'):
+        parts.append(f"{len(media['audio'])} audio")
+    if media.get('duration'):
+        parts.append(format_time(media['duration']))
+    return " ".join(parts)
+
+
+class MediaProbe:
+    # 動画の長さ・解像度・fps・コーデック・音声トラックを、プレーヤーに読み込む前にffprobeで調べる。
+    # 結果はパス・サイズ・更新時刻をキーにして保存するので、一度調べたファイルは二度と調べない
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+        self.cache = JsonCache("media_probe.json")
+        self.ffprobe = shutil.which("ffprobe")
+        self._running = set()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="Probe")
+
+    def cached(self, path):
+        try:
+            return self.cache.get(media_key(path))
+        except OSError:
+            return None
+
+    def request(self, path, on_ready):
+        # キャッシュにあればすぐにon_ready(path, media)を呼ぶ。なければバックグラウンドで調べてUIスレッドで呼ぶ
+        media = self.cached(path)
+        if media is not None:
+            on_ready(path, media)
+            return
+        if not self.ffprobe:
+            return  # 読み込み後にremember()でプレーヤーから得た情報を保存する
+        def deliver(future):
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                self.dispatch(on_ready, path, future.result())
+        self._executor.submit(self._probe, path).add_done_callback(deliver)
+
+    def probe(self, path):
+        # キャッシュになければその場で調べる。UIスレッド以外から呼ぶ
+        media = self.cached(path)
+        if media is None and self.ffprobe:
+            media = self._probe(path)
+        return media
+
+    def remember(self, path, media):
+        # ffprobeがない環境では、プレーヤーで読み込んだ時の情報を保存しておく
+        try:
+            key = media_key(path)
+        except OSError:
+            return
+        if self.cache.get(key) is None:
+            self.cache.put(key, media)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        stop_tools(self._running)
+
+    def _probe(self, path):
+        started = time.perf_counter()
+        try:
+            key = media_key(path)
+            output = run_tool([self.ffprobe, "-v", "error", "-show_entries",
+                               "format=duration,bit_rate:stream=index,codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,channels,sample_rate",
+                               "-of", "json", path], timeout=30, running=self._running)
+            data = json.loads(output.decode("utf-8", "replace"))
+        except Exception as e:
+            media_log.error("Error probing %s: %s", path, e)
+            return None
+        media = dict(duration=None, width=None, height=None, fps=None, codec=None, bitrate=None, audio=[],
+                     video_tracks=0)
+        try:
+            media['duration'] = float(data.get('format', {}).get('duration'))
+        except (TypeError, ValueError):
+            pass
+        try:
+            media['bitrate'] = int(data.get('format', {}).get('bit_rate'))
+        except (TypeError, ValueError):
+            pass
+        for stream in data.get('streams', []):
+            if stream.get('codec_type') == 'video':
+                media['video_tracks'] += 1  # mpvと同じく、カバー画像などの静止画も映像トラックとして数える
+            if stream.get('codec_type') == 'video' and media['codec'] is None:
+                media.update(codec=stream.get('codec_name'), width=stream.get('width'), height=stream.get('height'),
+                             fps=parse_rate(stream.get('avg_frame_rate')) or parse_rate(stream.get('r_frame_rate')))
+            elif stream.get('codec_type') == 'audio':
+                media['audio'].append(dict(codec=stream.get('codec_name'), channels=stream.get('channels'),
+                                           sample_rate=stream.get('sample_rate')))
+        self.cache.put(key, media)
+        media_log.info("Probed %s in %.0fms: %s",
+                       os.path.basename(path), (time.perf_counter() - started) * 1000, media_summary(media))
+        return media
+
+
+class ThumbnailIndex:
+    # 1ファイル分のキーフレーム位置と縮小画像の一覧
+    def __init__(self, directory, duration, interval, keyframes, count):
+        self.directory = directory
+        self.duration = duration
+        self.interval = interval  # 縮小画像の間隔 (秒)
+        self.keyframes = keyframes  # キーフレームの時刻 (昇順)
+        self.count = count
+
+    def thumbnail_path(self, position):
+        if not self.count:
+            return None
+        n = min(max(int(position / self.interval), 0), self.count - 1)
+        return os.path.join(self.directory, f"{n + 1:04d}.png")
+
+    def keyframe_before(self, position):
+        # position以前の最も近いキーフレーム
+        i = bisect.bisect_right(self.keyframes, position)
+        return self.keyframes[i - 1] if i else None
+
+    def to_json(self):
+        return dict(duration=self.duration, interval=self.interval, keyframes=self.keyframes, count=self.count)
+
+
+class ThumbnailCache:
+    # ドロップされたファイルのキーフレーム一覧と縮小画像をバックグラウンドで作成する。
+    # メモリ上のLRUとディスク上のキャッシュ (パス・サイズ・更新時刻ごと) の両方に保持し、ディスクは合計サイズで制限する
+    THUMB_WIDTH = 160
+    MAX_THUMBS = 120
+
+    def __init__(self, dispatch, max_bytes=256 * 1024 * 1024, memory_entries=32, workers=2):
+        self.dispatch = dispatch
+        self.directory = os.path.join(cache_dir(), "thumbnails")
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.ffprobe = shutil.which("ffprobe")
+        self.available = bool(self.ffmpeg and self.ffprobe)
+        self._entries = collections.OrderedDict()  # key -> ThumbnailIndex
+        self._jobs = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._running = set()  # 実行中のffmpeg/ffprobe
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Thumbnail")
+        if not self.available:
+            media_log.info("ffmpeg/ffprobe not found on PATH, slider previews are disabled")
+
+    def get(self, key):
+        # UIスレッドから呼ぶ。メモリにあるものだけを返す
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def request(self, path, on_ready=None):
+        # 作成済みならすぐにon_ready(key, index)を呼ぶ。まだならワーカーで作成してからUIスレッドで呼ぶ
+        if not self.available:
+            return None
+        try:
+            key = media_key(path)
+        except OSError as e:
+            media_log.warning("Cannot index %s: %s", path, e)
+            return None
+        entry = self.get(key)
+        if entry is not None:
+            if on_ready:
+                on_ready(key, entry)
+            return key
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._executor.submit(self._build, key, path)
+                self._jobs[key] = job
+        if on_ready:
+            def deliver(future):
+                if not future.cancelled() and future.exception() is None:
+                    self.dispatch(on_ready, key, future.result())
+            job.add_done_callback(deliver)
+        return key
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        stop_tools(self._running)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.memory_entries:
+                self._entries.popitem(last=False)
+            self._jobs.pop(key, None)
+
+    def _build(self, key, path):
+        directory = os.path.join(self.directory, key)
+        index_path = os.path.join(directory, "index.json")
+        try:
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                os.utime(index_path)  # ディスク上のLRU用に最終利用時刻を更新
+                entry = ThumbnailIndex(directory, data["duration"], data["interval"], data["keyframes"], data["count"])
+                media_log.info("Thumbnails for %s loaded from cache", os.path.basename(path))
+            except (FileNotFoundError, ValueError, KeyError):
+                entry = self._extract(path, directory, index_path)
+            self._remember(key, entry)
+            return entry
+        except Exception as e:
+            with self._lock:
+                self._jobs.pop(key, None)
+            media_log.error("Error building thumbnails for %s: %s", path, e)
+            raise
+
+    def _extract(self, path, directory, index_path):
+        started = time.perf_counter()
+        # パケット一覧からキーフレームの時刻を取り出す (デコードしないので速い)
+        output = run_tool([self.ffprobe, "-v", "error", "-select_streams", "v:0",
+                           "-show_entries", "packet=pts_time,flags:format=duration", "-of", "csv=p=0", path],
+                          running=self._running)
+        keyframes, duration = [], None
+        for line in output.decode("utf-8", "replace").splitlines():
+            fields = line.strip().split(",")
+            try:
+                if len(fields) >= 2 and "K" in fields[1]:
+                    keyframes.append(float(fields[0]))
+                elif len(fields) == 1 and fields[0]:
+                    duration = float(fields[0])
+            except ValueError:
+                continue
+        keyframes.sort()
+        duration = duration or (keyframes[-1] if keyframes else 0.0)
+        interval = max(duration / self.MAX_THUMBS, 1.0)
+        os.makedirs(directory, exist_ok=True)
+        # キーフレームだけをデコードして一定間隔の縮小画像を作る。再生側のCPUを奪わないよう1スレッドで実行
+        run_tool([self.ffmpeg, "-v", "error", "-threads", "1", "-skip_frame", "nokey", "-i", path,
+                  "-an", "-sn", "-vf", f"fps=1/{interval:.3f},scale={self.THUMB_WIDTH}:-2",
+                  "-frames:v", str(self.MAX_THUMBS), "-y", os.path.join(directory, "%04d.png")],
+                 timeout=600, running=self._running)
+        count = len([name for name in os.listdir(directory) if name.endswith(".png")])
+        entry = ThumbnailIndex(directory, duration, interval, keyframes, count)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry.to_json(), f)
+        os.replace(tmp_path, index_path)
+        media_log.info("Built %s thumbnails and %s keyframes for %s in %.1fs",
+                       count, len(keyframes), os.path.basename(path), time.perf_counter() - started)
+        self._trim_disk()
+        return entry
+
+    def _trim_disk(self):
+        # 合計サイズが上限を超えたら、最後に使われた時刻が古いものから削除する
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+                used = os.path.getmtime(os.path.join(directory, "index.json"))
+            except OSError:
+                continue
+            entries.append((used, size, name, directory))
+            total += size
+        for used, size, name, directory in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                if name in self._entries or name in self._jobs:
+                    continue
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+
+def lower_worker_priority():
+    # 画質比較のワーカープロセスの初期化。再生の邪魔にならないよう優先度を下げる
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+
+def box_mean(frames, size):
+    # (枚数, 高さ, 幅) の配列の各画素について、size x sizeの窓の平均を積分画像で求める (窓が収まる範囲だけ)
+    import numpy as np
+    total = np.pad(frames.cumsum(1, dtype=np.float64).cumsum(2), ((0, 0), (1, 0), (1, 0)))
+    window = total[:, size:, size:] - total[:, :-size, size:] - total[:, size:, :-size] + total[:, :-size, :-size]
+    return (window / (size * size)).astype(np.float32)
+
+
+def frame_ssim(x, y, size=7):
+    # フレームごとのSSIM。7x7の一様窓で、定数は8bitの画素値に対する標準的な値
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my = box_mean(x, size), box_mean(y, size)
+    vx = box_mean(x * x, size) - mx * mx
+    vy = box_mean(y * y, size) - my * my
+    cxy = box_mean(x * y, size) - mx * my
+    ssim = ((2 * mx * my + c1) * (2 * cxy + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    return ssim.mean(axis=(1, 2))
+
+
+def compare_frames(reference, others, height, width):
+    # プロセスプールのワーカーで実行する。referenceとothersの値は同じ大きさのグレースケールの生フレームを連結したbytes。
+    # {タイル番号: (PSNRのリスト, SSIMのリスト)} を返す。PSNRは完全に一致したフレームを100dBとする
+    import numpy as np
+    ref = np.frombuffer(reference, np.uint8).reshape(-1, height, width).astype(np.float32)
+    results = {}
+    for index, data in others.items():
+        dist = np.frombuffer(data, np.uint8).reshape(-1, height, width).astype(np.float32)
+        r = ref[:len(dist)]
+        mse = ((r - dist) ** 2).mean(axis=(1, 2))
+        psnr = np.where(mse > 0, 10 * np.log10(255.0 ** 2 / np.maximum(mse, 1e-10)), 100.0)
+        results[index] = (psnr.tolist(), frame_ssim(r, dist).tolist())
+    return results
+
+
+class QualityCurve:
+    # 1タイル分のフレームごとのPSNR/SSIM
+    def __init__(self):
+        self.psnr = []
+        self.ssim = []
+
+    def summary(self):
+        if not self.psnr:
+            return "no frames"
+        return (f"PSNR avg {sum(self.psnr) / len(self.psnr):.2f} dB (min {min(self.psnr):.2f}), "
+                f"SSIM avg {sum(self.ssim) / len(self.ssim):.4f} (min {min(self.ssim):.4f})")
+
+
+def curve_points(values, fps, duration, width, height, low, high):
+    # フレームごとの値をキャンバスの座標列にする。1画素に複数のフレームが入る場合は最小値 (画質の落ち込み) を使う
+    buckets = {}
+    for i, value in enumerate(values):
+        x = min(width - 1, int(i / fps / duration * width))
+        if x not in buckets or value < buckets[x]:
+            buckets[x] = value
+    points = []
+    for x in sorted(buckets):
+        points += [x, height - (min(max(buckets[x], low), high) - low) / (high - low) * height]
+    return points
+
+
+class QualityAnalyzer:
+    # 1つ目のファイルを基準に、他のファイルのフレームごとのPSNR/SSIM (輝度) を求める。
+    # デコード: ファイルごとのffmpegが縮小したグレースケールの生フレームをパイプに出し、読み取りスレッドがBATCH枚ずつキューに入れる。
+    # 比較: 全ファイルのBATCH枚をまとめてプロセスプールでNumPyの配列演算にかける。
+    # 集計: 終わった順ではなくフレーム順に結果をタイルごとのQualityCurveに追加する。
+    # キューと処理中の数に上限があるので、長いファイルでもメモリは一定に収まる。Tkには依存しない
+    BATCH = 16
+
+    def __init__(self, workers=None):
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.available = bool(self.ffmpeg) and importlib.util.find_spec("numpy") is not None
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.curves = {}  # タイル番号 -> QualityCurve
+        self.fps = None
+        self.frames = 0  # 集計済みのフレーム数
+        self.elapsed = 0.0
+        self.running = False
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._processes = set()
+        self._thread = None
+
+    def start(self, reference, others, fps, size, on_done=None):
+        # reference: 基準ファイルのパス、others: {タイル番号: パス}、size: 比較する (幅, 高さ)。
+        # 終わるとon_done(エラー)を解析スレッドから呼ぶ
+        self.cancel()
+        self._cancel = threading.Event()
+        with self._lock:
+            self.curves = {index: QualityCurve() for index in others}
+            self.fps = fps
+            self.frames = 0
+            self.elapsed = 0.0
+            self.running = True
+        self._thread = threading.Thread(target=self._run, args=(reference, others, fps, size, on_done, self._cancel),
+                                        name="QualityAnalysis", daemon=True)
+        self._thread.start()
+
+    def cancel(self, wait=True):
+        self._cancel.set()
+        stop_tools(self._processes)
+        if self._thread is not None and wait:
+            self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def snapshot(self):
+        # UIスレッドから呼ぶ。{タイル番号: (PSNRのリスト, SSIMのリスト)}
+        with self._lock:
+            return {index: (list(curve.psnr), list(curve.ssim)) for index, curve in self.curves.items()}
+
+    @staticmethod
+    def _put(batches, item, cancel):
+        # キューが一杯の間もキャンセルを確かめる (解析をやめた後に読み取りスレッドとffmpegが残らないように)
+        while not cancel.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @staticmethod
+    def _get(batches, cancel):
+        # キャンセルされたらNone (読み取りスレッドは終了の印を入れずに終わるため)
+        while not cancel.is_set():
+            try:
+                return batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _decode(self, path, fps, size, batches, cancel):
+        # 読み取りスレッド。batchesが一杯ならffmpegはパイプへの書き込みで待たされる
+        width, height = size
+        process = subprocess.Popen(
+            [self.ffmpeg, "-v", "error", "-nostdin", "-i", path, "-an", "-sn",
+             "-vf", f"fps={fps:.6f},scale={width}:{height}:flags=area,format=gray", "-f", "rawvideo", "-"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, **tool_priority())
+        self._processes.add(process)
+        try:
+            chunk = width * height * self.BATCH
+            while not cancel.is_set():
+                data = process.stdout.read(chunk)
+                if not data or not self._put(batches, data, cancel):
+                    break
+        finally:
+            self._put(batches, None, cancel)
+            process.stdout.close()  # 書き込み待ちのffmpegはパイプが閉じられて終了する
+            process.kill()
+            process.wait()
+            self._processes.discard(process)
+
+    def _run(self, reference, others, fps, size, on_done, cancel):
+        started = time.perf_counter()
+        width, height = size
+        frame_bytes = width * height
+        queues = {index: queue.Queue(maxsize=4) for index in [None] + list(others)}
+        paths = {None: reference, **others}  # Noneは基準のファイル
+        for index, batches in queues.items():
+            threading.Thread(target=self._decode, args=(paths[index], fps, size, batches, cancel),
+                             name=f"QualityDecode{'' if index is None else index}", daemon=True).start()
+        error = None
+        pending = collections.deque()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=lower_worker_priority) as pool:
+                active = set(others)
+                while active and not cancel.is_set():
+                    ref = self._get(queues[None], cancel)
+                    if ref is None:
+                        break
+                    count = len(ref) // frame_bytes
+                    if count == 0:
+                        break
+                    batch = {}
+                    for index in list(active):
+                        data = self._get(queues[index], cancel)
+                        # 基準より短いファイルは途中で終わるが、そのファイルの分だけ短くし、他のタイルは基準のまとまり全体と比べる
+                        # (全タイルの曲線の各点がフレーム番号、つまりスライダーの時刻と対応したままになるように)
+                        frames = min(count, len(data) // frame_bytes) if data else 0
+                        if frames == 0:
+                            active.discard(index)  # 終わったファイル (またはキャンセル)
+                            continue
+                        batch[index] = data[:frames * frame_bytes]
+                    if not batch:
+                        break
+                    pending.append(pool.submit(compare_frames, ref[:count * frame_bytes], batch, height, width))
+                    # 処理中のまとまりがワーカー数の2倍になったら、一番古いものの完了を待つ
+                    while pending and (len(pending) >= self.workers * 2 or pending[0].done()):
+                        self._aggregate(pending.popleft().result(), started)
+                while pending and not cancel.is_set():
+                    self._aggregate(pending.popleft().result(), started)
+                if cancel.is_set():
+                    pool.shutdown(wait=False, cancel_futures=True)
+        except Exception as e:
+            analysis_log.error("Quality analysis failed: %s", e, exc_info=True)
+            error = str(e)
+        finally:
+            cancel.set()  # 読み取りスレッドとffmpegを止める
+            for batches in queues.values():
+                while not batches.empty():
+                    batches.get_nowait()
+            stop_tools(self._processes)
+        with self._lock:
+            self.running = False
+            frames, elapsed = self.frames, self.elapsed
+        if error is None:
+            analysis_log.info("Analyzed %d frames x %d videos in %.1fs (%.1fx real time)", frames, len(others),
+                              elapsed, frames / fps / elapsed if elapsed else 0.0)
+        if on_done:
+            on_done(error)
+
+    def _aggregate(self, results, started):
+        with self._lock:
+            for index, (psnr, ssim) in results.items():
+                self.curves[index].psnr.extend(psnr)
+                self.curves[index].ssim.extend(ssim)
+            self.frames = max(len(curve.psnr) for curve in self.curves.values())
+            self.elapsed = time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+# 制御コマンドの引数と種類。末尾が "?" の引数は省略できる
+CONTROL_COMMANDS = {
+    "ping": {}, "state": {}, "play": {}, "pause": {}, "reset": {}, "profile": {},
+    "load": {"tile": "tile", "path": "path?", "paths": "paths?"},
+    "seek": {"position": "number"},
+    "seek_tile": {"tile": "tile", "position": "number"},
+    "loop": {"on": "bool"},
+    "mute": {"on": "bool"},
+    "volume": {"tile": "tile", "value": "number"},
+    "step": {"frames": "int"},
+    "shuttle": {"speed": "direction"},
+    "layout": {"mode": "mode"},
+    "set": {"step": "int"},
+}
+
+
+def control_error(command, tile_count, layout_modes):
+    # 1つのコマンドを検証し、不正ならエラーメッセージを返す。バッチは実行前に全コマンドをこれで調べる
+    if not isinstance(command, dict) or command.get("cmd") not in CONTROL_COMMANDS:
+        return f"unknown command {command.get('cmd') if isinstance(command, dict) else command!r}"
+    name = command["cmd"]
+    for arg, kind in CONTROL_COMMANDS[name].items():
+        if arg not in command:
+            if kind.endswith("?"):
+                continue
+            return f"{name}: missing {arg}"
+        value = command[arg]
+        integer = isinstance(value, int) and not isinstance(value, bool)  # JSONのtrueはintとして通ってしまう
+        valid = {
+            "tile": integer and 0 <= value < tile_count,
+            "number": (integer or isinstance(value, float)) and math.isfinite(value),
+            "int": integer,
+            "direction": integer and value in (-1, 0, 1),
+            "bool": isinstance(value, bool),
+            "path": isinstance(value, str) and bool(value),
+            "paths": isinstance(value, list) and bool(value) and all(isinstance(p, str) and p for p in value),
+            "mode": isinstance(value, str) and value in layout_modes,
+        }[kind.rstrip("?")]
+        if not valid:
+            if kind == "tile":
+                return f"{name}: tile must be 0-{tile_count - 1}"
+            if kind == "mode":
+                return f"{name}: mode must be one of {', '.join(layout_modes)}"
+            return f"{name}: invalid {arg} {value!r}"
+    if name == "load" and "path" not in command and "paths" not in command:
+        return "load: missing path or paths"
+    return None
+
+
+class ControlServer:
+    # テストなどから操作するためのローカルのソケット。1行に1つのJSONで、{"cmd": ...} か {"batch": [...]} を受け付け、
+    # batchのコマンドはUIスレッドの1回の処理でまとめて実行する (途中で他の操作が割り込まない)。
+    # {"cmd": "subscribe", "interval": 秒} で状態を定期的に送る。アドレスはUnixドメインソケットのパスか、
+    # "ポート" / "127.0.0.1:ポート" (Windowsなど)。Tkには依存しない
+    def __init__(self, address, execute, get_state, dispatch, timeout=5.0):
+        self.address = address
+        self.execute = execute  # UIスレッドで実行する (コマンドのリスト) -> 結果のリスト
+        self.get_state = get_state  # UIスレッドで実行する () -> 状態のdict
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.clients = 0
+        self._clients_lock = threading.Lock()
+        self._sock = None
+        self._closed = threading.Event()
+
+    def start(self):
+        host, _, port = self.address.rpartition(":")
+        if port.isdigit():
+            if host not in ("", "127.0.0.1", "localhost"):
+                raise ValueError("control socket only listens on the loopback interface")
+            self._sock = socket.create_server((host or "127.0.0.1", int(port)))
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address)  # 前回の終了時に残ったソケット
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.bind(self.address)
+            self._sock.listen()
+        threading.Thread(target=self._accept, name="ControlAccept", daemon=True).start()
+        control_log.info("Control socket listening on %s", self.address)
+
+    def close(self):
+        self._closed.set()
+        if self._sock is not None:
+            self._sock.close()
+            if not self.address.rpartition(":")[2].isdigit() and os.path.exists(self.address):
+                os.unlink(self.address)
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(conn,), name="ControlClient", daemon=True).start()
+
+    def _call(self, func, *args):
+        # UIスレッドで実行して結果を待つ
+        done = threading.Event()
+        box = {}
+
+        def run():
+            try:
+                box['result'] = func(*args)
+            except Exception as e:
+                box['error'] = e
+            finally:
+                done.set()
+
+        self.dispatch(run)
+        if not done.wait(self.timeout):
+            raise TimeoutError("UI thread did not respond")
+        if 'error' in box:
+            raise box['error']
+        return box['result']
+
+    def _send(self, conn, lock, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with lock:
+            conn.sendall(data)
+
+    def _serve(self, conn):
+        with self._clients_lock:
+            self.clients += 1
+        lock = threading.Lock()
+        latencies = []
+        subscribed = threading.Event()
+        control_log.info("Control client connected")
+        try:
+            for line in conn.makefile("r", encoding="utf-8"):
+                received = time.perf_counter()
+                if not line.strip():
+                    continue
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("expected an object")
+                except ValueError as e:
+                    self._send(conn, lock, {"ok": False, "error": f"invalid request: {e}"})
+                    continue
+                reply = {"id": message.get("id")}
+                stream = False
+                try:
+                    if message.get("cmd") == "subscribe":
+                        interval = float(message.get("interval", 0.1))
+                        if not math.isfinite(interval):
+                            raise ValueError(f"invalid interval {message['interval']!r}")
+                        stream = not subscribed.is_set()
+                        subscribed.set()
+                        reply["ok"] = True
+                    else:
+                        commands = message["batch"] if "batch" in message else [message]
+                        if not isinstance(commands, list):
+                            raise ValueError("batch must be a list")
+                        reply["results"] = self._call(self.execute, commands)
+                        reply["ok"] = all(result.get("ok") for result in reply["results"])
+                except Exception as e:
+                    reply.update(ok=False, error=str(e))
+                latency = time.perf_counter() - received
+                latencies.append(latency)
+                reply["latency_ms"] = round(latency * 1000, 3)
+                self._send(conn, lock, reply)
+                if stream:
+                    # 状態の送信は購読の応答を返してから始める
+                    threading.Thread(target=self._stream, args=(conn, lock, max(0.02, interval)), daemon=True).start()
+        except OSError:
+            pass
+        finally:
+            subscribed.clear()
+            conn.close()
+            with self._clients_lock:
+                self.clients -= 1
+            if latencies:
+                control_log.info("Control client disconnected after %d requests, latency p50 %.2fms p99 %.2fms max %.2fms",
+                                 len(latencies), percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+                                 max(latencies) * 1000)
+
+    def _stream(self, conn, lock, interval):
+        # 購読したクライアントに状態を送り続ける。切断されたら終わる
+        while not self._closed.is_set():
+            started = time.perf_counter()
+            try:
+                self._send(conn, lock, dict(self._call(self.get_state), event="state"))
+            except Exception:
+                break
+            time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+def read_manifest(path):
+    # 比較セットの一覧を読み込む。JSONは [[パス, ...], ...] または {"sets": [...]}。
+    # テキストは1行1ファイルで、空行でセットを区切る (#で始まる行はコメント)。相対パスはマニフェストの場所が基準
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.lower().endswith(".json"):
+            data = json.load(f)
+            groups = data.get("sets", []) if isinstance(data, dict) else data
+        else:
+            groups, group = [], []
+            for line in f:
+                line = line.strip()
+                if line.startswith("#"):
+                    continue
+                if not line:
+                    if group:
+                        groups.append(group)
+                    group = []
+                    continue
+                group.append(line)
+            if group:
+                groups.append(group)
+    return [[os.path.normpath(os.path.join(base, p)) for p in group] for group in groups if group]
+
+
+def scan_folder(path, tile_count):
+    # フォルダ内のサブフォルダを1セットずつとして扱う。サブフォルダがなければ動画をtile_count個ずつに分ける
+    def videos(directory):
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(os.path.join(directory, name)))
+    subdirs = sorted(os.path.join(path, name) for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+    sets = [videos(d) for d in subdirs]
+    sets = [s for s in sets if s]
+    if sets:
+        return sets
+    files = videos(path)
+    return [files[i:i + tile_count] for i in range(0, len(files), tile_count)]
+
+
+class SetQueue:
+    # 順番に見ていく比較セット (タイルごとのファイルの組) の一覧と現在位置
+    def __init__(self, sets):
+        self.sets = sets
+        self.position = 0
+
+    def __len__(self):
+        return len(self.sets)
+
+    def valid(self, position):
+        return 0 <= position < len(self.sets)
+
+
+class Preload:
+    # 次のセットを待機用のmpvに読み込んだもの。映像は無効 (vid=no) のまま先読みだけしておき、
+    # 切り替え時に描画先を設定して映像を有効にする
+    def __init__(self, position, paths):
+        self.position = position
+        self.paths = paths
+        self.players = {}  # タイル番号 -> mpv
+        self.requests = {}  # タイル番号 -> 完了したLoadRequest
+
+    def ready(self):
+        return [i for i in self.players if i in self.requests]
+
+
+def callback_name(func):
+    # プロファイルに表示するコールバック名。afterの包み (callit) は元の関数を、lambdaは行番号も示す
+    code = getattr(func, '__code__', None)
+    if code and code.co_name == 'callit' and func.__closure__:
+        func = dict(zip(code.co_freevars, (cell.cell_contents for cell in func.__closure__))).get('func', func)
+        code = getattr(func, '__code__', None)
+    name = getattr(func, '__qualname__', None) or type(func).__name__
+    if code and '<lambda>' in name:
+        name = f"{name} (line {code.co_firstlineno})"
+    return name
+
+
+class UiWatchdog:
+    # UIスレッドの応答性を測る。Tkのコールバック (command=, bind, after) を全て包んでハンドラーごとの実行時間を集計し、
+    # 一定間隔のafterで予定からの遅れを測る。別スレッドがこのafterのハートビートを見張り、
+    # threshold以上途絶えたらその時点のUIスレッドのスタックを記録する (どの処理で止まっているかがわかる)
+    DEFAULT_STALL_MS = 100  # --ui-profileだけを指定したときの停止の閾値
+
+    def __init__(self, threshold=0.1, interval=0.05, keep=50):
+        self.threshold = threshold
+        self.interval = interval
+        self.handlers = {}  # 名前 -> [回数, 合計秒, 最大秒] (中で呼ばれたハンドラーの時間も含む)
+        self.lateness = collections.deque(maxlen=5000)  # afterの予定からの遅れ (秒)
+        self.stalls = collections.deque(maxlen=keep)
+        self.current = None  # 実行中のハンドラー名
+        self._thread_id = threading.get_ident()  # UIスレッドで作る
+        self._beat = self._due = time.perf_counter()
+        self._stall = None  # 記録中の停止
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._root = None
+        self._tick_id = None
+        self._wrapper = None  # 差し替える前のtk.CallWrapper (自分が差し替えていなければNone)
+
+    def install(self, root):
+        # 以降に登録されるTkのコールバックを計測する。ウィジェットを作る前に呼ぶ
+        # tk.CallWrapperはプロセス全体で共有されるので、他のUiWatchdogが差し替え済みなら二重に包まない
+        if getattr(tk.CallWrapper, "watchdog", None) is None:
+            self._wrapper = tk.CallWrapper
+
+            class TimedCallWrapper(self._wrapper):
+                watchdog = self
+
+                def __call__(self, *args):
+                    return self.watchdog.run(callback_name(self.func), super().__call__, args)
+
+            tk.CallWrapper = TimedCallWrapper
+        else:
+            ui_log.warning("Tk callbacks are already timed by another UI watchdog")
+        self._root = root
+        self._beat = time.perf_counter()
+        self._due = self._beat + self.interval
+        self._tick_id = root.after(int(self.interval * 1000), self._tick)
+        threading.Thread(target=self._watch, name="UiWatchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._tick_id:
+            self._root.after_cancel(self._tick_id)
+            self._tick_id = None
+        # 自分が差し替えたままなら元に戻す。既に登録済みのコールバックはrunが素通しする
+        if self._wrapper is not None and getattr(tk.CallWrapper, "watchdog", None) is self:
+            tk.CallWrapper = self._wrapper
+        self._wrapper = None
+
+    def run(self, name, func, args):
+        if self._stop.is_set():
+            return func(*args)
+        outer, self.current = self.current, name
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.current = outer
+            stats = self.handlers.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def _tick(self):
+        now = time.perf_counter()
+        self.lateness.append(max(0.0, now - self._due))
+        with self._lock:
+            self._beat = now
+            stall, self._stall = self._stall, None
+        if stall:
+            stall["ms"] = (now - stall.pop("since")) * 1000
+            self.stalls.append(stall)
+            ui_log.warning("UI thread stalled for %.0fms in %s\n%s", stall["ms"], stall["handler"] or "Tk",
+                           "".join(stall["stack"][-6:]).rstrip())
+        self._due = now + self.interval
+        self._tick_id = self._root.after(int(self.interval * 1000), self._tick)
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 4):
+            with self._lock:
+                since = self._beat + self.interval  # 次のハートビートの予定時刻
+                if self._stall or time.perf_counter() - since < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self._thread_id)
+                self._stall = {"time": time.time(), "since": since, "handler": self.current,
+                               "stack": traceback.format_stack(frame) if frame else []}
+
+    def report(self):
+        handlers = sorted(self.handlers.items(), key=lambda item: -item[1][1])
+        return {
+            **latency_summary("after_late_ms", list(self.lateness)),
+            "stall_threshold_ms": self.threshold * 1000,
+            "stalls": list(self.stalls),
+            "handlers": [{"name": name, "count": count, "total_ms": total * 1000, "mean_ms": total / count * 1000,
+                          "max_ms": longest * 1000} for name, (count, total, longest) in handlers],
+        }
+
+    def summary(self, top=10):
+        report = self.report()
+        lines = [f"UI loop: after callbacks late by p50 {report.get('after_late_ms_p50', 0):.1f}ms, "
+                 f"p99 {report.get('after_late_ms_p99', 0):.1f}ms, max {report.get('after_late_ms_max', 0):.0f}ms; "
+                 f"{len(report['stalls'])} stalls over {self.threshold * 1000:.0f}ms"]
+        for stall in sorted(report["stalls"], key=lambda stall: -stall["ms"])[:3]:
+            lines.append(f"  stall {stall['ms']:.0f}ms in {stall['handler'] or 'Tk'}")
+        for handler in report["handlers"][:top]:
+            lines.append(f"  {handler['name']}: {handler['count']} calls, total {handler['total_ms']:.0f}ms, "
+                         f"max {handler['max_ms']:.1f}ms")
+        return lines
+
+
+class Tile:
+    # 1タイル分の状態とウィジェット
+    def __init__(self, index):
+        self.index = index
+        self.player = None
+        self.wid = None  # 描画先ウィンドウID
+        self.video_file = None
+        self.frame = None
+        self.label = None
+        self.progress_slider = None
+        self.volume_frame = None
+        self.volume_slider = None
+        self.volume_label = None
+        self.time_label = None
+        self.position = None  # 観測した最新のtime-pos (UIスレッドで反映済みの値)
+        self.duration = None
+        self.displayed_position = None  # プログラムからスライダーに設定した値
+        self.first_play = True
+        self.ended = False
+        self.scrubbing = False  # 進捗スライダーをドラッグ中
+        self.thumbnail_key = None  # ThumbnailCacheのキー
+        self.media = None  # MediaProbeの結果
+        self.stream_info = None  # デコード負荷の見積もりに使うStreamInfo
+        self.volume = 50  # ミュート前の音量
+        self.property_handlers = {}  # プロパティハンドラを保存
+        self.visible = True
+        self.decode_plan = None  # 現在適用しているDecodePlan
+        self.cache_plan = None  # 現在適用しているCachePlan
+        self.quality_level = 0  # QualityControllerの段階 (0は最高画質)
+
+    def alive(self):
+        return self.player is not None and not getattr(self.player, 'core_shutdown', False)
+
+
+def layout_modes(count):
+    # レイアウト切り替えの順序。4タイルは従来の順序を維持する
+    if count == 4:
+        return ["1x4", "1x3", "1x2", "1x1", "2x2"]
+    return ["auto"] + [f"1x{k}" for k in range(min(count, 4), 0, -1)]
+
+
+def compute_grid(count, width, height, tile_aspect=16 / 9, control_height=50):
+    # count個のタイルを並べる行数×列数のうち、映像1つあたりの表示面積が最も大きくなるものを選ぶ
+    best, best_area = (1, count), -1.0
+    for cols in range(1, count + 1):
+        rows = math.ceil(count / cols)
+        cell_w = width / cols
+        cell_h = height / rows - control_height
+        if cell_w <= 0 or cell_h <= 0:
+            continue
+        video_w = min(cell_w, cell_h * tile_aspect)
+        area = video_w * video_w / tile_aspect
+        if area > best_area:
+            best, best_area = (rows, cols), area
+    return best
+
+
+LAYOUT_WINDOW_SIZES = {"1x4": "1280x400", "1x3": "960x400", "1x2": "640x400", "1x1": "400x400", "2x2": "760x680"}
+
+
+def layout_window_size(rows, cols):
+    return LAYOUT_WINDOW_SIZES.get(f"{rows}x{cols}", f"{max(400, cols * 320)}x{rows * 280 + 120}")
 
 
 class VideoPlayerApp:
-    def __init__(self, root):
+    COMPOSITOR = -1  # Scrubberで合成モードのプレーヤーを表す番号
+    MAX_SHUTTLE = 8.0  # J/Lで上げられる再生速度の上限
+
+    def __init__(self, root, tile_count=4, startup_timer=None, log_ring=None, metrics_csv=None, metrics_prom=None,
+                 cache_budget=1 << 30, cache_back=10.0, workers=False, ui_stall_ms=None, ui_profile=None):
         self.root = root
+        # 以降に作るウィジェットやafterのコールバックを全て計測するので最初に設定する
+        # 計測はTkのコールバック全てに掛かるので、--ui-stall-msか--ui-profileを指定したときだけ有効にする
+        self.watchdog = None
+        if ui_stall_ms or ui_profile:
+            self.watchdog = UiWatchdog((ui_stall_ms or UiWatchdog.DEFAULT_STALL_MS) / 1000)
+            self.watchdog.install(root)
+        self.ui_profile = ui_profile  # 終了時にUIの計測結果を書き出すJSONのパス
+        self.log_ring = log_ring  # setup_loggingのRingBufferHandler
+        self.startup_timer = startup_timer or StartupTimer(time.perf_counter())
         self.root.title("Simul PB v" + version)
 
         # メインのPanedWindowを作成
@@ -37,359 +3244,977 @@ class VideoPlayerApp:
         self.root.update_idletasks()
         self.main_paned.sash_place(0, 0, self.root.winfo_height() - 280)
 
-        self.players = [None] * 4
-        self.video_files = [None] * 4
-        self.volume_labels = [None] * 4
-        self.progress_sliders = [None] * 4
+        self.tiles = [Tile(i) for i in range(tile_count)]
+        self.selected_vo = None
+        self.vo_cache = JsonCache("vo_cache.json")
+        self.hwdec_recorded = False
+        self.progress_queue = queue.Queue()  # (index, プロパティ名, 値) をmpvのイベントスレッドから受け取る
+        self.progress_interval_ms = 33  # 表示の更新は最大30Hz
         self.loop_enabled = False
         self.is_fullscreen = False
         self.playing = False
-        self.first_play = [True] * 4
-        self.ended = [False] * 4
-        self.layout_mode = "1x4"
+        self.layout_modes = layout_modes(tile_count)
+        self.layout_mode = self.layout_modes[0]
+        self.layout_grid = None  # 現在の (行数, 列数)
+        self.layout_resize_id = None
         self.is_muted = False
-        self.previous_volumes = [50] * 4
-        self.property_handlers = {i: {} for i in range(4)}  # プロパティハンドラを保存
-
-        # プレーヤーフレームのグリッド設定
-        self.player_frame.grid_rowconfigure(0, weight=1)  # プレーヤー行
-        self.player_frame.grid_rowconfigure(1, weight=0, minsize=50)  # スライダー行
-        for i in range(8):
-            if i % 2 == 0:
-                self.player_frame.grid_columnconfigure(i, weight=1)  # プレーヤー列
-            else:
-                self.player_frame.grid_columnconfigure(i, weight=0, minsize=80)  # ボリューム列
+        self.sync_modes = [SyncEngine.MASTER_CLOCK] + list(range(tile_count)) + [None]  # Noneは同期オフ
+        self.sync_mode = SyncEngine.MASTER_CLOCK
+        self.sync_engine = SyncEngine(self.sync_targets)
+        self.ui_queue = queue.Queue()
+        self.loader = FileLoader(self.call_in_ui)
+        self.player_pool = PlayerPool(self.new_player)
+        self.decode_scheduler = DecodeScheduler()
+        self.cache_budget = CacheBudget(cache_budget, cache_back)
+        self.seek_barrier = SeekBarrier(self.call_in_ui)
+        self.group_slider_dragging = False
+        self.scrubber = Scrubber()
+        self.thumbnails = ThumbnailCache(self.call_in_ui)
+        self.media_probe = MediaProbe(self.call_in_ui)
+        self.preview_images = collections.OrderedDict()  # 縮小画像のパス -> PhotoImage (UIスレッド専用)
+        self.preview_window = None
+        self.log_window = None
+        self.metrics = MetricsCollector(self.metric_targets, csv_path=metrics_csv, prom_path=metrics_prom)
+        self.metrics_window = None
+        self.quality = QualityController()
+        self.set_queue = None
+        self.preload = None
+        self.preload_loader = FileLoader(self.call_in_ui, timeout=30)
+        self.compositor = None  # 合成モード中のCompositor
+        self.compositor_loader = FileLoader(self.call_in_ui, timeout=30)
+        self.compositor_update_id = None
+        self.analyzer = QualityAnalyzer()
+        self.analysis_window = None
+        self.exporter = GridExporter()
+        self.export_window = None
+        self.focus_index = 0  # 最後にクリックまたはマウスを乗せたタイル。画質を下げない
+        self.shuttle_speed = 1.0  # 次に再生する時の速度。負の値は逆再生
+        self.control = None  # ControlServer
+        # ワーカーモードでは各プレーヤーを別プロセスで動かす。スロットはタイル、待機用、先読み、合成の分
+        self.worker_state = SharedState(slots=tile_count * 2 + 4) if workers else None
+        self.worker_watch_id = None
+
+        self.startup_timer.mark("window layout")
+        self.create_tiles()
+        self.create_buttons()
+        self.create_sliders()
+        self.apply_layout()
+        self.player_frame.bind('<Configure>', self.on_player_frame_resize)
+        self.startup_timer.mark("controls")
+        # 最初のドロップを待たせないよう、ウィンドウ表示後にバックグラウンドでmpvを読み込んでおく
+        self.root.after_idle(lambda: threading.Thread(target=load_mpv, name="MpvImport", daemon=True).start())
+        self.update_progress_id = self.root.after(self.progress_interval_ms, self.update_progress)
+        self.sync_engine.start_thread()
+        self.metrics.start_thread()  # 1秒に1回の読み取りなので常に動かしておく (画質の自動調整に使う)
+        self.quality_id = self.root.after(1000, self.update_quality)
+        self.ui_queue_id = self.root.after(15, self.process_ui_queue)
+        if self.worker_state:
+            self.worker_watch_id = self.root.after(1000, self.watch_workers)
+        self.root.bind('<Prior>', lambda e: self.step_set(-1))
+        self.root.bind('<Next>', lambda e: self.step_set(1))
+        self.root.bind('<space>', lambda e: self.toggle_play())
+        self.root.bind('<period>', lambda e: self.step_frames(1))
+        self.root.bind('<comma>', lambda e: self.step_frames(-1))
+        self.root.bind('<KeyPress-j>', lambda e: self.shuttle(-1))
+        self.root.bind('<KeyPress-k>', lambda e: self.shuttle(0))
+        self.root.bind('<KeyPress-l>', lambda e: self.shuttle(1))
+        self.root.bind('<F11>', self.toggle_fullscreen)
+        self.root.bind('<Escape>', lambda e: self.root.attributes('-fullscreen', False))
+
+    def call_in_ui(self, func, *args):
+        # 別スレッドからUIスレッドへ処理を依頼する (Tkはスレッドセーフではないため)
+        self.ui_queue.put((func, args))
+
+    def process_ui_queue(self):
+        while True:
+            try:
+                func, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if self.watchdog:
+                    self.watchdog.run(callback_name(func), func, args)
+                else:
+                    func(*args)
+            except Exception as e:
+                ui_log.error("Error in UI callback %s: %s", getattr(func, '__name__', func), e, exc_info=True)
+        # 制御ソケットのクライアントがいる間は応答を数msに抑えるため短い間隔で見る
+        interval = 2 if self.control and self.control.clients else 15
+        self.ui_queue_id = self.root.after(interval, self.process_ui_queue)
+
+    def vo_cache_key(self):
+        # マシンとlibmpvのバージョンが変わったらキャッシュは使わない
+        api_version = ".".join(str(v) for v in mpv.MPV_VERSION)
+        return f"{platform.node()}|{platform.platform()}|libmpv-api {api_version}|python-mpv {mpv.__version__}"
+
+    def create_tiles(self):
+        # タイルとドロップ先だけを作成する。配置はapply_layoutで行い、mpvはファイルがドロップされるまで作成しない
+        self.compositor_frame = tk.Frame(self.player_frame, bg="black", name="compositor")
+        for tile in self.tiles:
+            i = tile.index
+            tile.frame = tk.Frame(self.player_frame, width=320, height=240, name=f"frame{i}",
+                                  bg="steelblue" if i == self.focus_index else "lightgray")
+            tile.label = tk.Label(tile.frame, text="Drop video here", name=f"label{i}")
+            tile.label.pack(expand=True, fill="both", padx=2, pady=2)  # 枠の色でフォーカス中のタイルを示す
+            tile.label.bind('<Button-1>', lambda e, idx=i: self.set_focus(idx))
+            tile.label.drop_target_register(DND_FILES)
+            tile.label.dnd_bind('<<Drop>>', lambda e, idx=i: self.drop_file(e, idx))
+            tile.wid = int(tile.label.winfo_id())
+
+    def new_player(self, wid=None, vo=None):
+        if self.worker_state:
+            return RemotePlayer(self.worker_state, self.player_options(wid, vo),
+                                on_exit=lambda player: self.call_in_ui(self.on_worker_exit, player))
+        return load_mpv().MPV(**self.player_options(wid, vo))
+
+    def on_worker_exit(self, player):
+        # ワーカープロセスが落ちたら、そのタイルだけ新しいワーカーで読み込み直す
+        for tile in self.tiles:
+            if tile.player is player:
+                player_log.warning("Restarting player %s after its worker exited", tile.index)
+                self.recover_tile(tile.index)
+                return
+        if self.compositor and self.compositor.player is player:
+            player_log.warning("Compositor worker exited, going back to separate players")
+            self.stop_compositor(resume=False)
+
+    def watch_workers(self):
+        # ループが止まったワーカーは強制終了する (on_worker_exitで再起動される)
+        players = [tile.player for tile in self.tiles] + [self.compositor.player if self.compositor else None]
+        for player in players:
+            if isinstance(player, RemotePlayer) and player.stalled(3.0):
+                player_log.error("Player worker (pid %s) stopped responding, killing it", player.pid)
+                player.kill()
+        self.worker_watch_id = self.root.after(1000, self.watch_workers)
+
+    def ensure_player(self, index):
+        # タイルのプレーヤーが無ければ作成する。2台目以降は待機中のインスタンスを使う
+        player = self.tiles[index].player
+        if player and not getattr(player, 'core_shutdown', False):
+            return True
+        started = time.perf_counter()
+        load_mpv()  # open_fileからはwhen_mpv_readyでimportの完了を待ってから呼ばれるので、ここでは止まらない
+        created = self.create_first_player(index) if self.selected_vo is None else self.reinitialize_player(index)
+        if created:
+            player_log.info("Player %s created on demand in %.1fms", index, (time.perf_counter() - started) * 1000)
+        return created
+
+    def create_first_player(self, index):
+        label = self.tiles[index].label
+        vo_candidates = ['opengl', 'gpu', 'direct3d', 'win']
+        cached = self.vo_cache.get(self.vo_cache_key())
+        if cached and cached.get("vo") in vo_candidates:
+            # 前回選択したVOを最初に試す。失敗した場合だけ残りの候補を調べ直す
+            vo_candidates.remove(cached["vo"])
+            vo_candidates.insert(0, cached["vo"])
+            player_log.info("Using cached video output: %s (mpv %s, hwdec %s)",
+                            cached['vo'], cached.get('mpv_version'), cached.get('hwdec'))
+        vo_started = time.perf_counter()
+
+        player = None
+        for attempt, vo in enumerate(vo_candidates):
+            try:
+                player = self.new_player(self.tiles[index].wid, vo)
+                self.selected_vo = vo
+                player_log.info("Successfully created player with vo=%s (%s, %.1fms)",
+                                vo, 'cache hit' if cached and attempt == 0 else 'probe', (time.perf_counter() - vo_started) * 1000)
+                self.save_vo_cache(player, cached)
+                break
+            except Exception as e:
+                player_log.warning("Failed to create player with vo=%s: %s", vo, e)
+                continue
+
+        if self.selected_vo is None:
+            player_log.error("No suitable video output found")
+            label.config(text="Error: No Video Output")
+            return False
+
+        self.observe_player(index, player)
+        self.tiles[index].player = player
+        player.pause = True
+        player.volume = 0 if self.is_muted else self.tiles[index].volume
+        player.loop_file = 'inf' if self.loop_enabled else 'no'
+        player_log.info("Player %s initialized with vo=%s, loop-file=%s", index, self.selected_vo, player.loop_file)
+        # 待機インスタンスはここでは作らない (1タイルだけ使う間に遊んでいるmpvを持たない)。
+        # 2台目以降を作る時にacquireが補充を始める
+        return True
+
+    def save_vo_cache(self, player, cached):
+        entry = dict(cached or {})
+        try:
+            mpv_version = player.mpv_version
+        except Exception:
+            mpv_version = None
+        if entry.get("vo") == self.selected_vo and entry.get("mpv_version") == mpv_version:
+            self.hwdec_recorded = entry.get("hwdec") is not None
+            return
+        entry.update(vo=self.selected_vo, mpv_version=mpv_version, hwdec=None)
+        self.vo_cache.put(self.vo_cache_key(), entry)
+        player_log.info("Saved video output %s to cache %s", self.selected_vo, self.vo_cache.path)
+
+    def record_hwdec(self, index):
+        # 実際に使われたハードウェアデコーダーは動画を読み込むまでわからないので、最初の読み込み後に保存する
+        if self.hwdec_recorded:
+            return
+        try:
+            hwdec = self.tiles[index].player.hwdec_current
+        except Exception:
+            return
+        self.hwdec_recorded = True
+        entry = dict(self.vo_cache.get(self.vo_cache_key()) or {})
+        if entry.get("vo") == self.selected_vo:
+            entry["hwdec"] = hwdec or "no"
+            self.vo_cache.put(self.vo_cache_key(), entry)
+            player_log.info("Saved hwdec result %s to cache", entry['hwdec'])
+
+    def player_options(self, wid=None, vo=None):
+        # 全タイル共通のmpv設定。待機用インスタンスもこの設定で作成するので、差し替え後も同じ設定になる
+        options = dict(vo=vo or self.selected_vo,
+                       log_handler=self.log_handler,
+                       loglevel=mpv_loglevel(),
+                       # キー操作はメインウィンドウで受けて全タイルに送る。mpvごとの既定のキー/ホイール操作は
+                       # 1台だけをシークしてずれるので無効にする (OSCのボタンは使える)
+                       input_default_bindings=False,
+                       input_vo_keyboard=False,
+                       osc=True,
+                       hwdec='auto',
+                       keep_open='yes',  # 再生終了後もウィンドウを維持
+                       idle=True,        # アイドル状態を許可
+                       hr_seek='yes',    # 高精度シーク
+                       cache='yes',      # ローカルファイルでもデマルチプレクサキャッシュを使う (上限はCacheBudgetで決める)
+                       demuxer_seekable_cache='yes')  # キャッシュ内へのシークはファイルを読み直さない
+        if wid is not None:
+            options['wid'] = str(wid)
+        return options
+
+    def observe_player(self, index, player):
+        # プロパティの監視とイベントコールバックを登録する
+        self.tiles[index].property_handlers = {
+            'end-file': lambda name, value: self.on_tile_end(index, name, value),
+            'eof-reached': lambda name, value: self.on_tile_end(index, name, value),
+            'idle': lambda name, value: self.on_tile_end(index, name, value),
+            'time-pos': lambda name, value: self.progress_queue.put((index, name, value)),
+            'duration': lambda name, value: self.progress_queue.put((index, name, value)),
+            'decoder-frame-drop-count': lambda name, value: self.on_decoder_drops(index, value),
+            # マウスを乗せたタイルをフォーカスにする (mpvのウィンドウ上ではTkのイベントが来ないため)
+            'mouse-pos': lambda name, value: value and value.get('hover') and self.call_in_ui(self.set_focus, index),
+        }
+        for prop, handler in self.tiles[index].property_handlers.items():
+            player.observe_property(prop, handler)
+        self.loader.attach(index, player)
+        self.seek_barrier.attach(index, player)
+        self.scrubber.attach(index, player)
+
+    def unobserve_player(self, index, player):
+        for prop, handler in self.tiles[index].property_handlers.items():
+            try:
+                player.unobserve_property(prop, handler)
+                player_log.debug("Player %s unobserved property: %s", index, prop)
+            except Exception as e:
+                player_log.error("Error unobserving %s for player %s: %s", prop, index, e)
+        self.tiles[index].property_handlers = {}
+
+    def on_decoder_drops(self, index, count):
+        # mpvのスレッドから呼ばれる
+        if self.decode_scheduler.note_drops(index, count):
+            self.call_in_ui(self.rebalance_decoders)
+
+    def rebalance_decoders(self):
+        # スケジューラーの割り当てを各プレーヤーに反映する。hwdecを変えるとデコーダーが再初期化され、
+        # その時点でvd-lavc-threadsも反映される (スレッド数だけの変更は次の読み込みから有効)
+        for index, plan in self.decode_scheduler.plan().items():
+            tile = self.tiles[index]
+            if plan == tile.decode_plan:
+                continue
+            tile.decode_plan = plan
+            if not tile.alive():
+                continue
+            try:
+                for name, value in self.decode_options(tile).items():
+                    tile.player[name] = value
+                decode_log.info("Player %s decoder: threads=%s hwdec=%s framedrop=%s",
+                                index, plan.threads, plan.hwdec, plan.framedrop)
+            except Exception as e:
+                decode_log.error("Error applying decoder settings for player %s: %s", index, e)
+
+    def budget_cache(self, index):
+        # ファイルのビットレートとサイズをキャッシュの配分に渡し、全タイルの配分をやり直す
+        tile = self.tiles[index]
+        try:
+            size = os.path.getsize(tile.video_file)
+        except (OSError, TypeError):
+            size = None
+        bitrate = (tile.media or {}).get('bitrate')
+        if not bitrate and size and tile.duration:
+            bitrate = size * 8 / tile.duration
+        self.cache_budget.set_stream(index, bitrate, size)
+        self.rebalance_cache()
+
+    def rebalance_cache(self):
+        # 配分を各プレーヤーに反映する。キャッシュの上限は再生中に変更してもすぐに反映される
+        changed = False
+        for index, plan in self.cache_budget.plan().items():
+            tile = self.tiles[index]
+            if plan == tile.cache_plan:
+                continue
+            tile.cache_plan = plan
+            changed = True
+            if not tile.alive():
+                continue
+            try:
+                for name, value in plan.options().items():
+                    tile.player[name] = value
+                cache_log.debug("Player %s demuxer cache: %.0fMiB ahead, %.0fMiB back",
+                                index, plan.forward / (1 << 20), plan.back / (1 << 20))
+            except Exception as e:
+                cache_log.error("Error applying cache limits for player %s: %s", index, e)
+        if changed:
+            planned = sum(t.cache_plan.forward + t.cache_plan.back for t in self.tiles if t.cache_plan)
+            cache_log.info("Demuxer cache budget %.0fMiB: %s", self.cache_budget.total_bytes / (1 << 20), ", ".join(
+                f"P{t.index + 1} {(t.cache_plan.forward + t.cache_plan.back) / (1 << 20):.0f}MiB"
+                for t in self.tiles if t.cache_plan) + f" (limits total {planned / (1 << 20):.0f}MiB)")
+
+    def load_options(self, tile):
+        # 読み込みごとに指定するmpvオプション。差し替えたプレーヤーでも同じ設定になる
+        options = self.decode_options(tile)
+        if tile.cache_plan:
+            options.update(tile.cache_plan.options())
+        return options
+
+    def decode_options(self, tile):
+        # スケジューラーの割り当てに、画質を下げている場合の設定を重ねたもの
+        options = (tile.decode_plan or DecodePlan()).options()
+        options.update(QualityController.LEVELS[tile.quality_level]['options'])
+        return options
+
+    def set_focus(self, index):
+        if index == self.focus_index:
+            return
+        previous, self.focus_index = self.focus_index, index
+        for i in (previous, index):
+            if i is not None:
+                self.tiles[i].frame.config(bg="steelblue" if i == index else "lightgray")
+        self.update_quality(reschedule=False)
+
+    def update_quality(self, reschedule=True):
+        active = [tile.index for tile in self.tiles if tile.video_file and tile.alive()]
+        changes = self.quality.update(time.monotonic(), self.metrics.latest(), self.focus_index, active)
+        for index, level in changes.items():
+            self.apply_quality(index, level)
+        if reschedule:
+            self.quality_id = self.root.after(1000, self.update_quality)
+
+    def apply_quality(self, index, level):
+        tile = self.tiles[index]
+        previous, tile.quality_level = tile.quality_level, level
+        if not tile.alive():
+            return
+        player = tile.player
+        try:
+            for name, value in self.decode_options(tile).items():
+                player[name] = value
+            # 表示レートの上限はフィルタで付け外しする
+            fps_divisor = QualityController.LEVELS[level]['fps_divisor']
+            if QualityController.LEVELS[previous]['fps_divisor'] != fps_divisor:
+                if fps_divisor > 1:
+                    fps = (tile.stream_info.fps if tile.stream_info else 30.0) / fps_divisor
+                    player.command_async('vf', 'add', f"@degrade:fps=fps={fps:.3f}")
+                else:
+                    player.command_async('vf', 'remove', "@degrade")
+            # デコーダーの設定は再初期化しないと反映されないので、映像トラックを選択し直す
+            if QualityController.LEVELS[previous]['options'] != QualityController.LEVELS[level]['options']:
+                vid = player.vid
+                if vid not in (None, False, 'no'):
+                    player.vid = 'no'
+                    player.vid = vid
+        except Exception as e:
+            decode_log.error("Error applying quality level %s to player %s: %s", level, index, e)
+
+    def log_handler(self, loglevel, component, message):
+        mpv_log_handler(loglevel, component, message)
+
+    def reinitialize_player(self, index):
+        # 壊れたプレーヤーを待機中のインスタンスと差し替える。終了処理は時間がかかるので別スレッドで行う
+        if self.selected_vo is None:
+            return self.ensure_player(index)  # まだ1台も作成していない場合はVOの選択から行う
+        swap_started = time.perf_counter()
+        self.release_player(index)
+        try:
+            player = self.player_pool.acquire()
+            if player is None:
+                player_log.info("No standby player available for player %s, creating a new one", index)
+                player = self.new_player()
+            bind_window(player, self.tiles[index].wid)
+            self.observe_player(index, player)
+            player.pause = True
+            player.volume = 0 if self.is_muted else self.tiles[index].volume
+            player.loop_file = 'inf' if self.loop_enabled else 'no'  # 現在のループ状態を反映
+            self.tiles[index].player = player
+            player_log.info("Player %s swapped in %.1fms with vo=%s, loop-file=%s",
+                            index, (time.perf_counter() - swap_started) * 1000, self.selected_vo, 'inf' if self.loop_enabled else 'no')
+            return True
+        except Exception as e:
+            player_log.error("Error reinitializing player %s: %s", index, e, exc_info=True)
+            self.tiles[index].player = None
+            self.tiles[index].label.config(text="Error: Player Shutdown")
+            return False
+
+    def release_player(self, index):
+        # タイルからプレーヤーを外す。終了処理は時間がかかるので別スレッドで行う
+        self.sync_engine.forget(index)
+        self.loader.cancel(index)
+        self.seek_barrier.forget(index)
+        self.scrubber.forget(index)
+        self.metrics.forget(index)
+        self.quality.forget(index)
+        self.tiles[index].quality_level = 0  # 新しいプレーヤーには表示レートのフィルタが付いていない
+        old_player = self.tiles[index].player
+        self.tiles[index].player = None
+        if old_player:
+            self.unobserve_player(index, old_player)
+            threading.Thread(target=self.terminate_player, args=(index, old_player), daemon=True).start()
+        self.tiles[index].property_handlers = {}
+
+    def toggle_compositor(self):
+        if self.compositor:
+            self.stop_compositor()
+        else:
+            self.start_compositor()
+
+    def start_compositor(self):
+        # 各タイルのプレーヤーを終了し、全ファイルを1台のmpvに読み込んでlavfi-complexで1枚の映像に合成する
+        tiles = [tile for tile in self.tiles if tile.video_file and tile.alive()]
+        if len(tiles) < 2:
+            player_log.warning("Compositor needs at least 2 loaded videos")
+            return
+        resume = self.playing
+        if self.playing:
+            self.toggle_play()
+        reference = self.group_reference()
+        position = (reference.position or 0.0) if reference else 0.0
+        # 合成した映像の長さは本体のファイルの長さになるので、一番長いファイルを本体にする。
+        # トラック数はffprobeで調べたものを使う (調べられなかったファイルは映像だけ使う)
+        tiles.sort(key=lambda tile: -(tile.duration or 0))
+        inputs = [(tile.index, tile.video_file, track_counts(tile.media)) for tile in tiles]
+        for tile in tiles:
+            self.release_player(tile.index)
+        started = time.perf_counter()
+        try:
+            player = self.player_pool.acquire() or self.new_player()
+            bind_window(player, self.compositor_frame.winfo_id())
+            player.volume = 100  # タイルごとの音量はフィルタグラフで調整する
+            player.loop_file = 'inf' if self.loop_enabled else 'no'
+        except Exception as e:
+            player_log.error("Error creating compositor player: %s", e, exc_info=True)
+            self.compositor = Compositor(None, inputs)
+            return self.stop_compositor(resume)
+        compositor = self.compositor = Compositor(player, inputs)
+        player.observe_property('time-pos', lambda name, value: self.on_compositor_time(compositor, value))
+        player.observe_property('eof-reached', lambda name, value: value and self.call_in_ui(self.on_compositor_ended, compositor))
+        self.compositor_loader.attach(0, player)
+        self.scrubber.attach(self.COMPOSITOR, player)
+        self.layout_grid = None
+        self.apply_layout()  # フィルタグラフもここで設定される
+        self.compositor_button.config(text="Separate")
+
+        def loaded(i, request):
+            player_log.info("Compositor loaded %d videos in %.0fms: %s", len(inputs),
+                            (time.perf_counter() - started) * 1000, compositor.graph)
+            if resume and compositor is self.compositor:
+                self.toggle_play()
+
+        def failed(i, request):
+            player_log.error("Compositor failed to load (%s), returning to separate players",
+                             request.error if request else "no player")
+            if compositor is self.compositor:
+                self.stop_compositor(resume)
+
+        try:
+            compositor.load(self.compositor_loader, position, loaded, failed)
+        except Exception as e:
+            player_log.error("Error loading compositor: %s", e, exc_info=True)
+            failed(0, None)
+
+    def stop_compositor(self, resume=None):
+        # 合成をやめて、各タイルのプレーヤーを合成時の再生位置で読み込み直す。resumeがNoneなら再生中だった場合のみ再開する
+        compositor = self.compositor
+        resume = self.playing if resume is None else resume
+        if self.playing:
+            self.toggle_play()
+        self.compositor = None
+        self.compositor_loader.cancel(0)
+        self.scrubber.forget(self.COMPOSITOR)
+        if self.compositor_update_id:
+            self.root.after_cancel(self.compositor_update_id)
+            self.compositor_update_id = None
+        if compositor.player:
+            threading.Thread(target=self.terminate_player, args=("compositor", compositor.player), daemon=True).start()
+        self.layout_grid = None
+        self.apply_layout()
+        self.compositor_button.config(text="Composite")
+        indices = [index for index, path, _ in compositor.inputs if self.tiles[index].video_file == path]
+        indices = [index for index in indices if self.ensure_player(index)]
+        self.load_tiles(indices, start=compositor.position or 0.0,
+                        on_all_done=lambda requests: resume and not self.playing and self.compositor is None and self.toggle_play())
+
+    def on_compositor_time(self, compositor, value):
+        # mpvのスレッドから呼ばれる。合成した映像の再生位置を各タイルのスライダーに反映する
+        if value is None or compositor is not self.compositor:
+            return
+        compositor.position = value
+        for index, _, _ in compositor.inputs:
+            duration = self.tiles[index].duration
+            self.progress_queue.put((index, 'time-pos', min(value, duration) if duration else value))
+
+    def on_compositor_ended(self, compositor):
+        if compositor is self.compositor and self.playing and not self.loop_enabled:
+            self.playing = False
+            self.play_button.config(text="Play All")
+            player_log.info("Compositor ended, button reset to Play All")
+
+    def compositor_volumes(self):
+        return {tile.index: 0 if self.is_muted else tile.volume for tile in self.tiles}
+
+    def update_compositor(self):
+        self.compositor_update_id = None
+        if self.compositor is None:
+            return
+        try:
+            if self.compositor.configure(*self.layout_shape(), self.compositor_volumes()):
+                player_log.debug("Compositor graph: %s", self.compositor.graph)
+        except Exception as e:
+            player_log.error("Error updating compositor graph: %s", e)
+
+    def schedule_compositor_update(self):
+        # 音量スライダーのドラッグ中にフィルタグラフを作り直し続けないよう、操作が落ち着いてから反映する
+        if self.compositor is None:
+            return
+        if self.compositor_update_id:
+            self.root.after_cancel(self.compositor_update_id)
+        self.compositor_update_id = self.root.after(200, self.update_compositor)
+
+    def terminate_player(self, index, player):
+        try:
+            player.terminate()
+        except Exception as e:
+            player_log.error("Error terminating player %s: %s", index, e)
+
+    def snapshot_tile(self, index):
+        # 差し替え前のプレーヤーには問い合わせず、UI側で把握している状態から作る
+        return PlayerSnapshot(path=self.tiles[index].video_file,
+                              position=self.tiles[index].position or 0.0,
+                              paused=not self.playing or self.tiles[index].ended,
+                              volume=0 if self.is_muted else self.tiles[index].volume,
+                              loop=self.loop_enabled)
+
+    def on_tile_end(self, index, name, value):
+        # end-file / eof-reached / idle のどれかで終了を検出した時にmpvのスレッドから呼ばれる。
+        # 位置と長さはプレーヤーに問い合わせず、監視して反映済みのtime-pos/durationを使う
+        if not value or self.loop_enabled:
+            return
+        tile = self.tiles[index]
+        try:
+            player = tile.player
+            if not player or getattr(player, 'core_shutdown', False) or not tile.video_file or tile.ended:
+                return
+            # 動画が実際に終了位置に近い場合のみ処理を実行 (終了1秒前までは無視)
+            if tile.position and tile.duration and tile.position < tile.duration - 1.0:
+                return
+            player_log.info("Video %s %s detected: %s", index, name, tile.video_file)
+            tile.ended = True
+            player.pause = True
+            # プログレスバーを最後まで移動 (反映はUIスレッドで行う)
+            if tile.duration:
+                self.progress_queue.put((index, 'time-pos', tile.duration))
+            player_log.info("Video %s paused at end", index)
+            self.call_in_ui(self.check_all_ended)
+        except Exception as e:
+            player_log.error("Error handling %s for video %s: %s", name, index, e, exc_info=True)
+            # mpvのイベントスレッド上でプレーヤーを破棄しないよう、復旧はUIスレッドで行う
+            self.call_in_ui(self.recover_tile, index, None, True)
+
+    def check_all_ended(self):
+        all_ended = all(tile.ended or tile.video_file is None for tile in self.tiles)
+        if all_ended and self.playing:
+            self.playing = False
+            self.sync_engine.pause()
+            self.play_button.config(text="Play All")
+            player_log.info("All videos ended, button reset to Play All")
+            for tile in self.tiles:
+                tile.ended = False
 
-        self.create_players()
-        self.create_buttons()
-        self.create_sliders()
-        self.update_progress_id = self.root.after(1000, self.update_progress)
-        self.root.bind('<F11>', self.toggle_fullscreen)
-        self.root.bind('<Escape>', lambda e: self.root.attributes('-fullscreen', False))
+    def drop_file(self, event, index):
+        self.open_paths([urllib.parse.unquote(p) for p in self.root.tk.splitlist(event.data)], index)
+
+    def open_paths(self, paths, index=0):
+        # ファイルはドロップ先のタイルへ、フォルダやマニフェストは比較セットとして開く
+        paths = [os.path.normpath(p) for p in paths]
+        if self.compositor:
+            self.stop_compositor(resume=False)  # ファイルが変わるので合成をやめる
+        missing = [p for p in paths if not os.path.exists(p)]
+        if missing:
+            load_log.error("File not found: %s", missing[0])
+            self.tiles[index].label.config(text="Error: File Not Found")
+            return
+        first = paths[0]
+        try:
+            if os.path.isdir(first):
+                return self.open_sets(scan_folder(first, len(self.tiles)), f"folder {first}")
+            if first.lower().endswith(MANIFEST_EXTENSIONS):
+                return self.open_sets(read_manifest(first), f"manifest {first}")
+        except Exception as e:
+            load_log.error("Error reading comparison sets from %s: %s", first, e)
+            self.tiles[index].label.config(text="Error: Invalid Set List")
+            return
+        # 複数のファイルをまとめてドロップした場合は、ドロップ先から順にタイルへ割り当てる
+        videos = [p for p in paths if p.lower().endswith(VIDEO_EXTENSIONS)]
+        for offset, path in enumerate(videos[:len(self.tiles) - index]):
+            self.open_file(index + offset, path)
 
-    def create_players(self):
-        temp_player = mpv.MPV()
-        available_vos = temp_player.vo
-        print(f"Available video outputs: {available_vos}")
-        temp_player.terminate()
+    def open_file(self, index, file_path):
+        self.reset_tile_state(index, file_path)
+        # 調べたことのあるファイルならここで結果が反映され、デコーダー設定も読み込み前に決まる
+        self.media_probe.request(file_path, lambda path, media, idx=index: self.on_media_probed(idx, path, media))
+        self.when_mpv_ready(self.start_tile_load, index, file_path)
 
-        vo_candidates = ['opengl', 'gpu', 'direct3d', 'win']
-        selected_vo = None
-
-        for i in range(4):
-            frame = tk.Frame(self.player_frame, width=320, height=240, bg="lightgray", name=f"frame{i}")
-            if self.layout_mode == "2x2":
-                frame.grid(row=2 * (i // 2), column=2 * (i % 2), columnspan=2, padx=5, pady=5, sticky="nsew")
-            else:  # 1x4レイアウト
-                frame.grid(row=0, column=2*i, columnspan=2, padx=5, pady=5, sticky="nsew")
-
-            label = tk.Label(frame, text="Drop video here", name=f"label{i}")
-            label.pack(expand=True, fill="both")
-            label.drop_target_register(DND_FILES)
-            label.dnd_bind('<<Drop>>', lambda e, idx=i: self.drop_file(e, idx))
-
-            if selected_vo is None:
-                for vo in vo_candidates:
-                    try:
-                        player = mpv.MPV(vo=vo,
-                                       log_handler=self.log_handler,
-                                       input_default_bindings=True,
-                                       input_vo_keyboard=True,
-                                       osc=True,
-                                       hwdec='auto',
-                                       keep_open='yes',  # 再生終了後もウィンドウを維持
-                                       idle=True,        # アイドル状態を許可
-                                       hr_seek='yes',    # 高精度シーク
-                                       wid=str(int(label.winfo_id())))
-                        selected_vo = vo
-                        print(f"Successfully created player with vo={vo}")
-                        break
-                    except Exception as e:
-                        print(f"Failed to create player with vo={vo}: {e}")
-                        continue
+    def start_tile_load(self, index, file_path):
+        if self.tiles[index].video_file != file_path:
+            return  # mpvのimportを待っている間に別のファイルがドロップされた
+        self.ensure_player(index)
+        load_log.info("Loading video %s: %s", index, file_path)
+        self.load_tile(index)
 
-            if selected_vo is None:
-                print("Error: No suitable video output found")
-                label.config(text="Error: No Video Output")
-                continue
+    def when_mpv_ready(self, func, *args):
+        # mpvのimportが終わっていればすぐにfuncを呼ぶ。バックグラウンドのimportが終わっていなければ、
+        # UIスレッドを止めないよう別スレッドで待ってからUIスレッドで呼ぶ
+        if mpv is not None:
+            return func(*args)
 
+        def wait():
             try:
-                player = mpv.MPV(vo=selected_vo,
-                               log_handler=self.log_handler,
-                               input_default_bindings=True,
-                               input_vo_keyboard=True,
-                               osc=True,
-                               hwdec='auto',
-                               keep_open='yes',
-                               idle=True,
-                               hr_seek='yes',
-                               wid=str(int(label.winfo_id())))
+                load_mpv()
             except Exception as e:
-                print(f"Failed to create player {i}: {e}")
-                label.config(text="Error: Player Creation Failed")
-                continue
+                player_log.error("Error importing mpv: %s", e)
+                return
+            self.call_in_ui(func, *args)
 
-            self.property_handlers[i] = {}
-            self.property_handlers[i]['end-file'] = lambda name, value: self.on_end_file(i, value)
-            self.property_handlers[i]['eof-reached'] = lambda name, value: self.on_eof_reached(i, value)
-            self.property_handlers[i]['idle'] = lambda name, value: self.on_idle(i, value)
-            player.observe_property('end-file', self.property_handlers[i]['end-file'])
-            player.observe_property('eof-reached', self.property_handlers[i]['eof-reached'])
-            player.observe_property('idle', self.property_handlers[i]['idle'])
-            self.players[i] = player
-            player.pause = True
-            player.volume = 50
-            player.loop_file = 'no'  # デフォルトでループオフ
-            print(f"Player {i} initialized with vo={selected_vo}, loop-file=no")
+        threading.Thread(target=wait, name="MpvWait", daemon=True).start()
 
-    def log_handler(self, loglevel, component, message):
-        print(f"[mpv {loglevel}] {component}: {message}")
+    def reset_tile_state(self, index, file_path):
+        # タイルのファイルが変わる時に、前のファイルについての状態を捨てる
+        tile = self.tiles[index]
+        tile.video_file = file_path
+        self.sync_engine.forget(index)
+        self.decode_scheduler.forget(index)
+        self.cache_budget.forget(index)
+        self.metrics.forget(index)
+        self.quality.forget(index)
+        if tile.quality_level:
+            self.apply_quality(index, 0)
+        tile.decode_plan = None
+        tile.cache_plan = None
+        tile.media = None
+        tile.stream_info = None
+        tile.duration = None
+        tile.position = None
+        tile.thumbnail_key = self.thumbnails.request(file_path) if file_path else None
+        tile.first_play = True
+        tile.ended = False
+        tile.label.config(text=os.path.basename(file_path) if file_path else "Drop video here")
+        if not file_path:
+            tile.progress_slider.config(to=100, state="disabled")
+            tile.progress_slider.set(0)
+            self.refresh_progress(index)
 
-    def reinitialize_player(self, index):
-        try:
-            if self.players[index]:
-                for prop in ['end-file', 'eof-reached', 'idle']:
-                    if prop in self.property_handlers[index]:
-                        try:
-                            self.players[index].unobserve_property(prop, self.property_handlers[index][prop])
-                            print(f"Player {index} unobserved property: {prop}")
-                        except Exception as e:
-                            print(f"Error unobserving {prop} for player {index}: {e}")
-                self.players[index].terminate()
-                self.players[index] = None
-            self.property_handlers[index] = {}
-            frame = self.player_frame.nametowidget(f"frame{index}")
-            vo_candidates = ['opengl', 'gpu', 'direct3d', 'win']
-            for vo in vo_candidates:
-                try:
-                    self.players[index] = mpv.MPV(wid=str(frame.winfo_id()), vo=vo, log_handler=self.log_handler,
-                                                 loglevel='info', keep_open='yes', hwdec='auto',
-                                                 demuxer_lavf_o='fps=24')
-                    self.property_handlers[index]['end-file'] = lambda name, value: self.on_end_file(index, value)
-                    self.property_handlers[index]['eof-reached'] = lambda name, value: self.on_eof_reached(index, value)
-                    self.property_handlers[index]['idle'] = lambda name, value: self.on_idle(index, value)
-                    self.players[index].observe_property('end-file', self.property_handlers[index]['end-file'])
-                    self.players[index].observe_property('eof-reached', self.property_handlers[index]['eof-reached'])
-                    self.players[index].observe_property('idle', self.property_handlers[index]['idle'])
-                    self.players[index].pause = True
-                    self.players[index].volume = 50
-                    self.players[index].loop_file = 'inf' if self.loop_enabled else 'no'  # 現在のループ状態を反映
-                    print(f"Player {index} reinitialized with vo={vo}, loop-file={'inf' if self.loop_enabled else 'no'}")
-                    return True
-                except Exception as e:
-                    print(f"Failed to reinitialize player {index} with vo={vo}: {e}")
-            self.players[index] = None
+    def clear_tile(self, index):
+        # セットのファイル数がタイル数より少ない場合、余ったタイルを空にする
+        tile = self.tiles[index]
+        self.loader.cancel(index)
+        self.reset_tile_state(index, None)
+        if tile.alive():
             try:
-                self.player_frame.nametowidget(f"frame{index}.label{index}").config(text="Error: Player Shutdown")
-            except KeyError:
-                print(f"Warning: Label for player {index} not found")
-            return False
-        except Exception as e:
-            print(f"Error reinitializing player {index}: {e}\n{traceback.format_exc()}")
-            self.players[index] = None
-            try:
-                self.player_frame.nametowidget(f"frame{index}.label{index}").config(text="Error: Player Shutdown")
-            except KeyError:
-                print(f"Warning: Label for player {index} not found")
-            return False
+                tile.player.command_async('stop')
+            except Exception as e:
+                load_log.error("Error stopping player %s: %s", index, e)
 
-    def on_end_file(self, index, value):
-        if not value or self.loop_enabled:
+    def open_sets(self, sets, source):
+        sets = [group[:len(self.tiles)] for group in sets if group]
+        if not sets:
+            load_log.warning("No comparison sets found in %s", source)
             return
+        load_log.info("Opened %d comparison sets from %s", len(sets), source)
+        self.discard_preload()
+        self.set_queue = SetQueue(sets)
+        self.show_set(0)
 
-        try:
-            player = self.players[index]
-            if not player or getattr(player, 'core_shutdown', False):
-                return
+    def step_set(self, delta):
+        if self.set_queue and self.set_queue.valid(self.set_queue.position + delta):
+            self.show_set(self.set_queue.position + delta)
 
-            # 動画が実際に終了位置に近い場合のみ処理を実行
-            try:
-                if player.time_pos and player.duration:
-                    if player.time_pos < (player.duration - 1.0):  # 終了1秒前までは無視
-                        return
-            except:
-                pass
+    def show_set(self, position):
+        started = time.perf_counter()
+        if self.compositor:
+            self.stop_compositor(resume=False)
+        if self.playing:
+            self.toggle_play()
+        self.set_queue.position = position
+        paths = self.set_queue.sets[position]
+        if self.preload and self.preload.position != position:
+            self.discard_preload()  # 別のセットを先読みしていた場合は、待機中のmpvをここで終了する
+        preload, self.preload = self.preload, None
+        swapped = []
+        for index in range(len(self.tiles)):
+            path = paths[index] if index < len(paths) else None
+            if path is None:
+                self.clear_tile(index)
+            elif preload and index in preload.ready() and preload.paths[index] == path:
+                self.swap_in_preloaded(index, preload.players.pop(index), path)
+                swapped.append(index)
+            else:
+                self.open_file(index, path)
+        if preload:
+            self.discard_preload(preload)
+        if swapped:
+            # 映像を有効にしたタイルの最初のフレームが揃うのを待って、読み込み完了の処理をする
+            def done(group):
+                for i in swapped:
+                    self.on_tile_loaded(i, preload.requests[i])
+                load_log.info("Switched to set %d/%d in %.0fms (%d preloaded, %d cold)", position + 1, len(self.set_queue),
+                              (time.perf_counter() - started) * 1000, len(swapped), len(paths) - len(swapped))
+            self.group_seek(0.0, resume=False, on_done=done)
+        else:
+            load_log.info("Loading set %d/%d cold", position + 1, len(self.set_queue))
+        self.update_set_controls()
+        self.start_preload(position + 1)
 
-            print(f"Video {index} end-file detected: {self.video_files[index]}")
-            if self.video_files[index]:
-                self.ended[index] = True
-                player.pause = True
-                # プログレスバーを最後まで移動
-                try:
-                    if player.duration and self.progress_sliders[index]:
-                        self.progress_sliders[index].set(player.duration)
-                except:
-                    pass
-                print(f"Video {index} paused at end")
-                self.check_all_ended()
-        except Exception as e:
-            print(f"Error handling end-file for video {index}: {e}\n{traceback.format_exc()}")
-            if self.reinitialize_player(index) and self.video_files[index]:
+    def update_set_controls(self):
+        sets, position = self.set_queue, self.set_queue.position
+        self.set_label.config(text=f"Set {position + 1}/{len(sets)}")
+        self.prev_set_button.config(state="normal" if sets.valid(position - 1) else "disabled")
+        self.next_set_button.config(state="normal" if sets.valid(position + 1) else "disabled")
+
+    def swap_in_preloaded(self, index, player, path):
+        # 先読み済みのプレーヤーをタイルに割り当てる。reinitialize_playerと同じ手順で古いプレーヤーを片付ける
+        tile = self.tiles[index]
+        self.loader.cancel(index)
+        self.seek_barrier.forget(index)
+        self.scrubber.forget(index)
+        old_player = tile.player
+        tile.player = None
+        if old_player:
+            self.unobserve_player(index, old_player)
+            threading.Thread(target=self.terminate_player, args=(index, old_player), daemon=True).start()
+        tile.quality_level = 0  # 先読みしたプレーヤーには表示レートのフィルタが付いていない
+        self.reset_tile_state(index, path)
+        self.media_probe.request(path, lambda p, media, idx=index: self.on_media_probed(idx, p, media))
+        bind_window(player, tile.wid)
+        self.observe_player(index, player)
+        player.volume = 0 if self.is_muted else tile.volume
+        player.loop_file = 'inf' if self.loop_enabled else 'no'
+        player.vid = 'auto'  # 先読み中は映像を無効にしているので、VOはここで描画先のウィンドウに作られる
+        tile.player = player
+        tile.first_play = False
+
+    def start_preload(self, position):
+        # 次のセットを待機用のmpvに読み込んでおく。mpvの作成は時間がかかるのでバックグラウンドで行う
+        self.discard_preload()
+        if self.set_queue is None or not self.set_queue.valid(position) or self.selected_vo is None:
+            return
+        preload = self.preload = Preload(position, self.set_queue.sets[position])
+
+        def create():
+            for index, path in enumerate(preload.paths):
                 try:
-                    player = self.players[index]
-                    player.loadfile(self.video_files[index], pause=True)
-                    if not self.loop_enabled:
-                        try:
-                            if player.duration:
-                                player.seek(player.duration - 0.1)
-                        except:
-                            pass
+                    player = self.player_pool.acquire() or self.new_player()
                 except Exception as e:
-                    print(f"Error reloading video {index}: {e}")
+                    load_log.error("Error creating preload player for %s: %s", path, e)
+                    continue
+                self.call_in_ui(self.preload_file, preload, index, player, path)
 
-    def on_eof_reached(self, index, value):
-        if not value or self.loop_enabled:
+        threading.Thread(target=create, name="Preload", daemon=True).start()
+
+    def preload_file(self, preload, index, player, path):
+        if preload is not self.preload:
+            threading.Thread(target=self.terminate_player, args=(index, player), daemon=True).start()
+            return  # 作成中にセットが切り替わった
+        preload.players[index] = player
+        self.preload_loader.attach(index, player)
+        options = dict(DecodePlan().options(), **CachePlan(CacheBudget.STANDBY_BYTES, 0).options(), vid='no')
+
+        def loaded(i, request):
+            if preload is self.preload:
+                preload.requests[i] = request
+                load_log.info("Preloaded set %d tile %d in %.0fms: %s", preload.position + 1, i + 1,
+                              request.latency * 1000, os.path.basename(request.path))
+
+        def failed(i, request):
+            load_log.warning("Failed to preload %s (%s)", path, request.error if request else "no player")
+            if preload.players.get(i) is player:
+                del preload.players[i]
+                threading.Thread(target=self.terminate_player, args=(i, player), daemon=True).start()
+
+        try:
+            self.preload_loader.load(index, player, path, loaded, failed, start=0, pause=True, options=options)
+        except Exception as e:
+            load_log.error("Error preloading %s: %s", path, e)
+            failed(index, None)
+
+    def discard_preload(self, preload=None):
+        preload = preload or self.preload
+        if preload is None:
             return
+        if preload is self.preload:
+            self.preload = None
+        for index, player in preload.players.items():
+            self.preload_loader.cancel(index)
+            threading.Thread(target=self.terminate_player, args=(index, player), daemon=True).start()
+        preload.players = {}
+
+    def load_tile(self, index, start=0, pause=True, on_done=None, retry=True):
+        # 非同期でファイルを読み込む。完了するとUIスレッドでスライダーを設定し、on_done(index, request)を呼ぶ
+        def loaded(i, request):
+            self.on_tile_loaded(i, request)
+            if on_done:
+                on_done(i, request)
+
+        def failed(i, request):
+            self.on_tile_load_failed(i, request)
+            if on_done:
+                on_done(i, request)
 
         try:
-            player = self.players[index]
+            player = self.tiles[index].player
             if not player or getattr(player, 'core_shutdown', False):
-                return
+                raise RuntimeError("no player instance")
+            # 差し替えたプレーヤーでも同じデコーダー/キャッシュ設定になるよう、読み込みごとに明示的に指定する
+            self.loader.load(index, player, self.tiles[index].video_file, loaded, failed, start=start, pause=pause,
+                             options=self.load_options(self.tiles[index]))
+        except Exception as e:
+            load_log.error("Error loading video %s: %s", index, e, exc_info=True)
+            if retry and self.reinitialize_player(index) and self.tiles[index].video_file:
+                self.load_tile(index, start, pause, on_done, retry=False)
+            else:
+                failed(index, None)
 
-            # 動画が実際に終了位置に近い場合のみ処理を実行
-            try:
-                if player.time_pos and player.duration:
-                    if player.time_pos < (player.duration - 1.0):  # 終了1秒前までは無視
-                        return
-            except:
-                pass
+    def load_tiles(self, indices, start=0, on_all_done=None):
+        # 複数のタイルを同時に読み込み、最も遅いファイルの完了時にon_all_done(requests)を呼ぶ
+        remaining = set(indices)
+        requests = {}
 
-            print(f"Video {index} eof-reached detected: {self.video_files[index]}")
-            if self.video_files[index]:
-                self.ended[index] = True
-                player.pause = True
-                # プログレスバーを最後まで移動
-                try:
-                    if player.duration and self.progress_sliders[index]:
-                        self.progress_sliders[index].set(player.duration)
-                except:
-                    pass
-                print(f"Video {index} paused at end")
-                self.check_all_ended()
-        except Exception as e:
-            print(f"Error handling eof-reached for video {index}: {e}\n{traceback.format_exc()}")
-            if self.reinitialize_player(index) and self.video_files[index]:
-                try:
-                    player = self.players[index]
-                    player.loadfile(self.video_files[index], pause=True)
-                    if not self.loop_enabled:
-                        try:
-                            if player.duration:
-                                player.seek(player.duration - 0.1)
-                        except:
-                            pass
-                except Exception as e:
-                    print(f"Error reloading video {index}: {e}")
+        def done(i, request):
+            remaining.discard(i)
+            requests[i] = request
+            if not remaining and on_all_done:
+                on_all_done(requests)
 
-    def on_idle(self, index, value):
-        if not value or self.loop_enabled:
+        if not remaining and on_all_done:
+            on_all_done(requests)
+        for i in indices:
+            self.load_tile(i, start=start, on_done=done)
+
+    def on_tile_loaded(self, index, request):
+        duration = request.duration
+        self.tiles[index].duration = duration
+        load_log.info("Loaded video %s in %.0fms: %s", index, request.latency * 1000, request.path)
+        self.check_video_output(index)
+        self.record_hwdec(index)
+        self.schedule_decoder(index)
+        self.budget_cache(index)
+        if not self.tiles[index].progress_slider:
             return
+        try:
+            if duration is not None and duration > 0:
+                self.tiles[index].progress_slider.config(to=duration, state="normal")
+                self.tiles[index].progress_slider.set(request.start or 0)
+                self.tiles[index].displayed_position = self.tiles[index].progress_slider.get()
+                load_log.debug("Player %s progress slider set to duration: %s", index, duration)
+            else:
+                self.tiles[index].progress_slider.config(to=100, state="disabled")
+                self.tiles[index].progress_slider.set(0)
+                load_log.debug("Player %s progress slider disabled: no duration", index)
+        except Exception as e:
+            load_log.error("Error setting up progress slider for player %s: %s", index, e)
 
+    def check_video_output(self, index):
+        # 待機用・先読み用から差し替えたプレーヤーが、タイルのウィンドウに映像を出せているか確かめる
+        tile = self.tiles[index]
+        if not (tile.media or {}).get('codec'):
+            return  # 映像があるかわからないファイル
         try:
-            player = self.players[index]
-            if not player or getattr(player, 'core_shutdown', False):
-                return
+            configured = tile.player['vo-configured']
+        except Exception as e:
+            player_log.debug("Cannot read vo-configured of player %s: %s", index, e)
+            return
+        if configured:
+            player_log.debug("Player %s renders into window %s", index, tile.wid)
+        else:
+            player_log.warning("Player %s has no video output after loading into window %s", index, tile.wid)
 
-            # 動画が実際に終了位置に近い場合のみ処理を実行
-            try:
-                if player.time_pos and player.duration:
-                    if player.time_pos < (player.duration - 1.0):  # 終了1秒前までは無視
-                        return
-            except:
-                pass
+    def on_media_probed(self, index, path, media):
+        # プレーヤーに読み込む前に、スライダーの範囲・ラベル・デコーダー設定を決めておく
+        tile = self.tiles[index]
+        if tile.video_file != path:
+            return  # 調べている間に別のファイルがドロップされた
+        tile.media = media
+        tile.label.config(text=f"{os.path.basename(path)}\n{media_summary(media)}")
+        if media.get('duration') and tile.duration is None:
+            tile.duration = media['duration']
+            tile.progress_slider.config(to=media['duration'])
+            self.refresh_progress(index)
+        if media.get('codec') and tile.stream_info is None:
+            tile.stream_info = StreamInfo.from_media(media)
+            self.decode_scheduler.set_stream(index, tile.stream_info)
+            self.rebalance_decoders()
+        self.budget_cache(index)
 
-            print(f"Video {index} idle detected: {self.video_files[index]}")
-            if self.video_files[index]:
-                self.ended[index] = True
-                player.pause = True
-                # プログレスバーを最後まで移動
-                try:
-                    if player.duration and self.progress_sliders[index]:
-                        self.progress_sliders[index].set(player.duration)
-                except:
-                    pass
-                print(f"Video {index} paused at end")
-                self.check_all_ended()
+    def schedule_decoder(self, index):
+        # 読み込んだファイルの解像度/コーデックをスケジューラーに渡し、全タイルの割り当てをやり直す
+        tile = self.tiles[index]
+        try:
+            info = tile.stream_info
+            if info is None:
+                info = tile.stream_info = StreamInfo.from_player(tile.player)
+                self.decode_scheduler.set_stream(index, info)
+                self.media_probe.remember(tile.video_file, dict(
+                    duration=tile.duration, width=info.width, height=info.height, fps=info.fps, codec=info.codec,
+                    bitrate=None, audio=None))
+            hwdec_current = tile.player.hwdec_current
         except Exception as e:
-            print(f"Error handling idle for video {index}: {e}\n{traceback.format_exc()}")
-            if self.reinitialize_player(index) and self.video_files[index]:
-                try:
-                    player = self.players[index]
-                    player.loadfile(self.video_files[index], pause=True)
-                    if not self.loop_enabled:
-                        try:
-                            if player.duration:
-                                player.seek(player.duration - 0.1)
-                        except:
-                            pass
-                except Exception as e:
-                    print(f"Error reloading video {index}: {e}")
+            decode_log.error("Error reading stream info for player %s: %s", index, e)
+            return
+        plan = tile.decode_plan or DecodePlan()
+        if plan.hwdec != 'no' and hwdec_current in (None, 'no') and info.codec in DecodeScheduler.HW_CODECS:
+            if self.decode_scheduler.hwdec_unavailable(index):
+                decode_log.info("Player %s hardware decoding unavailable for %s, using software decoding",
+                                index, info.codec)
+        self.rebalance_decoders()
 
-    def check_all_ended(self):
-        all_ended = all(self.ended[i] or self.video_files[i] is None for i in range(4))
-        if all_ended and self.playing:
-            self.playing = False
-            self.play_button.config(text="Play All")
-            print("All videos ended, button reset to Play All")
-            self.ended = [False] * 4
+    def on_tile_load_failed(self, index, request):
+        reason = request.error if request else "player unavailable"
+        load_log.warning("Failed to load video %s: %s (%s)", index, self.tiles[index].video_file, reason)
+        if self.tiles[index].progress_slider:
+            self.tiles[index].progress_slider.config(to=100, state="disabled")
+            self.tiles[index].progress_slider.set(0)
+        self.tiles[index].label.config(text="Error: Invalid Video")
 
-    def drop_file(self, event, index):
-        file_path = event.data
-        if file_path.startswith('{'):
-            file_path = file_path.lstrip('{').split('}')[0]
-        file_path = urllib.parse.unquote(file_path)
-        file_path = os.path.normpath(file_path)
-        if not os.path.exists(file_path):
-            print(f"Error: File not found: {file_path}")
-            for widget in event.widget.winfo_children():
-                widget.config(text="Error: File Not Found")
-            return
-        if file_path.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.gif')):
-            try:
-                self.video_files[index] = file_path
-                if not self.players[index] or self.players[index].core_shutdown:
-                    self.reinitialize_player(index)
-                self.players[index].loadfile(file_path)
-                time.sleep(0.1)
-                self.players[index].pause = True
-                self.first_play[index] = True
-                self.ended[index] = False
+    def recover_tile(self, index, start=None, seek_to_end=False, on_done=None):
+        # プレーヤーを差し替え、スナップショットからファイル・再生位置・一時停止状態を復元する
+        snapshot = self.snapshot_tile(index)
+
+        def loaded(i, request):
+            if seek_to_end and not self.loop_enabled and request and request.duration:
                 try:
-                    duration = self.players[index].duration
-                    if duration:
-                        self.progress_sliders[index].config(to=duration, state="normal")
-                        self.progress_sliders[index].set(0)
-                        print(f"Player {index} progress slider set to duration: {duration}")
-                    else:
-                        self.progress_sliders[index].config(to=100, state="disabled")
-                        print(f"Player {index} progress slider disabled: no duration")
+                    self.tiles[i].player.seek(request.duration - 0.1, reference="absolute")
                 except Exception as e:
-                    print(f"Error setting up progress slider for player {index}: {e}")
-                print(f"Loaded video {index}: {file_path}")
-                for widget in event.widget.winfo_children():
-                    widget.config(text=os.path.basename(file_path))
-            except Exception as e:
-                print(f"Error loading video {file_path}: {e}\n{traceback.format_exc()}")
-                if self.reinitialize_player(index) and self.video_files[index]:
-                    try:
-                        self.players[index].loadfile(file_path)
-                        time.sleep(0.1)
-                        self.players[index].pause = True
-                        print(f"Video {index} reinitialized and loaded: {file_path}")
-                        if self.progress_sliders[index]:
-                            duration = self.players[index].duration
-                            if duration is not None and duration > 0:
-                                self.progress_sliders[index].config(to=duration, state="normal")
-                                self.progress_sliders[index].set(0)
-                                print(f"Player {index} progress slider set to duration: {duration}")
-                            else:
-                                self.progress_sliders[index].config(to=100, state="disabled")
-                                self.progress_sliders[index].set(0)
-                                print(f"Player {index} progress slider disabled: no duration")
-                    except Exception as e2:
-                        print(f"Failed to load after reinitialization for video {index}: {e2}")
-                        for widget in event.widget.winfo_children():
-                            widget.config(text="Error: Invalid Video")
+                    load_log.error("Error seeking to end for video %s: %s", i, e)
+            if on_done:
+                on_done(i, request)
+
+        if self.reinitialize_player(index) and snapshot.path:
+            self.load_tile(index, start=snapshot.position if start is None else start,
+                           pause=snapshot.paused, on_done=loaded, retry=False)
+            return True
+        return False
 
     def create_buttons(self):
         self.button_frame = tk.Frame(self.bottom_frame)
@@ -409,165 +4234,756 @@ class VideoPlayerApp:
         self.layout_button.pack(side=tk.LEFT, padx=5)
         self.mute_button = tk.Button(button_inner_frame, text="Mute", command=self.toggle_mute)
         self.mute_button.pack(side=tk.LEFT, padx=5)
+        self.sync_button = tk.Button(button_inner_frame, text=self.sync_button_text(), command=self.toggle_sync)
+        self.sync_button.pack(side=tk.LEFT, padx=5)
+        self.compositor_button = tk.Button(button_inner_frame, text="Composite", command=self.toggle_compositor)
+        self.compositor_button.pack(side=tk.LEFT, padx=5)
+        self.prev_set_button = tk.Button(button_inner_frame, text="< Set", command=lambda: self.step_set(-1), state="disabled")
+        self.prev_set_button.pack(side=tk.LEFT, padx=(15, 2))
+        self.set_label = tk.Label(button_inner_frame, text="No sets", width=9, font=("Arial", 8))
+        self.set_label.pack(side=tk.LEFT)
+        self.next_set_button = tk.Button(button_inner_frame, text="Set >", command=lambda: self.step_set(1), state="disabled")
+        self.next_set_button.pack(side=tk.LEFT, padx=(2, 15))
+        metrics_button = tk.Button(button_inner_frame, text="Metrics", command=self.toggle_metrics_panel)
+        metrics_button.pack(side=tk.LEFT, padx=5)
+        if self.exporter.available:
+            export_button = tk.Button(button_inner_frame, text="Export", command=self.open_export)
+            export_button.pack(side=tk.LEFT, padx=5)
+        if self.analyzer.available:
+            analyze_button = tk.Button(button_inner_frame, text="Analyze", command=self.open_analysis)
+            analyze_button.pack(side=tk.LEFT, padx=5)
+        if self.log_ring is not None:
+            log_button = tk.Button(button_inner_frame, text="Log", command=self.open_log_viewer)
+            log_button.pack(side=tk.LEFT, padx=5)
+
+        # 全タイルを同じ位置へシークするスライダー。ドラッグ中は高速シーク、離した時点で正確な位置に揃える
+        group_frame = tk.Frame(self.button_frame)
+        group_frame.pack(fill=tk.X, padx=10, pady=(4, 0))
+        tk.Label(group_frame, text="All", font=("Arial", 8)).pack(side=tk.LEFT, padx=(0, 5))
+        self.group_slider = tk.Scale(group_frame, from_=0, to=100, resolution=0.05, orient=tk.HORIZONTAL, width=10,
+                                     showvalue=0, state="disabled", sliderrelief="raised", sliderlength=15, troughcolor="gray",
+                                     command=self.scrub_group)
+        self.group_slider.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.group_time_label = tk.Label(group_frame, text="--:-- / --:--", width=13, font=("Arial", 8), anchor="w")
+        self.group_time_label.pack(side=tk.LEFT, padx=(5, 0))
+        self.group_slider.bind('<ButtonPress-1>', self.on_group_slider_press)
+        self.group_slider.bind('<ButtonRelease-1>', self.on_group_slider_release)
+
+    def open_log_viewer(self):
+        # 直近のログを表示するウィンドウ。開いている間だけ新しい行を取り込む
+        if self.log_window is not None:
+            self.log_window.lift()
+            return
+        self.log_window = tk.Toplevel(self.root)
+        self.log_window.title("Simul PB Log")
+        self.log_window.geometry("900x300")
+        scrollbar = tk.Scrollbar(self.log_window)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.log_text = tk.Text(self.log_window, wrap="none", font=("Consolas", 9), yscrollcommand=scrollbar.set)
+        self.log_text.pack(fill=tk.BOTH, expand=True)
+        scrollbar.config(command=self.log_text.yview)
+        self.log_window.protocol("WM_DELETE_WINDOW", self.close_log_viewer)
+        self.log_serial = 0
+        self.refresh_log_viewer()
+
+    def refresh_log_viewer(self):
+        lines, self.log_serial = self.log_ring.lines_since(self.log_serial)
+        if lines:
+            at_bottom = self.log_text.yview()[1] >= 0.999
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            # 表示する行数はリングバッファと同じだけにする
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - self.log_ring.records.maxlen
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            if at_bottom:
+                self.log_text.see(tk.END)
+        self.log_refresh_id = self.root.after(500, self.refresh_log_viewer)
+
+    def close_log_viewer(self):
+        self.root.after_cancel(self.log_refresh_id)
+        self.log_window.destroy()
+        self.log_window = None
+
+    def open_export(self):
+        # 今の並び・音量・各タイルの再生位置のずれのまま、指定した範囲を1本の動画に書き出す
+        if self.export_window is not None:
+            self.export_window.lift()
+            return
+        if not any(tile.video_file for tile in self.tiles):
+            export_log.warning("Nothing to export, drop videos first")
+            return
+        longest = max((tile.duration or (tile.media or {}).get('duration') or 0.0) for tile in self.tiles if tile.video_file)
+        self.export_window = tk.Toplevel(self.root)
+        self.export_window.title("Simul PB Export")
+        self.export_window.protocol("WM_DELETE_WINDOW", self.close_export)
+        frame = tk.Frame(self.export_window)
+        frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Label(frame, text="Range", font=("Arial", 8)).pack(side=tk.LEFT)
+        self.export_range = tk.Entry(frame, width=20)
+        self.export_range.insert(0, f"0:00-{format_time(math.ceil(longest))}")
+        self.export_range.pack(side=tk.LEFT, padx=5)
+        self.export_button = tk.Button(frame, text="Save as...", command=self.start_export)
+        self.export_button.pack(side=tk.LEFT, padx=5)
+        self.export_status = tk.Label(self.export_window, text="Range is start-end in [h:]mm:ss of the reference tile",
+                                      anchor="w", width=60, font=("Arial", 8))
+        self.export_status.pack(fill=tk.X, padx=10, pady=(0, 5))
+        self.export_longest = longest
+
+    def start_export(self):
+        try:
+            start, end = parse_range(self.export_range.get())
+        except ValueError as e:
+            self.export_status.config(text=f"Invalid range: {e}")
+            return
+        end = end or self.export_longest
+        output = filedialog.asksaveasfilename(parent=self.export_window, defaultextension=".mp4",
+                                              filetypes=[("MP4", "*.mp4"), ("Matroska", "*.mkv")])
+        if not output:
+            return
+        # 基準のタイルとの再生位置の差をそのまま残す (同期していれば実質0)
+        reference = self.group_reference()
+        base = (reference.position or 0.0) if reference else 0.0
+        tiles = [tile for tile in self.tiles if tile.video_file]
+        offsets = {tile.index: (tile.position or 0.0) - base for tile in tiles}
+        offsets = {index: offset if abs(offset) >= 0.05 else 0.0 for index, offset in offsets.items()}
+        inputs = [(tile.index, tile.video_file, offsets[tile.index], track_counts(tile.media))
+                  for tile in tiles]
+        rows, cols, visible = self.layout_shape()
+        args = self.exporter.command(inputs, rows, cols, visible, self.compositor_volumes(), start, end, output)
+        export_log.info("Exporting %s-%s as %dx%d to %s (offsets %s)", format_time(start), format_time(end), rows, cols,
+                        output, {f"P{i + 1}": round(o, 3) for i, o in offsets.items() if o})
+        self.export_button.config(text="Cancel", command=self.exporter.cancel)
+
+        def run():
+            try:
+                elapsed = self.exporter.run(args, lambda done, fps, speed: self.call_in_ui(
+                    self.on_export_progress, done, end - start, fps, speed))
+                self.call_in_ui(self.on_export_done, output, end - start, elapsed, None)
+            except (OSError, RuntimeError) as e:
+                self.call_in_ui(self.on_export_done, output, end - start, None, str(e))
+
+        threading.Thread(target=run, name="Export", daemon=True).start()
+
+    def on_export_progress(self, done, total, fps, speed):
+        if self.export_window is not None:
+            self.export_status.config(text=f"Exporting {format_time(done)} / {format_time(total)} "
+                                           f"({done / total * 100:.0f}%, {fps:.0f} fps, {speed:.1f}x real time)")
+
+    def on_export_done(self, output, total, elapsed, error):
+        if error:
+            export_log.error("Export to %s failed: %s", output, error)
+        else:
+            export_log.info("Exported %s in %.1fs (%.1fx real time)", output, elapsed, total / elapsed)
+        if self.export_window is not None:
+            self.export_status.config(text=f"Failed: {error}" if error else
+                                      f"Saved {os.path.basename(output)} in {elapsed:.1f}s ({total / elapsed:.1f}x real time)")
+            self.export_button.config(text="Save as...", command=self.start_export)
+
+    def close_export(self):
+        self.exporter.cancel()
+        self.export_window.destroy()
+        self.export_window = None
+
+    def open_analysis(self):
+        # P1を基準に他のタイルのフレームごとのPSNR/SSIMを求め、スライダーと同じ時間軸のグラフで表示する
+        if self.analysis_window is not None:
+            self.analysis_window.lift()
+            return
+        reference = self.tiles[0]
+        others = {tile.index: tile.video_file for tile in self.tiles[1:] if tile.video_file}
+        if not reference.video_file or not others:
+            analysis_log.warning("Quality analysis needs a reference video in P1 and at least one other video")
+            return
+        media = reference.media or {}
+        fps = media.get('fps') or (reference.stream_info.fps if reference.stream_info else 30.0)
+        # 比較は幅640までに縮小した輝度で行う (全タイルを基準の縦横比に合わせる)
+        source_w, source_h = media.get('width') or 1920, media.get('height') or 1080
+        width = min(640, source_w) // 2 * 2
+        height = max(2, round(width * source_h / source_w / 2) * 2)
+        self.analysis_fps = fps
+        self.analysis_duration = reference.duration or media.get('duration')
+        self.analysis_window = tk.Toplevel(self.root)
+        self.analysis_window.title("Simul PB Quality (reference: P1)")
+        self.analysis_window.geometry(f"800x{40 + 100 * len(others)}")
+        self.analysis_window.protocol("WM_DELETE_WINDOW", self.close_analysis)
+        self.analysis_status = tk.Label(self.analysis_window, text="Starting...", anchor="w", font=("Arial", 8))
+        self.analysis_status.pack(fill=tk.X, padx=5)
+        self.analysis_rows = {}
+        for index in others:
+            label = tk.Label(self.analysis_window, text=f"P{index + 1}", anchor="w", font=("Consolas", 9))
+            label.pack(fill=tk.X, padx=5)
+            canvas = tk.Canvas(self.analysis_window, height=70, bg="white", highlightthickness=0)
+            canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+            canvas.bind('<Button-1>', lambda e, c=canvas: self.seek_from_curve(e, c))
+            canvas.bind('<Configure>', lambda e: self.draw_analysis())
+            self.analysis_rows[index] = (label, canvas)
+        self.analysis_drawn = {}  # タイル番号 -> 描いた時の (フレーム数, 幅, 高さ)
+        analysis_log.info("Analyzing %s against %s at %dx%d, %.3f fps", list(others.values()), reference.video_file,
+                          width, height, fps)
+        self.analyzer.start(reference.video_file, others, fps, (width, height),
+                            on_done=lambda error: self.call_in_ui(self.on_analysis_done, error))
+        self.refresh_analysis()
+
+    def refresh_analysis(self):
+        analyzer = self.analyzer
+        if analyzer.running:
+            speed = analyzer.frames / analyzer.fps / analyzer.elapsed if analyzer.elapsed else 0.0
+            self.analysis_status.config(text=f"Analyzing: {analyzer.frames} frames, {speed:.1f}x real time")
+        self.draw_analysis()
+        self.analysis_refresh_id = self.root.after(200, self.refresh_analysis)
+
+    def draw_analysis(self):
+        # PSNR (青, 20-60dB) とSSIM (橙, 最小値-1) の曲線と、P1の再生位置を描く。曲線は結果が増えた時だけ描き直す
+        if self.analysis_window is None:
+            return
+        snapshot = None
+        frames = self.analyzer.frames
+        duration = self.analysis_duration or max(frames / self.analysis_fps, 1.0)
+        for index, (label, canvas) in self.analysis_rows.items():
+            width, height = canvas.winfo_width(), canvas.winfo_height()
+            if width < 2 or height < 2:
+                continue
+            if self.analysis_drawn.get(index) != (frames, width, height):
+                self.analysis_drawn[index] = (frames, width, height)
+                snapshot = snapshot or self.analyzer.snapshot()
+                psnr, ssim = snapshot.get(index, ([], []))
+                curve = QualityCurve()
+                curve.psnr, curve.ssim = psnr, ssim
+                label.config(text=f"P{index + 1}: {curve.summary()}")
+                canvas.delete("curve")
+                ssim_low = min(min(ssim, default=0.9), 0.99)
+                for values, low, high, color in ((psnr, 20.0, 60.0, "steelblue"), (ssim, ssim_low, 1.0, "darkorange")):
+                    points = curve_points(values, self.analysis_fps, duration, width, height, low, high)
+                    if len(points) >= 4:
+                        canvas.create_line(*points, fill=color, tags="curve")
+            canvas.delete("playhead")
+            position = self.tiles[0].position
+            if position is not None:
+                x = position / duration * width
+                canvas.create_line(x, 0, x, height, fill="red", tags="playhead")
+
+    def seek_from_curve(self, event, canvas):
+        # グラフをクリックした位置へ全タイルをシークする
+        duration = self.analysis_duration or self.analyzer.frames / self.analysis_fps
+        if duration and canvas.winfo_width() > 0:
+            self.group_seek(max(0.0, event.x / canvas.winfo_width() * duration))
+
+    def on_analysis_done(self, error):
+        if self.analysis_window is None:
+            return
+        analyzer = self.analyzer
+        speed = analyzer.frames / analyzer.fps / analyzer.elapsed if analyzer.elapsed else 0.0
+        self.analysis_status.config(text=f"Error: {error}" if error else
+                                    f"Done: {analyzer.frames} frames in {analyzer.elapsed:.1f}s ({speed:.1f}x real time)")
+        self.analysis_drawn = {}
+        self.draw_analysis()
+
+    def close_analysis(self):
+        self.analyzer.cancel(wait=False)
+        self.root.after_cancel(self.analysis_refresh_id)
+        self.analysis_window.destroy()
+        self.analysis_window = None
+
+    def metric_targets(self):
+        # メトリクス収集スレッドから呼ばれる
+        return [(tile.index, tile.player) for tile in self.tiles if tile.video_file and tile.alive()]
+
+    def toggle_metrics_panel(self):
+        # タイルごとの再生状況を1秒ごとに表示する
+        if self.metrics_window is not None:
+            self.close_metrics_panel()
+            return
+        self.metrics_window = tk.Toplevel(self.root)
+        self.metrics_window.title("Simul PB Metrics")
+        self.metrics_window.protocol("WM_DELETE_WINDOW", self.close_metrics_panel)
+        headers = ["Tile", "FPS (out/file)", "VO drops/s", "Dec drops/s", "Delayed", "A/V ms", "Cache s", "Cache MB", "Used/limit MB", "Speed"]
+        for column, text in enumerate(headers):
+            tk.Label(self.metrics_window, text=text, font=("Arial", 8, "bold"), padx=6).grid(row=0, column=column, sticky="e")
+        self.metrics_labels = {}
+        for tile in self.tiles:
+            row = []
+            for column in range(len(headers)):
+                label = tk.Label(self.metrics_window, text=f"P{tile.index + 1}" if column == 0 else "-", font=("Consolas", 9), padx=6)
+                label.grid(row=tile.index + 1, column=column, sticky="e")
+                row.append(label)
+            self.metrics_labels[tile.index] = row
+        self.refresh_metrics_panel()
+
+    def refresh_metrics_panel(self):
+        latest = self.metrics.latest()
+
+        def fmt(value, spec, scale=1):
+            return "-" if value is None else format(value * scale, spec)
+
+        for index, row in self.metrics_labels.items():
+            values, rates = latest.get(index, ({}, {}))
+            texts = [f"{fmt(values.get('output_fps'), '.1f')}/{fmt(values.get('container_fps'), '.1f')}",
+                     fmt(rates.get('vo_drops'), '.1f'), fmt(rates.get('decoder_drops'), '.1f'),
+                     fmt(values.get('delayed'), 'd'), fmt(values.get('avsync'), '+.0f', 1000),
+                     fmt(values.get('cache_seconds'), '.1f'), fmt(values.get('cache_bytes'), '.1f', 1 / 1e6),
+                     f"{fmt(values.get('cache_total'), '.0f', 1 / 1e6)}/{fmt(self.cache_limit(index), '.0f', 1 / 1e6)}",
+                     fmt(values.get('speed'), '.3f')]
+            # フレームを落としているタイルは赤で表示する
+            dropping = any((rates.get(k) or 0) > 0 for k in ("vo_drops", "decoder_drops"))
+            for label, text in zip(row[1:], texts):
+                label.config(text=text, fg="red" if dropping else "black")
+        self.metrics_refresh_id = self.root.after(int(self.metrics.interval * 1000), self.refresh_metrics_panel)
+
+    def cache_limit(self, index):
+        plan = self.tiles[index].cache_plan
+        return plan.forward + plan.back if plan else None
+
+    def close_metrics_panel(self):
+        self.root.after_cancel(self.metrics_refresh_id)
+        self.metrics_window.destroy()
+        self.metrics_window = None
+
+    def sync_button_text(self):
+        if self.sync_mode is None:
+            return "Sync Off"
+        if self.sync_mode == SyncEngine.MASTER_CLOCK:
+            return "Sync: Clock"
+        return f"Sync: P{self.sync_mode + 1}"
+
+    def sync_targets(self):
+        # 同期エンジンのスレッドから呼ばれる。再生中で終了していないプレーヤーのみを対象にする
+        return [(tile.index, tile.player) for tile in self.tiles
+                if tile.video_file and not tile.ended and tile.alive()]
+
+    def toggle_sync(self):
+        # 同期モードを順番に切り替え: 壁時計 -> P1 -> ... -> PN -> オフ
+        current_index = self.sync_modes.index(self.sync_mode)
+        self.sync_mode = self.sync_modes[(current_index + 1) % len(self.sync_modes)]
+        if self.sync_mode is None:
+            self.sync_engine.pause()
+        else:
+            self.sync_engine.set_master(self.sync_mode)
+            if self.playing:
+                self.start_sync()
+        self.sync_button.config(text=self.sync_button_text())
+
+    def start_sync(self):
+        if self.sync_mode is None or self.shuttle_speed < 0:
+            return  # 逆再生中は補正しない
+        # 壁時計の基準位置はマスター(壁時計の場合は先頭のプレーヤー)の現在位置
+        position = 0.0
+        targets = self.sync_targets()
+        master = [p for i, p in targets if i == self.sync_mode] or [p for _, p in targets]
+        if master:
+            try:
+                position = master[0].time_pos or 0.0
+            except Exception as e:
+                sync_log.error("Error reading sync base position: %s", e)
+        self.sync_engine.resume(position)
+
+    def print_sync_report(self):
+        for line in self.sync_engine.report():
+            sync_log.info("%s", line)
 
     def create_sliders(self):
-        for i in range(4):
-            progress_slider = tk.Scale(self.player_frame, from_=0, to=100, orient=tk.HORIZONTAL, length=300, width=10,
+        for tile in self.tiles:
+            i = tile.index
+            progress_slider = tk.Scale(self.player_frame, from_=0, to=100, resolution=0.05, orient=tk.HORIZONTAL, length=300, width=10,
                                   showvalue=0, state="disabled", sliderrelief="raised", sliderlength=15,
                                   troughcolor="gray", command=lambda value, idx=i: self.seek_position(value, idx),
                                   name=f"progress_slider{i}")
             progress_slider.set(0)
+            progress_slider.bind('<ButtonPress-1>', lambda e, idx=i: self.on_progress_press(e, idx))
+            progress_slider.bind('<ButtonRelease-1>', lambda e, idx=i: self.on_progress_release(e, idx))
+            progress_slider.bind('<Motion>', lambda e, idx=i: self.show_preview(e, idx))
+            progress_slider.bind('<Leave>', self.hide_preview)
             volume_frame = tk.Frame(self.player_frame, name=f"volume_frame{i}")
             volume_slider = tk.Scale(volume_frame, from_=0, to=100, orient=tk.HORIZONTAL, length=100, width=10,
                                     showvalue=0, command=lambda value, idx=i: self.set_volume(value, idx), name=f"slider{i}")
             volume_slider.set(50)
+            time_label = tk.Label(volume_frame, text="--:-- / --:--", width=13, font=("Arial", 8), anchor="w")
+            time_label.pack(side=tk.LEFT, padx=(2, 0), anchor="center")
             volume_label = tk.Label(volume_frame, text=f"Vol: {volume_slider.get()}", width=8, font=("Arial", 8), anchor="e")
             volume_label.pack(side=tk.LEFT, padx=(2, 5), anchor="center")
             volume_slider.pack(side=tk.LEFT, padx=2, anchor="center")
-            if self.layout_mode == "2x2":
-                progress_slider.grid(row=2*(i//2)+1, column=2*(i%2), padx=5, pady=5, sticky="ew")
-                volume_frame.grid(row=2*(i//2)+1, column=2*(i%2)+1, padx=5, pady=5, sticky="w")
-            else:
-                progress_slider.grid(row=1, column=2*i, padx=5, pady=(5, 0), sticky="ew")
-                volume_frame.grid(row=1, column=2*i+1, padx=5, pady=(5, 0), sticky="w")
-            self.progress_sliders[i] = progress_slider
-            self.volume_labels[i] = volume_label
+            tile.progress_slider = progress_slider
+            tile.volume_frame = volume_frame
+            tile.volume_slider = volume_slider
+            tile.volume_label = volume_label
+            tile.time_label = time_label
 
     def update_progress(self):
-        for i in range(4):
-            try:
-                player = self.players[i]
-                if (player and not getattr(player, 'core_shutdown', False) and
-                    self.video_files[i] and not player.pause and not player.idle_active and
-                    self.progress_sliders[i]):
-                    time_pos = player.time_pos
-                    if time_pos is not None:
-                        try:
-                            current_value = self.progress_sliders[i].get()
-                            if abs(current_value - time_pos) > 0.5:  # 0.5秒以上の差がある場合のみ更新
-                                self.progress_sliders[i].set(time_pos)
-                                print(f"Player {i} progress updated to {time_pos} seconds")
-                        except Exception as e:
-                            print(f"Error setting progress slider for player {i}: {e}")
+        # mpvから通知されたtime-pos/durationをまとめて反映する。同じプレーヤーの古い値は捨てて最新値だけを使う
+        latest = {}
+        while True:
+            try:
+                index, name, value = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            latest[(index, name)] = value
+        changed = set()
+        for (index, name), value in latest.items():
+            if name == 'duration':
+                self.tiles[index].duration = value
+            else:
+                self.tiles[index].position = value
+            changed.add(index)
+        for i in changed:
+            try:
+                self.refresh_progress(i)
             except Exception as e:
-                print(f"Error updating progress for player {i}: {e}\n{traceback.format_exc()}")
-        self.update_progress_id = self.root.after(1000, self.update_progress)
+                ui_log.error("Error updating progress for player %s: %s", i, e, exc_info=True)
+        if changed:
+            self.refresh_group_progress()
+        self.update_progress_id = self.root.after(self.progress_interval_ms, self.update_progress)
+
+    def refresh_progress(self, index):
+        position = self.tiles[index].position if self.tiles[index].video_file else None
+        duration = self.tiles[index].duration if self.tiles[index].video_file else None
+        slider = self.tiles[index].progress_slider
+        if slider and position is not None and slider.cget("state") == "normal" and not self.tiles[index].scrubbing:
+            if abs(slider.get() - position) >= slider.cget("resolution"):
+                slider.set(position)
+                # スライダーのコマンドは後から呼ばれるので、自分で設定した値を覚えておきシークと区別する
+                self.tiles[index].displayed_position = slider.get()
+        if self.tiles[index].time_label:
+            remaining = duration - position if duration is not None and position is not None else None
+            self.tiles[index].time_label.config(
+                text=f"{format_time(position)} / -{format_time(remaining)}" if position is not None else "--:-- / --:--")
 
     def seek_position(self, value, index):
+        tile = self.tiles[index]
+        if self.compositor:
+            # 合成モードでは時計が1つなので、どのタイルのスライダーでも全体をシークする
+            if tile.scrubbing and float(value) != tile.displayed_position:
+                self.scrubber.request(self.COMPOSITOR, self.compositor.player, float(value))
+            return
         try:
-            player = self.players[index]
-            if player and not getattr(player, 'core_shutdown', False) and self.video_files[index]:
-                current_pos = player.time_pos
+            player = tile.player
+            if player and not getattr(player, 'core_shutdown', False) and tile.video_file:
                 target_pos = float(value)
+                if target_pos == tile.displayed_position:
+                    return  # update_progressによる表示更新
+                if tile.scrubbing:
+                    # ドラッグ中はキーフレームへの高速シーク。古い要求はScrubberが捨てる
+                    self.scrubber.request(index, player, target_pos)
+                    self.rebase_sync_after_seek(index, target_pos)
+                    return
+                current_pos = tile.position or 0.0
                 if abs(current_pos - target_pos) > 0.5:  # 0.5秒以上の差がある場合のみシーク
                     player.seek(target_pos, reference="absolute")
-                    print(f"Player {index} seek to {target_pos} seconds")
-                    self.root.update_idletasks()
+                    seek_log.debug("Player %s seek to %s seconds", index, target_pos)
+                    self.rebase_sync_after_seek(index, target_pos)
         except Exception as e:
-            print(f"Error seeking position for player {index}: {e}\n{traceback.format_exc()}")
-            if self.reinitialize_player(index) and self.video_files[index]:
-                try:
-                    self.players[index].loadfile(self.video_files[index])
-                    time.sleep(0.1)
-                    self.players[index].pause = True
-                    self.players[index].seek(float(value), reference="absolute")
-                    print(f"Player {index} reinitialized and seek to {value} seconds")
-                except Exception as e2:
-                    print(f"Failed to seek after reinitialization for player {index}: {e2}")
+            seek_log.error("Error seeking position for player %s: %s", index, e, exc_info=True)
+            if self.recover_tile(index, start=float(value)):
+                seek_log.info("Player %s reinitialized and loading at %s seconds", index, value)
+
+    def rebase_sync_after_seek(self, index, position):
+        if self.sync_mode is not None and self.sync_mode in (SyncEngine.MASTER_CLOCK, index):
+            # マスターがシークされた場合はフォロワーも追従させる
+            self.sync_engine.rebase(position)
+
+    def on_progress_press(self, event, index):
+        self.tiles[index].scrubbing = True
+        self.set_focus(index)
+
+    def show_preview(self, event, index):
+        # スライダー上のマウス位置の縮小画像を表示する。画像はバックグラウンドで作成済みのものだけを使う
+        tile = self.tiles[index]
+        slider = tile.progress_slider
+        if slider.cget("state") != "normal" or not tile.video_file:
+            return self.hide_preview()
+        position = float(slider.tk.call(slider._w, 'get', event.x, event.y))
+        entry = self.thumbnails.get(tile.thumbnail_key) if tile.thumbnail_key else None
+        image = None
+        text = format_time(position)
+        if entry is not None:
+            image = self.preview_image(entry.thumbnail_path(position))
+            keyframe = entry.keyframe_before(position)
+            if keyframe is not None:
+                text += f"  (key {format_time(keyframe)})"
+        elif self.thumbnails.available and tile.thumbnail_key:
+            text += "  (indexing...)"
+        if self.preview_window is None:
+            self.preview_window = tk.Toplevel(self.root)
+            self.preview_window.overrideredirect(True)
+            self.preview_window.attributes('-topmost', True)
+            self.preview_label = tk.Label(self.preview_window, bg="black", fg="white", font=("Arial", 8), compound="top")
+            self.preview_label.pack()
+        self.preview_label.config(image=image or "", text=text)
+        self.preview_label.image = image
+        self.preview_window.update_idletasks()
+        width = self.preview_window.winfo_reqwidth()
+        height = self.preview_window.winfo_reqheight()
+        x = slider.winfo_rootx() + event.x - width // 2
+        y = slider.winfo_rooty() - height - 4
+        self.preview_window.geometry(f"+{x}+{y}")
+        self.preview_window.deiconify()
+
+    def preview_image(self, path, limit=64):
+        if path is None:
+            return None
+        image = self.preview_images.get(path)
+        if image is None:
+            try:
+                image = tk.PhotoImage(file=path)
+            except tk.TclError:
+                return None
+            self.preview_images[path] = image
+            while len(self.preview_images) > limit:
+                self.preview_images.popitem(last=False)
+        else:
+            self.preview_images.move_to_end(path)
+        return image
+
+    def hide_preview(self, event=None):
+        if self.preview_window is not None:
+            self.preview_window.withdraw()
+
+    def on_progress_release(self, event, index):
+        tile = self.tiles[index]
+        if not tile.scrubbing:
+            return
+        tile.scrubbing = False
+        slider = tile.progress_slider
+        if self.compositor and tile.video_file:
+            tile.displayed_position = float(slider.get())
+            self.scrubber.finish(self.COMPOSITOR, self.compositor.player, tile.displayed_position)
+            return
+        if slider.cget("state") != "normal" or not tile.alive() or not tile.video_file:
+            return
+        target_pos = float(slider.get())
+        # この後に遅れて呼ばれるスライダーのコマンドでもう一度シークしないようにする
+        tile.displayed_position = target_pos
+        if tile.position is not None and abs(tile.position - target_pos) < slider.cget("resolution"):
+            return  # つまみをクリックしただけ
+        self.scrubber.finish(index, tile.player, target_pos)
+        self.rebase_sync_after_seek(index, target_pos)
+        seek_log.debug("Player %s seek to %s seconds", index, target_pos)
+
+    def group_reference(self):
+        # 全体スライダーに表示するタイル。同期のマスターがプレーヤーならそれ、それ以外は先頭の読み込み済みタイル
+        loaded = [tile for tile in self.tiles if tile.video_file and tile.duration]
+        for tile in loaded:
+            if tile.index == self.sync_mode:
+                return tile
+        return loaded[0] if loaded else None
+
+    def refresh_group_progress(self):
+        durations = [tile.duration for tile in self.tiles if tile.video_file and tile.duration]
+        if not durations:
+            self.group_slider.config(state="disabled")
+            self.group_time_label.config(text="--:-- / --:--")
+            return
+        self.group_slider.config(to=max(durations), state="normal")
+        if self.group_slider_dragging:
+            return
+        reference = self.group_reference()
+        if reference and reference.position is not None:
+            self.group_slider.set(reference.position)
+            self.group_time_label.config(text=f"{format_time(reference.position)} / {format_time(max(durations))}")
+
+    def on_group_slider_press(self, event):
+        self.group_slider_dragging = True
+
+    def scrub_group(self, value):
+        # ドラッグ中は全タイルをキーフレーム単位で追従させ、離した時点でgroup_seekが正確な位置へ揃える
+        if not self.group_slider_dragging:
+            return  # refresh_group_progressによる表示更新
+        position = float(value)
+        if self.compositor:
+            self.scrubber.request(self.COMPOSITOR, self.compositor.player, position)
+            return
+        for tile in self.tiles:
+            if tile.video_file and tile.alive():
+                target = position if not tile.duration else min(position, max(tile.duration - 0.1, 0.0))
+                self.scrubber.request(tile.index, tile.player, target)
+
+    def on_group_slider_release(self, event):
+        self.group_slider_dragging = False
+        if self.group_slider.cget("state") == "normal":
+            self.group_seek(float(self.group_slider.get()))
+
+    def group_seek(self, position, resume=None, on_done=None):
+        # 全タイルを一時停止して同じ位置へ同時にシークし、全員の最初のフレームが揃ってからまとめて再生を再開する。
+        # resumeがNoneなら再生中だった場合のみ再開する
+        resume = self.playing if resume is None else resume
+        if self.compositor:
+            self.scrubber.finish(self.COMPOSITOR, self.compositor.player, position)
+            return None
+        self.sync_engine.pause()
+        targets = []
+        for tile in self.tiles:
+            if not (tile.video_file and tile.alive()):
+                continue
+            try:
+                tile.player.pause = True
+            except Exception as e:
+                seek_log.error("Error pausing video %s for group seek: %s", tile.index, e)
+                continue
+            # 短いファイルは末尾で止める
+            target = position if not tile.duration else min(position, max(tile.duration - 0.1, 0.0))
+            tile.first_play = False
+            tile.ended = False
+            self.scrubber.forget(tile.index)  # ドラッグ中の高速シークが後から割り込まないようにする
+            targets.append((tile.index, tile.player, target))
+
+        def done(group):
+            seek_log.info("group seek %s, all ready in %.0fms",
+                          group.summary(), (time.perf_counter() - group.started) * 1000)
+            for i, reason in group.errors.items():
+                if reason.startswith("error"):
+                    self.recover_tile(i, start=position, on_done=lambda i, request: (
+                        resume and self.playing and request and not request.error and self.start_playback([i])))
+            if resume and self.playing:
+                self.start_playback(sorted(group.latencies))
+            if on_done:
+                on_done(group)
+
+        return self.seek_barrier.seek(targets, position, done)
 
     def toggle_play(self):
         self.playing = not self.playing
-        for i, player in enumerate(self.players):
-            if self.video_files[i] is not None and player and not getattr(player, 'core_shutdown', False):
+        if self.playing:
+            self.apply_shuttle()
+        else:
+            self.sync_engine.pause()
+            self.shuttle_speed = 1.0  # 一時停止したら次は通常の再生に戻す
+        if self.compositor:
+            try:
+                self.compositor.player.pause = not self.playing
+                player_log.info("%s compositor", "Playing" if self.playing else "Paused")
+            except Exception as e:
+                player_log.error("Error toggling play/pause for compositor: %s", e)
+            self.play_button.config(text="Pause All" if self.playing else "Play All")
+            return
+        ready = []  # 再生準備ができたプレーヤー。最後にまとめて再生開始する
+        reload = []  # 読み込み直しが必要なプレーヤー。読み込み完了を待ってから再生開始する
+        for tile in self.tiles:
+            i, player = tile.index, tile.player
+            if tile.video_file is not None and tile.alive():
                 try:
                     if self.playing:
                         if not player.filename or player.idle_active:
-                            player.loadfile(self.video_files[i])
-                            time.sleep(0.1)
-                            player.pause = True
-                            player.seek(0, reference="absolute")
-                            self.first_play[i] = True
-                            print(f"Video {i} reloaded: {self.video_files[i]}")
-                        if self.first_play[i]:
+                            self.tiles[i].first_play = False
+                            reload.append(i)
+                            continue
+                        if self.tiles[i].first_play:
                             player.seek(0, reference="absolute")
-                            self.first_play[i] = False
-                        player.pause = False
-                        self.ended[i] = False
-                        print(f"Playing video {i}: {self.video_files[i]}, filename={player.filename}, pause={player.pause}")
+                            self.tiles[i].first_play = False
+                        ready.append(i)
                     else:
                         player.pause = True
-                        print(f"Paused video {i}: {self.video_files[i]}, filename={player.filename}, pause={player.pause}")
+                        player_log.info("Paused video %s: %s", i, self.tiles[i].video_file)
                 except Exception as e:
-                    print(f"Error toggling play/pause for video {i}: {e}\n{traceback.format_exc()}")
-                    if self.reinitialize_player(i) and self.video_files[i]:
-                        try:
-                            self.players[i].loadfile(self.video_files[i])
-                            time.sleep(0.1)
-                            self.players[i].pause = True
-                            self.players[i].seek(0, reference="absolute")
-                            self.first_play[i] = True
-                            print(f"Video {i} reinitialized and reloaded: {self.video_files[i]}")
-                            if self.playing:
-                                self.players[i].pause = False
-                                self.ended[i] = False
-                                print(f"Playing video {i} after reinitialization: {self.video_files[i]}")
-                        except Exception as e2:
-                            print(f"Failed to force reload video {i}: {e2}")
+                    player_log.error("Error toggling play/pause for video %s: %s", i, e, exc_info=True)
+                    if self.playing:
+                        self.tiles[i].first_play = False
+                        reload.append(i)
+        if self.playing:
+            if reload:
+                player_log.info("Reloading videos %s before playback", reload)
+                self.load_tiles(reload, on_all_done=lambda requests: self.start_playback(
+                    ready + [i for i, request in requests.items() if request and not request.error]))
+            else:
+                self.start_playback(ready)
+        else:
+            self.print_sync_report()
         self.play_button.config(text="Pause All" if self.playing else "Play All")
 
+    def start_playback(self, indices):
+        if not self.playing:
+            return  # 読み込み待ちの間に一時停止された
+        # 各プレーヤーの再生開始時刻がずれないよう、準備処理とは分けて連続で一気に再生を開始する
+        for i in indices:
+            try:
+                self.tiles[i].player.pause = False
+                self.tiles[i].ended = False
+            except Exception as e:
+                player_log.error("Error starting video %s: %s", i, e)
+        player_log.info("Playing videos %s", indices)
+        self.start_sync()
+
+    def frame_targets(self):
+        if self.compositor:
+            return [self.compositor.player] if self.compositor.player else []
+        return [tile.player for tile in self.tiles if tile.video_file and tile.alive()]
+
+    def step_frames(self, count):
+        # 全タイルを同時に1フレーム進める/戻す。戻す時はplay-direction=backwardにしてframe-stepする。
+        # mpvは逆方向のデコードをGOP単位でまとめて行い、デコード済みのフレームを逆順に持っておくので、
+        # frame-back-stepのように1フレーム戻すたびにキーフレームからデコードし直すことがない
+        if self.playing:
+            self.toggle_play()
+        direction = 'forward' if count > 0 else 'backward'
+        for tile in self.tiles:
+            tile.first_play = False  # 再生開始時に先頭へ戻さない
+            tile.ended = False
+        for player in self.frame_targets():
+            try:
+                if player.play_direction != direction:
+                    player.play_direction = direction  # 切り替えた時だけ現在位置からデコードし直す
+                player.command_async('frame-step')
+            except Exception as e:
+                player_log.error("Error stepping frame %s: %s", direction, e)
+        seek_log.debug("Frame step %s", direction)
+
+    def shuttle(self, step):
+        # J/K/L。Lで順方向、Jで逆方向に再生し、同じ向きに押すたびに速度を倍にする。Kで一時停止
+        if step == 0:
+            if self.playing:
+                self.toggle_play()
+            return
+        current = self.shuttle_speed if self.playing else 0.0
+        speed = current * 2 if current * step > 0 else float(step)
+        self.shuttle_speed = max(-self.MAX_SHUTTLE, min(self.MAX_SHUTTLE, speed))
+        player_log.info("Shuttle %+gx", self.shuttle_speed)
+        if self.playing:
+            self.apply_shuttle()
+            self.start_sync()
+        else:
+            self.toggle_play()
+
+    def apply_shuttle(self):
+        # shuttle_speedの向きと速さを全プレーヤーに設定する。同期の補正もこの速さを基準にする
+        direction = 'forward' if self.shuttle_speed > 0 else 'backward'
+        speed = abs(self.shuttle_speed)
+        self.sync_engine.pause()
+        self.sync_engine.rate = speed
+        for player in self.frame_targets():
+            try:
+                if player.play_direction != direction:
+                    player.play_direction = direction
+                if player.speed != speed:
+                    player.speed = speed
+            except Exception as e:
+                player_log.error("Error setting %s playback at %sx: %s", direction, speed, e)
+
     def reset_all(self):
-        for i, player in enumerate(self.players):
-            if self.video_files[i] is not None and player and not getattr(player, 'core_shutdown', False):
-                try:
-                    player.loadfile(self.video_files[i])
-                    time.sleep(0.1)
-                    player.seek(0, reference="absolute")
-                    player.pause = True
-                    self.first_play[i] = True
-                    self.ended[i] = False
-                    print(f"Reset video {i}: {self.video_files[i]}")
-                    if self.progress_sliders[i]:
-                        duration = player.duration
-                        if duration is not None and duration > 0:
-                            self.progress_sliders[i].config(to=duration, state="normal")
-                            self.progress_sliders[i].set(0)
-                            print(f"Player {i} progress slider reset to duration: {duration}")
-                        else:
-                            self.progress_sliders[i].config(to=100, state="disabled")
-                            self.progress_sliders[i].set(0)
-                            print(f"Player {i} progress slider disabled: no duration")
-                except Exception as e:
-                    print(f"Error resetting video {i}: {e}\n{traceback.format_exc()}")
-                    if self.reinitialize_player(i) and self.video_files[i]:
-                        try:
-                            self.players[i].loadfile(self.video_files[i])
-                            time.sleep(0.1)
-                            self.players[i].pause = True
-                            self.players[i].seek(0, reference="absolute")
-                            self.first_play[i] = True
-                            self.ended[i] = False
-                            print(f"Video {i} reinitialized and reset: {self.video_files[i]}")
-                            if self.progress_sliders[i]:
-                                duration = self.players[i].duration
-                                if duration is not None and duration > 0:
-                                    self.progress_sliders[i].config(to=duration, state="normal")
-                                    self.progress_sliders[i].set(0)
-                                    print(f"Player {i} progress slider reset to duration: {duration}")
-                                else:
-                                    self.progress_sliders[i].config(to=100, state="disabled")
-                                    self.progress_sliders[i].set(0)
-                                    print(f"Player {i} progress slider disabled: no duration")
-                        except Exception as e2:
-                            print(f"Failed to reset after reinitialization for video {i}: {e2}")
+        if self.compositor:
+            if self.playing:
+                self.toggle_play()
+            self.scrubber.finish(self.COMPOSITOR, self.compositor.player, 0.0)
+            return
+        indices = []
+        for tile in self.tiles:
+            if tile.video_file is not None:
+                tile.first_play = True
+                tile.ended = False
+                indices.append(tile.index)
         if self.playing:
             self.playing = False
+            self.sync_engine.pause()
             self.play_button.config(text="Play All")
+        self.sync_engine.reset_stats()
+        # 全ファイルを同時に読み込むので、最も遅いファイルの読み込み時間だけで完了する
+        reset_started = time.perf_counter()
+        self.load_tiles(indices, on_all_done=lambda requests: load_log.info(
+            "Reset videos %s in %.0fms", sorted(requests), (time.perf_counter() - reset_started) * 1000))
 
     def toggle_loop(self):
         self.loop_enabled = not self.loop_enabled
+        self.sync_engine.loop = self.loop_enabled
         loop_value = "inf" if self.loop_enabled else "no"
-        for i, player in enumerate(self.players):
-            if player and not getattr(player, 'core_shutdown', False):
+        for tile in self.tiles:
+            i, player = tile.index, tile.player
+            if tile.alive():
                 try:
                     player.loop_file = loop_value
                     if not self.loop_enabled and player.idle_active:
@@ -577,216 +4993,422 @@ class VideoPlayerApp:
                                 player.seek(player.duration - 0.1)
                         except:
                             pass
-                        print(f"Player {i} paused due to loop off")
+                        player_log.info("Player %s paused due to loop off", i)
                 except Exception as e:
-                    print(f"Error setting loop for player {i}: {e}")
-                    if self.reinitialize_player(i):
-                        try:
-                            self.players[i].loop_file = loop_value
-                            if not self.loop_enabled:
-                                self.players[i].pause = True
-                                try:
-                                    if self.players[i].duration:
-                                        self.players[i].seek(self.players[i].duration - 0.1)
-                                except:
-                                    pass
-                            print(f"Player {i} reinitialized and loop set to {loop_value}")
-                        except Exception as e2:
-                            print(f"Failed to set loop after reinitialization for player {i}: {e2}")
+                    player_log.error("Error setting loop for player %s: %s", i, e)
+                    # 差し替え後のプレーヤーには現在のループ設定が反映される
+                    if self.recover_tile(i):
+                        player_log.info("Player %s reinitialized and loop set to %s", i, loop_value)
+        if self.compositor:
+            try:
+                self.compositor.player.loop_file = loop_value
+            except Exception as e:
+                player_log.error("Error setting loop for compositor: %s", e)
         self.loop_button.config(text=f"Loop {'On' if self.loop_enabled else 'Off'}")
 
     def set_volume(self, value, index):
         try:
-            if self.volume_labels[index] and not self.is_muted:
-                self.volume_labels[index].config(text=f"Vol: {int(float(value))}")
-            player = self.players[index]
+            if self.tiles[index].volume_label and not self.is_muted:
+                self.tiles[index].volume_label.config(text=f"Vol: {int(float(value))}")
+            player = self.tiles[index].player
             if player and not getattr(player, 'core_shutdown', False) and not self.is_muted:
                 player.volume = float(value)
-                print(f"Player {index} volume set to {value}")
+                player_log.debug("Player %s volume set to %s", index, value)
             else:
-                print(f"Player {index} volume not set: {'muted' if self.is_muted else 'no player instance'}")
-            self.previous_volumes[index] = float(value)
+                player_log.debug("Player %s volume not set: %s",
+                                 index, 'muted' if self.is_muted else 'no player instance')
+            self.tiles[index].volume = float(value)
+            self.schedule_compositor_update()
             self.root.update_idletasks()
         except Exception as e:
-            print(f"Error setting volume for player {index}: {e}\n{traceback.format_exc()}")
-            if self.reinitialize_player(index) and self.video_files[index]:
-                try:
-                    self.players[index].volume = float(value) if not self.is_muted else 0
-                    if self.volume_labels[index] and not self.is_muted:
-                        self.volume_labels[index].config(text=f"Vol: {int(float(value))}")
-                    self.previous_volumes[index] = float(value)
-                    print(f"Player {index} reinitialized and volume set: {value}")
-                except Exception as e2:
-                    print(f"Failed to set volume after reinitialization for player {index}: {e2}")
+            player_log.error("Error setting volume for player %s: %s", index, e, exc_info=True)
+            self.tiles[index].volume = float(value)
+            if self.recover_tile(index):
+                player_log.info("Player %s reinitialized and volume set: %s", index, value)
 
     def toggle_mute(self):
         self.is_muted = not self.is_muted
-        for i in range(4):
+        for tile in self.tiles:
+            i = tile.index
             try:
-                player = self.players[i]
-                volume_frame = self.player_frame.nametowidget(f"volume_frame{i}")
-                volume_slider = volume_frame.nametowidget(f"slider{i}")
+                player = tile.player
+                volume_slider = tile.volume_slider
                 if self.is_muted:
                     if player and not getattr(player, 'core_shutdown', False):
-                        self.previous_volumes[i] = player.volume
+                        self.tiles[i].volume = player.volume
                         player.volume = 0
                         time.sleep(0.01)
-                        print(f"Player {i} muted, saved volume: {self.previous_volumes[i]}")
+                        player_log.debug("Player %s muted, saved volume: %s", i, self.tiles[i].volume)
                     volume_slider.set(0)
-                    if self.volume_labels[i]:
-                        self.volume_labels[i].config(text="Vol: 0")
-                        print(f"Player {i} label set to Vol: 0")
+                    if self.tiles[i].volume_label:
+                        self.tiles[i].volume_label.config(text="Vol: 0")
+                        player_log.debug("Player %s label set to Vol: 0", i)
                 else:
                     if player and not getattr(player, 'core_shutdown', False):
-                        player.volume = self.previous_volumes[i]
+                        player.volume = self.tiles[i].volume
                         time.sleep(0.01)
-                        print(f"Player {i} unmuted, restored volume: {self.previous_volumes[i]}")
-                    volume_slider.set(self.previous_volumes[i])
-                    if self.volume_labels[i]:
-                        self.volume_labels[i].config(text=f"Vol: {int(self.previous_volumes[i])}")
-                        print(f"Player {i} label restored: Vol: {int(self.previous_volumes[i])}")
+                        player_log.debug("Player %s unmuted, restored volume: %s", i, self.tiles[i].volume)
+                    volume_slider.set(self.tiles[i].volume)
+                    if self.tiles[i].volume_label:
+                        self.tiles[i].volume_label.config(text=f"Vol: {int(self.tiles[i].volume)}")
+                        player_log.debug("Player %s label restored: Vol: %s", i, int(self.tiles[i].volume))
                 self.root.update_idletasks()
             except Exception as e:
-                print(f"Error toggling mute for player {i}: {e}\n{traceback.format_exc()}")
-                if self.reinitialize_player(i) and self.video_files[i]:
+                player_log.error("Error toggling mute for player %s: %s", i, e, exc_info=True)
+                if self.recover_tile(i):
                     try:
-                        self.players[i].volume = 0 if self.is_muted else self.previous_volumes[i]
-                        volume_slider.set(0 if self.is_muted else self.previous_volumes[i])
-                        if self.volume_labels[i]:
-                            self.volume_labels[i].config(text="Vol: 0" if self.is_muted else f"Vol: {int(self.previous_volumes[i])}")
-                        print(f"Player {i} reinitialized and mute state set: {'muted' if self.is_muted else f'restored to {self.previous_volumes[i]}'}")
+                        volume_slider.set(0 if self.is_muted else self.tiles[i].volume)
+                        if self.tiles[i].volume_label:
+                            self.tiles[i].volume_label.config(text="Vol: 0" if self.is_muted else f"Vol: {int(self.tiles[i].volume)}")
+                        player_log.info("Player %s reinitialized and mute state set: %s",
+                                        i, 'muted' if self.is_muted else f'restored to {self.tiles[i].volume}')
                         self.root.update_idletasks()
                     except Exception as e2:
-                        print(f"Failed to set mute state after reinitialization for player {i}: {e2}")
+                        player_log.warning("Failed to set mute state after reinitialization for player %s: %s", i, e2)
         self.mute_button.config(text="Unmute" if self.is_muted else "Mute")
-        print(f"{'Muted' if self.is_muted else 'Unmuted'} all players, restored volumes: {self.previous_volumes if not self.is_muted else []}")
+        self.schedule_compositor_update()
+        player_log.info("%s all players, restored volumes: %s",
+                        'Muted' if self.is_muted else 'Unmuted', [tile.volume for tile in self.tiles] if not self.is_muted else [])
 
     def toggle_layout(self):
         # レイアウトモードを順番に切り替え
-        layout_modes = ["1x4", "1x3", "1x2", "1x1", "2x2"]
-        current_index = layout_modes.index(self.layout_mode)
-        self.layout_mode = layout_modes[(current_index + 1) % len(layout_modes)]
-
-        # すべての動画フレームを一旦非表示に
-        for i in range(4):
-            frame = self.player_frame.nametowidget(f"frame{i}")
-            frame.grid_remove()
-            if self.progress_sliders[i]:
-                self.progress_sliders[i].grid_remove()
-            volume_frame = self.player_frame.nametowidget(f"volume_frame{i}")
-            volume_frame.grid_remove()
-
-        # グリッド設定をリセット
-        for i in range(8):
-            self.player_frame.grid_rowconfigure(i, weight=0, minsize=0)
-            self.player_frame.grid_columnconfigure(i, weight=0, minsize=0)
-
-        # レイアウトモードに応じた配置
-        if self.layout_mode == "2x2":
-            # 2x2レイアウトの設定
-            for i in range(2):
-                self.player_frame.grid_rowconfigure(2 * i, weight=1)
-                self.player_frame.grid_rowconfigure(2 * i + 1, weight=0, minsize=50)
-                self.player_frame.grid_columnconfigure(2 * i, weight=1)
-                self.player_frame.grid_columnconfigure(2 * i + 1, weight=0, minsize=160)
-            visible_players = 4
-            window_size = "760x680"
-        elif self.layout_mode == "1x4":
-            # 1x4レイアウトの設定
-            self.player_frame.grid_rowconfigure(0, weight=1)
-            self.player_frame.grid_rowconfigure(1, weight=0, minsize=50)
-            for i in range(4):
-                self.player_frame.grid_columnconfigure(2 * i, weight=1)
-                self.player_frame.grid_columnconfigure(2 * i + 1, weight=0, minsize=160)
-            visible_players = 4
-            window_size = "1280x400"
-        elif self.layout_mode == "1x3":
-            # 1x3レイアウトの設定
-            self.player_frame.grid_rowconfigure(0, weight=1)
-            self.player_frame.grid_rowconfigure(1, weight=0, minsize=50)
-            for i in range(3):
-                self.player_frame.grid_columnconfigure(2 * i, weight=1)
-                self.player_frame.grid_columnconfigure(2 * i + 1, weight=0, minsize=160)
-            visible_players = 3
-            window_size = "960x400"
-        elif self.layout_mode == "1x2":
-            # 1x2レイアウトの設定
-            self.player_frame.grid_rowconfigure(0, weight=1)
-            self.player_frame.grid_rowconfigure(1, weight=0, minsize=50)
-            for i in range(2):
-                self.player_frame.grid_columnconfigure(2 * i, weight=1)
-                self.player_frame.grid_columnconfigure(2 * i + 1, weight=0, minsize=160)
-            visible_players = 2
-            window_size = "640x400"
-        else:  # "1x1"
-            # 1x1レイアウトの設定
-            self.player_frame.grid_rowconfigure(0, weight=1)
-            self.player_frame.grid_rowconfigure(1, weight=0, minsize=50)
-            self.player_frame.grid_columnconfigure(0, weight=1)
-            self.player_frame.grid_columnconfigure(1, weight=0, minsize=160)
-            visible_players = 1
-            window_size = "400x400"
-
-        # 表示する動画フレームの配置
-        for i in range(visible_players):
-            frame = self.player_frame.nametowidget(f"frame{i}")
-            progress_slider = self.progress_sliders[i]
-            volume_frame = self.player_frame.nametowidget(f"volume_frame{i}")
-
-            if self.layout_mode == "2x2":
-                frame.grid(row=2 * (i // 2), column=2 * (i % 2), columnspan=2, padx=5, pady=5, sticky="nsew")
-                progress_slider.grid(row=2 * (i // 2) + 1, column=2 * (i % 2), padx=5, pady=5, sticky="ew")
-                volume_frame.grid(row=2 * (i // 2) + 1, column=2 * (i % 2) + 1, padx=5, pady=5, sticky="w")
-            else:
-                frame.grid(row=0, column=2 * i, columnspan=2, padx=5, pady=5, sticky="nsew")
-                progress_slider.grid(row=1, column=2 * i, padx=5, pady=(5, 0), sticky="ew")
-                volume_frame.grid(row=1, column=2 * i + 1, padx=5, pady=(5, 0), sticky="w")
-
-        # ボタンフレームの再配置
-        self.button_frame.pack_forget()
-        self.button_frame.pack(fill=tk.X, expand=True, pady=1)
-
-        # ウィンドウサイズの更新
-        if not self.is_fullscreen:
-            self.root.geometry(window_size)
+        current_index = self.layout_modes.index(self.layout_mode)
+        self.layout_mode = self.layout_modes[(current_index + 1) % len(self.layout_modes)]
+        self.apply_layout(resize_window=True)
         # ボタンテキストを更新したい場合
         # self.layout_button.config(text=f"{self.layout_mode} Layout")
-        # print(f"Switched to {self.layout_mode} layout")
+        ui_log.info("Switched to %s layout", self.layout_mode)
+
+    def layout_shape(self):
+        # 現在のレイアウトモードの (行数, 列数, 表示するタイル数) を返す
+        count = len(self.tiles)
+        if self.layout_mode == "auto":
+            width = max(self.player_frame.winfo_width(), 320)
+            height = max(self.player_frame.winfo_height(), 240)
+            rows, cols = compute_grid(count, width, height)
+            return rows, cols, count
+        rows, cols = (int(n) for n in self.layout_mode.split("x"))
+        return rows, cols, min(count, rows * cols)
+
+    def apply_layout(self, resize_window=False):
+        rows, cols, visible = self.layout_shape()
+        if (rows, cols) != self.layout_grid or resize_window:
+            # すべての動画フレームを一旦非表示にしてから配置し直す
+            for tile in self.tiles:
+                tile.frame.grid_remove()
+                tile.progress_slider.grid_remove()
+                tile.volume_frame.grid_remove()
+                tile.visible = tile.index < visible
+                self.decode_scheduler.set_visible(tile.index, tile.visible)
+                self.cache_budget.set_visible(tile.index, tile.visible)
+
+            # 合成モードでは1枚の映像を1行目に置き、その下に各タイルのスライダーを並べる
+            composite = self.compositor is not None
+            self.compositor_frame.grid_remove()
+
+            # グリッド設定をリセット
+            old_rows, old_cols = self.layout_grid or (0, 0)
+            for r in range(2 * max(rows, old_rows)):
+                self.player_frame.grid_rowconfigure(r, weight=0, minsize=0)
+            for c in range(2 * max(cols, old_cols)):
+                self.player_frame.grid_columnconfigure(c, weight=0, minsize=0)
+            # 偶数行/列に映像、奇数行にスライダー、奇数列にボリュームを置く
+            for r in range(rows):
+                if composite:
+                    self.player_frame.grid_rowconfigure(r + 1, weight=0, minsize=50)
+                else:
+                    self.player_frame.grid_rowconfigure(2 * r, weight=1)
+                    self.player_frame.grid_rowconfigure(2 * r + 1, weight=0, minsize=50)
+            if composite:
+                self.player_frame.grid_rowconfigure(0, weight=1)
+            for c in range(cols):
+                self.player_frame.grid_columnconfigure(2 * c, weight=1)
+                self.player_frame.grid_columnconfigure(2 * c + 1, weight=0, minsize=160)
+
+            # 表示する動画フレームの配置
+            pady = 5 if rows > 1 else (5, 0)
+            if composite:
+                self.compositor_frame.grid(row=0, column=0, columnspan=2 * cols, padx=5, pady=5, sticky="nsew")
+            for tile in self.tiles[:visible]:
+                r, c = divmod(tile.index, cols)
+                if not composite:
+                    tile.frame.grid(row=2 * r, column=2 * c, columnspan=2, padx=5, pady=5, sticky="nsew")
+                slider_row = r + 1 if composite else 2 * r + 1
+                tile.progress_slider.grid(row=slider_row, column=2 * c, padx=5, pady=pady, sticky="ew")
+                tile.volume_frame.grid(row=slider_row, column=2 * c + 1, padx=5, pady=pady, sticky="w")
+            self.layout_grid = (rows, cols)
+            self.rebalance_decoders()
+            self.rebalance_cache()
+            self.update_compositor()
+
+            # ボタンフレームの再配置
+            self.button_frame.pack_forget()
+            self.button_frame.pack(fill=tk.X, expand=True, pady=1)
+
+        # ウィンドウサイズの更新。autoはウィンドウサイズに合わせて並べるのでサイズは変えない
+        if resize_window and not self.is_fullscreen and self.layout_mode != "auto":
+            self.root.geometry(layout_window_size(rows, cols))
+
+    def on_player_frame_resize(self, event):
+        # autoレイアウトではウィンドウサイズが変わったら並べ方を計算し直す。連続するイベントはまとめる
+        if self.layout_mode != "auto":
+            return
+        if self.layout_resize_id:
+            self.root.after_cancel(self.layout_resize_id)
+        self.layout_resize_id = self.root.after(100, self.on_layout_resize_done)
+
+    def on_layout_resize_done(self):
+        self.layout_resize_id = None
+        self.apply_layout()
 
     def toggle_fullscreen(self, event=None):
         self.is_fullscreen = not self.is_fullscreen
         self.root.attributes('-fullscreen', self.is_fullscreen)
-        if not self.is_fullscreen:
-            self.root.geometry("760x680" if self.layout_mode == "2x2" else "1280x400")
+        if not self.is_fullscreen and self.layout_mode != "auto":
+            self.root.geometry(layout_window_size(*self.layout_grid))
+
+    def start_control(self, address):
+        self.control = ControlServer(address, self.execute_control, self.control_state, self.call_in_ui)
+        self.control.start()
+
+    def control_commands(self):
+        # コマンド名 -> 実行する関数。引数はcontrol_errorで検証済み
+        return {
+            "ping": lambda c: None,
+            "state": lambda c: self.control_state(),
+            "load": lambda c: self.open_paths(c.get("paths") or [c["path"]], c["tile"]),
+            "play": lambda c: self.playing or self.toggle_play(),
+            "pause": lambda c: self.playing and self.toggle_play(),
+            "seek": self.control_seek,
+            "seek_tile": self.control_seek_tile,
+            "loop": lambda c: c["on"] != self.loop_enabled and self.toggle_loop(),
+            "mute": lambda c: c["on"] != self.is_muted and self.toggle_mute(),
+            "volume": self.control_volume,
+            "reset": lambda c: self.reset_all(),
+            "step": lambda c: self.step_frames(c["frames"]),
+            "shuttle": lambda c: self.shuttle(c["speed"]),
+            "layout": self.control_layout,
+            "set": lambda c: self.step_set(c["step"]),
+            "profile": lambda c: self.watchdog.report() if self.watchdog else None,
+        }
+
+    def execute_control(self, commands):
+        # UIスレッドで実行する。先に全コマンドの引数と実行時の前提を調べ、1つでも満たさなければ何も実行しない。
+        # それでも実行中に失敗したら残りは実行せず、バッチ全体を失敗として返す
+        table = self.control_commands()
+        for command in commands:
+            error = control_error(command, len(self.tiles), self.layout_modes) or self.control_unavailable(command)
+            if error:
+                control_log.warning("Rejected control batch: %s", error)
+                return [{"ok": False, "error": error}]
+        results = []
+        for command in commands:
+            try:
+                value = table[command["cmd"]](command)
+            except Exception as e:
+                control_log.error("Error in control command %s, stopping the batch: %s", command["cmd"], e, exc_info=True)
+                results.append({"ok": False, "error": str(e)})
+                results += [{"ok": False, "error": "not run"}] * (len(commands) - len(results))
+                return results
+            results.append({"ok": True} if value is None or isinstance(value, bool) else {"ok": True, "value": value})
+        control_log.debug("Control batch %s", [command["cmd"] for command in commands])
+        return results
+
+    def control_unavailable(self, command):
+        # 今の状態では実行できないコマンドなら理由を返す。loadは非同期なので、同じバッチで読み込むタイルはまだ動画なしとして調べる
+        name = command["cmd"]
+        if name in ("seek", "step", "shuttle") and not (
+                self.compositor or any(tile.video_file and tile.alive() for tile in self.tiles)):
+            return f"{name}: no video loaded"
+        if name == "seek_tile" and not self.compositor:
+            tile = self.tiles[command["tile"]]
+            if not (tile.video_file and tile.alive()):
+                return f"seek_tile: tile {tile.index} has no video"
+        if name == "set" and not (self.set_queue and self.set_queue.valid(self.set_queue.position + command["step"])):
+            return f"set: no comparison set at {command['step']:+d}"
+        return None
+
+    def control_seek(self, command):
+        self.group_seek(float(command["position"]))
+
+    def control_volume(self, command):
+        tile = self.tiles[command["tile"]]
+        value = max(0.0, min(100.0, float(command["value"])))
+        if self.is_muted:
+            tile.volume = value  # ミュート解除時に反映される
+        else:
+            tile.volume_slider.set(value)
+            self.set_volume(value, tile.index)
+
+    def control_seek_tile(self, command):
+        # 1タイルだけ正確な位置へシークする。合成モードでは全体をシークする
+        tile, position = self.tiles[command["tile"]], float(command["position"])
+        if self.compositor:
+            self.scrubber.finish(self.COMPOSITOR, self.compositor.player, position)
+        else:
+            tile.first_play = False  # 動画があることはcontrol_unavailableで確かめてある
+            tile.ended = False
+            self.scrubber.finish(tile.index, tile.player, position)
+            self.rebase_sync_after_seek(tile.index, position)
+
+    def control_layout(self, command):
+        self.layout_mode = command["mode"]
+        self.apply_layout(resize_window=True)
+
+    def control_state(self):
+        # 制御ソケットで返す現在の状態 (UIスレッドで実行する)
+        return {
+            "time": time.time(),
+            "playing": self.playing,
+            "speed": self.shuttle_speed,
+            "loop": self.loop_enabled,
+            "muted": self.is_muted,
+            "layout": self.layout_mode,
+            "compositor": self.compositor is not None,
+            "position": self.compositor.position if self.compositor else None,
+            "set": self.set_queue.position if self.set_queue else None,
+            "tiles": [{
+                "file": tile.video_file,
+                "position": tile.position,
+                "duration": tile.duration,
+                "ended": tile.ended,
+                "volume": tile.volume,
+                "visible": tile.visible,
+            } for tile in self.tiles],
+        }
 
     def on_closing(self):
+        if self.watchdog:
+            self.watchdog.stop()
+            for line in self.watchdog.summary():
+                ui_log.info("%s", line)
+        if self.watchdog and self.ui_profile:
+            try:
+                with open(self.ui_profile, "w", encoding="utf-8") as f:
+                    json.dump(self.watchdog.report(), f, indent=2)
+            except OSError as e:
+                ui_log.error("Error writing UI profile %s: %s", self.ui_profile, e)
+        if self.control:
+            self.control.close()
         self.root.after_cancel(self.update_progress_id)
-        for i, player in enumerate(self.players):
+        self.root.after_cancel(self.ui_queue_id)
+        self.sync_engine.stop_thread()
+        self.print_sync_report()
+        self.discard_preload()
+        self.player_pool.close()
+        self.thumbnails.close()
+        self.media_probe.close()
+        if self.log_window is not None:
+            self.close_log_viewer()
+        if self.metrics_window is not None:
+            self.close_metrics_panel()
+        if self.analysis_window is not None:
+            self.close_analysis()
+        if self.export_window is not None:
+            self.close_export()
+        self.analyzer.cancel()
+        self.metrics.stop_thread()
+        self.root.after_cancel(self.quality_id)
+        if self.worker_watch_id:
+            self.root.after_cancel(self.worker_watch_id)
+        if self.layout_resize_id:
+            self.root.after_cancel(self.layout_resize_id)
+        if self.compositor_update_id:
+            self.root.after_cancel(self.compositor_update_id)
+        if self.compositor and self.compositor.player:
+            self.compositor.player.terminate()
+        for tile in self.tiles:
+            player = tile.player
             if player and not isinstance(player, dict):
-                for prop in ['end-file', 'eof-reached', 'idle']:
-                    if prop in self.property_handlers[i]:
-                        try:
-                            player.unobserve_property(prop, self.property_handlers[i][prop])
-                        except Exception:
-                            pass
+                for prop, handler in tile.property_handlers.items():
+                    try:
+                        player.unobserve_property(prop, handler)
+                    except Exception:
+                        pass
                 player.terminate()
+        if self.worker_state:
+            self.worker_state.close(unlink=True)
         self.root.destroy()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simultaneous video playback app")
+    parser.add_argument("files", nargs="*", help="videos to open in the tiles at startup")
+    parser.add_argument("--tiles", type=int, default=4, help="number of video tiles (default: 4)")
+    parser.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"],
+                        help="console log level (default: info)")
+    parser.add_argument("--log", action="append", metavar="COMPONENT=LEVEL",
+                        help=f"log level for one component, may be repeated ({', '.join(LOG_COMPONENTS)})")
+    parser.add_argument("--sets", metavar="PATH", help="open a comparison set manifest (.json/.txt) or folder at startup")
+    parser.add_argument("--cache-budget", type=parse_size, default="1G", metavar="SIZE",
+                        help="total demuxer cache memory shared by all players, e.g. 512M or 4G (default: 1G)")
+    parser.add_argument("--cache-back", type=float, default=10.0, metavar="SECONDS",
+                        help="seconds of already played media kept in each player's cache for backward seeks (default: 10)")
+    parser.add_argument("--export", metavar="OUTPUT", help="export the given files side by side to OUTPUT without opening a window")
+    parser.add_argument("--export-range", type=parse_range, metavar="START-END", help="time range to export, e.g. 0:10-1:20")
+    parser.add_argument("--export-layout", type=parse_grid, metavar="RxC", help="rows x columns for --export, e.g. 2x2")
+    parser.add_argument("--workers", action="store_true",
+                        help="run each player in its own process so one tile cannot stall the UI or the other tiles")
+    parser.add_argument("--control", metavar="ADDRESS",
+                        help="accept JSON-lines commands on a Unix socket path or a localhost TCP port (e.g. 127.0.0.1:7700)")
+    parser.add_argument("--benchmark", metavar="OUTPUT",
+                        help="run the headless benchmark (vo=null, generated sources) and write the results as JSON")
+    parser.add_argument("--benchmark-baseline", metavar="PATH", help="compare the benchmark with a previous result")
+    parser.add_argument("--benchmark-sizes", type=parse_sizes, default="640x360,1280x720,1920x1080", metavar="WxH,...",
+                        help="resolutions to benchmark (default: 640x360,1280x720,1920x1080)")
+    parser.add_argument("--benchmark-tiles", type=parse_counts, default="1,4,9", metavar="N,...",
+                        help="tile counts to benchmark (default: 1,4,9)")
+    parser.add_argument("--benchmark-seconds", type=float, default=10.0, metavar="SECONDS",
+                        help="playback time measured per benchmark case (default: 10)")
+    parser.add_argument("--ui-stall-ms", type=float, metavar="MS",
+                        help="time every UI callback and log the UI thread's stack when it is blocked for longer than this")
+    parser.add_argument("--ui-profile", metavar="PATH",
+                        help="time every UI callback and write per-handler timings and stalls as JSON on exit "
+                             "(stall threshold 100ms unless --ui-stall-ms is given)")
+    parser.add_argument("--metrics-csv", metavar="PATH", help="append per-player metrics to a CSV file every second")
+    parser.add_argument("--metrics-prom", metavar="PATH", help="write per-player metrics in Prometheus text format every second")
+    args = parser.parse_args()
+    if args.tiles < 1:
+        parser.error("--tiles must be 1 or more")
+    try:
+        component_levels = parse_log_levels(args.log)
+    except ValueError as e:
+        parser.error(str(e))
+    log_listener, log_ring = setup_logging(logging.getLevelName(args.log_level.upper()), component_levels)
+    if args.export:
+        if not args.files:
+            parser.error("--export needs video files")
+        status = export_files(args.files, args.export, args.export_layout, args.export_range)
+        log_listener.stop()
+        sys.exit(status)
+    if args.benchmark:
+        status = run_benchmark(args.benchmark, args.benchmark_baseline, args.benchmark_sizes, args.benchmark_tiles,
+                               args.benchmark_seconds)
+        log_listener.stop()
+        sys.exit(status)
+
+    startup_timer = StartupTimer(startup_started)
+    startup_timer.mark("imports")
     root = TkinterDnD.Tk()
-    # 1x4レイアウト用のグリッド設定
+    startup_timer.mark("tk root")
     root.grid_rowconfigure(0, weight=1)  # プレーヤー行
-    root.grid_rowconfigure(1, weight=0, minsize=50)  # スライダー行
-    root.grid_rowconfigure(2, weight=0)  # ボタン行
-
-    # すべての列の重みを明示的に設定
-    for i in range(8):  # 4つのプレーヤー用に8列（各プレーヤーに2列）
-        if i % 2 == 0:
-            root.grid_columnconfigure(i, weight=1)  # プレーヤー列は均等に
-        else:
-            root.grid_columnconfigure(i, weight=0, minsize=80)  # ボリューム列は固定幅
+    root.grid_columnconfigure(0, weight=1)
 
-    root.geometry("1280x400")
-    app = VideoPlayerApp(root)
+    if args.tiles == 4:
+        root.geometry(LAYOUT_WINDOW_SIZES["1x4"])
+    else:
+        root.geometry(layout_window_size(*compute_grid(args.tiles, 1280, 680)))
+    app = VideoPlayerApp(root, args.tiles, startup_timer, log_ring, args.metrics_csv, args.metrics_prom,
+                         args.cache_budget, args.cache_back, args.workers, args.ui_stall_ms, args.ui_profile)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
-    root.mainloop()
\ No newline at end of file
+    if args.control:
+        try:
+            app.start_control(args.control)
+        except (OSError, ValueError) as e:
+            control_log.error("Cannot open control socket %s: %s", args.control, e)
+    root.after_idle(startup_timer.report)
+    if args.sets:
+        root.after_idle(lambda: app.open_paths([args.sets]))
+    elif args.files:
+        root.after_idle(lambda: app.open_paths(args.files))
+    root.mainloop()
+    log_listener.stop()  # 残っているログを書き出す
\ No newline at end of file
@@ -37,7 +37,7 @@ def run_py_script():
 
     # 仮想環境経由でない場合、依存ライブラリが見つからない可能性があるが、
     # その場合はユーザー側の環境構築不備となる。
-    subprocess.Popen([python_executable, py_script_path],
+    subprocess.Popen([python_executable, py_script_path] + sys.argv[1:],
                      creationflags=subprocess.CREATE_NO_WINDOW)
 
 
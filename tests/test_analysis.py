@@ -0,0 +1,86 @@
+import concurrent.futures
+import os
+import queue
+import sys
+import threading
+import time
+
+import pytest
+
+import simul_pb
+
+
+def test_curve_points_keeps_the_lowest_value_per_pixel():
+    # 4フレームを幅2に描くと、1画素に2フレームずつ入る
+    points = simul_pb.curve_points([40.0, 30.0, 50.0, 60.0], fps=1.0, duration=4.0, width=2, height=100,
+                                   low=20.0, high=60.0)
+    assert points == [0, 75.0, 1, 25.0]
+
+
+def test_curve_summary():
+    curve = simul_pb.QualityCurve()
+    assert curve.summary() == "no frames"
+    curve.psnr, curve.ssim = [30.0, 40.0], [0.9, 1.0]
+    assert curve.summary() == "PSNR avg 35.00 dB (min 30.00), SSIM avg 0.9500 (min 0.9000)"
+
+
+@pytest.mark.skipif(os.name == "nt", reason="uses a POSIX shell script in place of ffmpeg")
+def test_cancel_releases_a_blocked_decoder(tmp_path):
+    # 出力を止めずに書き続けるffmpegの代わり
+    fake = tmp_path / "ffmpeg"
+    fake.write_text(f"#!/bin/sh\nexec {sys.executable} -c \"import sys\nwhile True: sys.stdout.buffer.write(bytes(4096))\"\n")
+    fake.chmod(0o755)
+    analyzer = simul_pb.QualityAnalyzer()
+    analyzer.ffmpeg = str(fake)
+    batches = queue.Queue(maxsize=1)
+    cancel = threading.Event()
+    thread = threading.Thread(target=analyzer._decode, args=("in.mp4", 30.0, (8, 8), batches, cancel))
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not batches.full() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert batches.full()  # 読み取りスレッドはキューが空くのを待っている
+    cancel.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert not analyzer._processes
+
+
+def test_get_returns_none_after_cancel():
+    cancel = threading.Event()
+    cancel.set()
+    assert simul_pb.QualityAnalyzer._get(queue.Queue(), cancel) is None
+
+
+def fake_compare(reference, others, height, width):
+    # 比較の代わりに、各点がどのフレーム同士から作られたかを返す (フレームの全画素をフレーム番号で埋めてある)
+    size = height * width
+    return {index: ([reference[i * size] for i in range(len(data) // size)],
+                    [data[i * size] for i in range(len(data) // size)]) for index, data in others.items()}
+
+
+def test_short_input_does_not_shift_the_other_curves(monkeypatch):
+    # 基準と長いタイルは40フレーム、タイル1は20フレーム目で終わる (BATCH=16なので2つ目のまとまりの途中)
+    size = (2, 2)
+    frame = size[0] * size[1]
+    frames = {"ref.mp4": 40, "short.mp4": 20, "long.mp4": 40}
+
+    def fake_decode(self, path, fps, size, batches, cancel):
+        data = b"".join(bytes([i]) * frame for i in range(frames[path]))
+        chunk = frame * self.BATCH
+        for start in range(0, len(data), chunk):
+            batches.put(data[start:start + chunk])
+        batches.put(None)
+
+    monkeypatch.setattr(simul_pb.QualityAnalyzer, "_decode", fake_decode)
+    monkeypatch.setattr(simul_pb, "compare_frames", fake_compare)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor)
+    analyzer = simul_pb.QualityAnalyzer(workers=1)
+    done = threading.Event()
+    analyzer.start("ref.mp4", {1: "short.mp4", 2: "long.mp4"}, 30.0, size, on_done=lambda error: done.set())
+    assert done.wait(5)
+    curves = analyzer.snapshot()
+    # 短いタイルは自分の長さまで、長いタイルは基準の最後まで、どの点も同じ番号のフレーム同士を比べている
+    assert curves[1] == (list(range(20)), list(range(20)))
+    assert curves[2] == (list(range(40)), list(range(40)))
+    assert analyzer.frames == 40
@@ -0,0 +1,50 @@
+import pytest
+
+import simul_pb
+
+
+def scenario(name, **metrics):
+    return {"name": name, "metrics": metrics}
+
+
+def test_regressions_need_both_relative_and_absolute_growth():
+    baseline = {"scenarios": [scenario("720p x4 separate", load_ms=100.0, drops=2.0, seek_ms=0.5)]}
+    report = {"scenarios": [scenario("720p x4 separate", load_ms=130.0, drops=2.5, seek_ms=1.0)]}
+    assert simul_pb.compare_benchmark(report, baseline) == 1
+    comparison = report["scenarios"][0]["comparison"]
+    assert comparison["load_ms"] == {"baseline": 100.0, "change": 30.0, "regressed": True}
+    assert not comparison["drops"]["regressed"]  # 25%増えたが0.5しか増えていない
+    assert not comparison["seek_ms"]["regressed"]  # 2倍だが1未満の差
+
+
+def test_improvements_are_not_regressions():
+    baseline = {"scenarios": [scenario("a", load_ms=200.0)]}
+    report = {"scenarios": [scenario("a", load_ms=50.0)]}
+    assert simul_pb.compare_benchmark(report, baseline) == 0
+    assert report["scenarios"][0]["comparison"]["load_ms"]["change"] == -150.0
+
+
+def test_unmatched_scenarios_and_metrics_are_skipped():
+    baseline = {"scenarios": [scenario("a", load_ms=100.0, mpv="0.38")]}
+    report = {"scenarios": [scenario("b", load_ms=900.0), scenario("a", new_metric=5.0, mpv=1.0),
+                            {"name": "a", "error": "failed"}]}
+    assert simul_pb.compare_benchmark(report, baseline) == 0
+    assert "comparison" not in report["scenarios"][0]
+    assert report["scenarios"][1]["comparison"] == {}
+    assert simul_pb.compare_benchmark(report, {}) == 0
+
+
+def test_tolerance_and_floor_are_configurable():
+    baseline = {"scenarios": [scenario("a", load_ms=100.0)]}
+    report = {"scenarios": [scenario("a", load_ms=105.0)]}
+    assert simul_pb.compare_benchmark(report, baseline) == 0
+    assert simul_pb.compare_benchmark(report, baseline, tolerance=0.01, floor=0.0) == 1
+
+
+def test_parse_sizes_and_counts():
+    assert simul_pb.parse_sizes("640x360,1920x1080") == [(640, 360), (1920, 1080)]
+    assert simul_pb.parse_counts("1,4,9") == [1, 4, 9]
+    with pytest.raises(ValueError):
+        simul_pb.parse_sizes("8x8")
+    with pytest.raises(ValueError):
+        simul_pb.parse_counts("0,4")
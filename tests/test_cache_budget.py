@@ -0,0 +1,79 @@
+import pytest
+
+import simul_pb
+
+MiB = 1 << 20
+
+
+def total(plans):
+    return sum(plan.forward + plan.back for plan in plans.values())
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("512M", 512 * MiB), ("2G", 2 << 30), ("1.5g", 3 << 29), ("64KiB", 64 << 10), ("100MB", 100 * MiB),
+    ("4096", 4096), (" 8m ", 8 * MiB),
+])
+def test_parse_size(text, expected):
+    assert simul_pb.parse_size(text) == expected
+
+
+def test_parse_size_rejects_garbage():
+    with pytest.raises(ValueError):
+        simul_pb.parse_size("lots")
+
+
+def test_split_follows_bitrate_and_keeps_back_buffer():
+    budget = simul_pb.CacheBudget(400 * MiB, back_seconds=10)
+    budget.set_stream(0, 8_000_000)
+    budget.set_stream(1, 24_000_000)
+    plans = budget.plan()
+    # 最低限の8MiBずつを除いた残りをビットレート 1:3 で分ける
+    assert total({0: plans[0]}) == 8 * MiB + 96 * MiB
+    assert total({1: plans[1]}) == 8 * MiB + 288 * MiB
+    assert plans[0].back == 10_000_000  # 8Mbpsの10秒分
+    assert plans[1].back == 30_000_000
+    assert total(plans) <= 400 * MiB
+
+
+def test_hidden_tiles_get_a_smaller_share():
+    budget = simul_pb.CacheBudget(200 * MiB)
+    for i in range(2):
+        budget.set_stream(i, 8_000_000)
+    budget.set_visible(1, False)
+    plans = budget.plan()
+    # 最低限の分を除くと、非表示のタイルは表示中の1/4
+    assert total({0: plans[0]}) - 8 * MiB == pytest.approx(4 * (total({1: plans[1]}) - 8 * MiB), abs=4)
+    assert total(plans) <= 200 * MiB
+
+
+@pytest.mark.parametrize("tiles", [1, 4, 8, 16, 64, 200])
+def test_never_exceeds_the_budget(tiles):
+    budget = simul_pb.CacheBudget(1 << 30)
+    for i in range(tiles):
+        budget.set_stream(i, 1_000_000 if i % 2 else 80_000_000)
+        budget.set_visible(i, i % 3 != 0)
+    plans = budget.plan()
+    assert len(plans) == tiles
+    assert total(plans) <= 1 << 30
+    if tiles * simul_pb.CacheBudget.MIN_BYTES <= 1 << 30:
+        assert all(plan.forward + plan.back >= simul_pb.CacheBudget.MIN_BYTES for plan in plans.values())
+
+
+def test_whole_files_count_forward_and_back():
+    budget = simul_pb.CacheBudget(1 << 30)
+    budget.set_stream(0, 8_000_000, size=50 * MiB)
+    budget.set_stream(1, 8_000_000, size=300 * MiB)  # 丸ごと保持するには600MiB要るので収まらない
+    for i in range(2, 8):
+        budget.set_stream(i, 8_000_000)
+    plans = budget.plan()
+    assert plans[0] == simul_pb.CachePlan(50 * MiB, 50 * MiB)
+    assert plans[1].forward < 300 * MiB
+    assert total(plans) <= 1 << 30
+
+
+def test_tiny_budget_is_split_evenly():
+    budget = simul_pb.CacheBudget(16 * MiB)
+    for i in range(4):
+        budget.set_stream(i, 8_000_000)
+    plans = budget.plan()
+    assert [plan.forward + plan.back for plan in plans.values()] == [4 * MiB] * 4
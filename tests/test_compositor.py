@@ -0,0 +1,53 @@
+import simul_pb
+
+
+def chains(graph):
+    return graph.split(";")
+
+
+def test_labels_follow_track_counts():
+    # 1本目は音声2本、2本目は音声なし、3本目は映像2本 (カバー画像つき) と音声1本
+    inputs = [(0, (1, 2)), (1, (1, 0)), (2, (2, 1))]
+    graph = simul_pb.compositor_graph(inputs, 2, 2, 3, {0: 50})
+    parts = chains(graph)
+    assert "[aid1]volume=0.500[a0]" in parts
+    assert "[aid3]volume=1.000[a2]" in parts
+    assert not any(part.startswith("[aid2]") for part in parts)
+    assert any(part.startswith("[vid1]scale=") and part.endswith("[v0]") for part in parts)
+    assert any(part.startswith("[vid2]scale=") and part.endswith("[v1]") for part in parts)
+    assert any(part.startswith("[vid3]scale=") and part.endswith("[v2]") for part in parts)
+    assert parts[-1] == "[a0][a2]amix=inputs=2:duration=longest:normalize=0[ao]"
+
+
+def test_ffmpeg_labels_use_input_numbers():
+    inputs = [(0, (1, 0)), (1, (2, 3))]
+    parts = chains(simul_pb.compositor_graph(inputs, 1, 2, 2, {}, ffmpeg=True))
+    assert parts[0].startswith("[0:v:0]scale=")
+    assert parts[1] == "[1:a:0]volume=1.000[a1]"
+    assert parts[2].startswith("[1:v:0]scale=")
+    assert parts[-1] == "[a1]anull[ao]"
+
+
+def test_layout_and_hidden_tiles():
+    inputs = [(index, (1, 1)) for index in range(4)]
+    graph = simul_pb.compositor_graph(inputs, 1, 4, 3, {}, size=(1920, 1080))
+    parts = chains(graph)
+    # 1x4なら1セルは480x270、4本目は映像を使わず音声だけ鳴らす
+    assert parts[1].startswith("[vid1]scale=480:270:")
+    assert "[vid4]" not in graph
+    assert "[v0][v1][v2]xstack=inputs=3:layout=0_0|480_0|960_0:fill=black,pad=1920:270:0:0[vo]" in parts
+    assert "amix=inputs=4" in graph
+
+
+def test_audio_only_file_has_no_cell():
+    parts = chains(simul_pb.compositor_graph([(0, (1, 0)), (1, (0, 1))], 1, 2, 2, {}))
+    assert parts[0].startswith("[vid1]scale=960:540:")
+    assert parts[1] == "[aid1]volume=1.000[a1]"
+    assert parts[2] == "[v0]pad=1920:540:0:0[vo]"
+
+
+def test_track_counts():
+    assert simul_pb.track_counts(None) == (1, 0)
+    assert simul_pb.track_counts({"audio": None}) == (1, 0)
+    assert simul_pb.track_counts({"video_tracks": 2, "audio": [{}, {}]}) == (2, 2)
+    assert simul_pb.track_counts({"video_tracks": 0, "audio": [{}]}) == (0, 1)
@@ -0,0 +1,192 @@
+import json
+import queue
+import socket
+import threading
+
+import pytest
+
+import simul_pb
+
+LAYOUTS = ["1x4", "1x3", "1x2", "1x1", "2x2"]
+
+
+def check(command, tiles=4):
+    return simul_pb.control_error(command, tiles, LAYOUTS)
+
+
+@pytest.mark.parametrize("command", [
+    {"cmd": "ping"},
+    {"cmd": "load", "tile": 0, "path": "a.mp4"},
+    {"cmd": "load", "tile": 3, "paths": ["a.mp4", "b.mp4"]},
+    {"cmd": "seek", "position": 12},
+    {"cmd": "seek", "position": 12.5},
+    {"cmd": "seek_tile", "tile": 1, "position": 0.0},
+    {"cmd": "loop", "on": True},
+    {"cmd": "volume", "tile": 2, "value": 40},
+    {"cmd": "step", "frames": -1},
+    {"cmd": "shuttle", "speed": 0},
+    {"cmd": "layout", "mode": "2x2"},
+    {"cmd": "set", "step": 1},
+])
+def test_valid_commands(command):
+    assert check(command) is None
+
+
+@pytest.mark.parametrize("command, message", [
+    ({"cmd": "nope"}, "unknown command"),
+    ("ping", "unknown command"),
+    ({"cmd": "load", "tile": 0}, "missing path or paths"),
+    ({"cmd": "load", "tile": 0, "paths": []}, "invalid paths"),
+    ({"cmd": "load", "tile": 0, "path": 3}, "invalid path"),
+    ({"cmd": "load", "tile": True, "path": "a.mp4"}, "tile must be 0-3"),
+    ({"cmd": "load", "tile": 4, "path": "a.mp4"}, "tile must be 0-3"),
+    ({"cmd": "seek"}, "missing position"),
+    ({"cmd": "seek", "position": "x"}, "invalid position"),
+    ({"cmd": "seek", "position": True}, "invalid position"),
+    ({"cmd": "seek", "position": float("nan")}, "invalid position"),
+    ({"cmd": "step", "frames": 1.5}, "invalid frames"),
+    ({"cmd": "shuttle", "speed": 4}, "invalid speed"),
+    ({"cmd": "set", "step": "1"}, "invalid step"),
+    ({"cmd": "loop", "on": 1}, "invalid on"),
+    ({"cmd": "layout", "mode": "3x3"}, "mode must be one of"),
+    ({"cmd": "layout", "mode": ["2x2"]}, "mode must be one of"),
+])
+def test_invalid_commands(command, message):
+    assert message in check(command)
+
+
+@pytest.fixture
+def server(tmp_path):
+    # UIスレッドの代わりにキューを処理するスレッドで動かす
+    calls = queue.Queue()
+    executed = []
+
+    def ui():
+        while True:
+            func, args = calls.get()
+            func(*args)
+
+    threading.Thread(target=ui, daemon=True).start()
+
+    def execute(commands):
+        errors = [simul_pb.control_error(command, 4, LAYOUTS) for command in commands]
+        if any(errors):
+            return [{"ok": False, "error": next(e for e in errors if e)}]
+        executed.extend(command["cmd"] for command in commands)
+        return [{"ok": True} for _ in commands]
+
+    control = simul_pb.ControlServer("127.0.0.1:0", execute, lambda: {"playing": False},
+                                     lambda func, *args: calls.put((func, args)))
+    control.start()
+    control.executed = executed
+    yield control
+    control.close()
+
+
+def connect(control):
+    conn = socket.create_connection(control._sock.getsockname())
+    return conn, conn.makefile("r", encoding="utf-8")
+
+
+def request(conn, reader, message):
+    conn.sendall((message if isinstance(message, str) else json.dumps(message)).encode() + b"\n")
+    return json.loads(reader.readline())
+
+
+def test_batch_is_all_or_nothing(server):
+    conn, reader = connect(server)
+    reply = request(conn, reader, {"id": 1, "batch": [{"cmd": "play"}, {"cmd": "load", "tile": 0}]})
+    assert reply["id"] == 1 and not reply["ok"]
+    assert server.executed == []
+    reply = request(conn, reader, {"id": 2, "batch": [{"cmd": "play"}, {"cmd": "seek", "position": 3}]})
+    assert reply["ok"] and server.executed == ["play", "seek"]
+    conn.close()
+
+
+def test_bad_requests_get_error_replies(server):
+    conn, reader = connect(server)
+    assert not request(conn, reader, "not json")["ok"]
+    assert not request(conn, reader, {"id": 3, "cmd": "subscribe", "interval": "fast"})["ok"]
+    assert not request(conn, reader, {"id": 4, "batch": 5})["ok"]
+    # 接続は切れずに次の要求も処理される
+    assert request(conn, reader, {"id": 5, "cmd": "ping"})["ok"]
+    conn.close()
+
+
+def test_subscribe_streams_state(server):
+    conn, reader = connect(server)
+    assert request(conn, reader, {"id": 1, "cmd": "subscribe", "interval": 0.02})["ok"]
+    event = json.loads(reader.readline())
+    assert event == {"playing": False, "event": "state"}
+    conn.close()
+
+
+def test_client_count(server):
+    connections = [connect(server) for _ in range(3)]
+    for conn, reader in connections:
+        assert request(conn, reader, {"cmd": "ping"})["ok"]
+    assert server.clients == 3
+    for conn, _ in connections:
+        conn.close()
+
+
+@pytest.fixture
+def app():
+    # タイル0だけに動画がある状態のアプリ。実行する関数は呼ばれた順を記録するだけのものに差し替える
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(i) for i in range(2)]
+    app.tiles[0].video_file, app.tiles[0].player = "a.mp4", object()
+    app.layout_modes = simul_pb.layout_modes(2)
+    app.compositor = None
+    app.set_queue = simul_pb.SetQueue([["a.mp4"], ["b.mp4"]])
+    app.ran = []
+
+    def fail(command):
+        raise RuntimeError("player gone")
+
+    def run(name, value=None):
+        return lambda command: app.ran.append(name) or value
+
+    app.control_commands = lambda: {"play": run("play"), "seek": run("seek", 3.5), "seek_tile": run("seek_tile"),
+                                    "set": run("set"), "pause": fail, "ping": run("ping")}
+    return app
+
+
+def test_execute_control_validates_the_whole_batch_first(app):
+    assert app.execute_control([{"cmd": "play"}, {"cmd": "seek", "position": "soon"}]) == [
+        {"ok": False, "error": simul_pb.control_error({"cmd": "seek", "position": "soon"}, 2, app.layout_modes)}]
+    assert app.ran == []
+    assert app.execute_control([{"cmd": "play"}, {"cmd": "seek", "position": 1}]) == [
+        {"ok": True}, {"ok": True, "value": 3.5}]
+    assert app.ran == ["play", "seek"]
+
+
+@pytest.mark.parametrize("command, message", [
+    ({"cmd": "seek_tile", "tile": 1, "position": 2.0}, "seek_tile: tile 1 has no video"),
+    ({"cmd": "set", "step": 1}, None),
+    ({"cmd": "set", "step": 2}, "set: no comparison set at +2"),
+    ({"cmd": "set", "step": -1}, "set: no comparison set at -1"),
+    ({"cmd": "seek_tile", "tile": 0, "position": 2.0}, None),
+])
+def test_runtime_preconditions(app, command, message):
+    assert app.control_unavailable(command) == message
+
+
+def test_batch_with_an_unavailable_command_runs_nothing(app):
+    results = app.execute_control([{"cmd": "play"}, {"cmd": "seek_tile", "tile": 1, "position": 2.0}])
+    assert results == [{"ok": False, "error": "seek_tile: tile 1 has no video"}]
+    assert app.ran == []
+
+
+def test_seek_needs_some_video(app):
+    app.tiles[0].player = None
+    assert app.control_unavailable({"cmd": "seek", "position": 1.0}) == "seek: no video loaded"
+    app.compositor = object()  # 合成モードでは合成したプレーヤーをシークする
+    assert app.control_unavailable({"cmd": "seek", "position": 1.0}) is None
+    assert app.control_unavailable({"cmd": "seek_tile", "tile": 1, "position": 1.0}) is None
+
+
+def test_runtime_failure_stops_the_batch(app):
+    results = app.execute_control([{"cmd": "play"}, {"cmd": "pause"}, {"cmd": "ping"}])
+    assert results == [{"ok": True}, {"ok": False, "error": "player gone"}, {"ok": False, "error": "not run"}]
+    assert app.ran == ["play"]
@@ -0,0 +1,83 @@
+import pytest
+
+import simul_pb
+
+
+def info(codec="h264", width=1920, height=1080, fps=30.0):
+    return simul_pb.StreamInfo(width, height, fps, codec)
+
+
+def test_stream_cost_is_relative_to_1080p30_h264():
+    assert info().cost() == pytest.approx(1.0)
+    assert info("hevc", 3840, 2160, 60.0).cost() == pytest.approx(1.6 * 4 * 2)
+    assert simul_pb.StreamInfo().cost() == pytest.approx(1.0)  # 不明な値は1080p30とみなす
+
+
+def test_heaviest_streams_get_the_hardware_slots():
+    scheduler = simul_pb.DecodeScheduler(cores=8, hw_slots=2)
+    scheduler.set_stream(0, info("h264", 1280, 720))
+    scheduler.set_stream(1, info("hevc", 3840, 2160))
+    scheduler.set_stream(2, info("h264"))
+    plans = scheduler.plan()
+    assert plans[1].hwdec == "auto" and plans[2].hwdec == "auto"
+    assert plans[1].threads == 1
+    assert plans[0] == simul_pb.DecodePlan(threads=6, hwdec="no", framedrop="vo")
+
+
+def test_software_threads_follow_cost():
+    scheduler = simul_pb.DecodeScheduler(cores=8, hw_slots=0)
+    scheduler.set_stream(0, info(height=1080))
+    scheduler.set_stream(1, info(width=3840, height=2160))
+    plans = scheduler.plan()
+    # 8スレッドを1:4で分ける
+    assert plans[0].threads == 2
+    assert plans[1].threads == 6
+    assert all(plan.hwdec == "no" for plan in plans.values())
+
+
+def test_hidden_tiles_get_minimal_resources():
+    scheduler = simul_pb.DecodeScheduler(cores=8, hw_slots=4)
+    scheduler.set_stream(0, info())
+    scheduler.set_stream(1, info())
+    scheduler.set_visible(1, False)
+    plans = scheduler.plan()
+    assert plans[0].hwdec == "auto"
+    assert plans[1] == simul_pb.DecodePlan(threads=1, hwdec="no", framedrop="decoder+vo")
+
+
+def test_overload_lets_the_decoder_drop_frames():
+    scheduler = simul_pb.DecodeScheduler(cores=2, hw_slots=0, core_capacity=1.0)
+    for i in range(4):
+        scheduler.set_stream(i, info())
+    plans = scheduler.plan()
+    assert all(plan.framedrop == "decoder+vo" and plan.threads >= 1 for plan in plans.values())
+
+
+def test_failed_hardware_decoding_falls_back_to_software():
+    scheduler = simul_pb.DecodeScheduler(cores=4, hw_slots=4)
+    scheduler.set_stream(0, info())
+    assert scheduler.hwdec_unavailable(0)
+    assert not scheduler.hwdec_unavailable(0)  # 2回目は何もしない
+    assert scheduler.plan()[0].hwdec == "no"
+    # 別のファイルを読み込めばまた試す
+    scheduler.set_stream(0, info())
+    assert scheduler.plan()[0].hwdec == "auto"
+
+
+def test_unsupported_codecs_stay_in_software():
+    scheduler = simul_pb.DecodeScheduler(cores=4, hw_slots=4)
+    scheduler.set_stream(0, info("prores"))
+    assert scheduler.plan()[0].hwdec == "no"
+
+
+def test_sustained_drops_raise_the_estimate():
+    scheduler = simul_pb.DecodeScheduler(cores=8, hw_slots=0)
+    scheduler.set_stream(0, info())
+    scheduler.set_stream(1, info())
+    assert not scheduler.note_drops(0, 0)  # 最初の値は基準にするだけ
+    assert not scheduler.note_drops(0, 5)
+    assert scheduler.note_drops(0, 20)
+    assert scheduler.note_drops(0, 40)
+    assert scheduler.note_drops(0, 60)
+    plans = scheduler.plan()
+    assert plans[0].threads > plans[1].threads
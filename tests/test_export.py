@@ -0,0 +1,76 @@
+import sys
+import threading
+
+import pytest
+
+import simul_pb
+
+# ffmpegの-progress pipe:1と同じ形式で進捗を出力する偽のffmpeg
+FAKE_FFMPEG = """
+import sys, time
+for out_time, fps in (("N/A", "0.00"), ("500000", "60.00"), ("1000000", "n/a")):
+    print("frame=1")
+    print("fps=" + fps)
+    print("out_time_us=" + out_time)
+    print("progress=continue", flush=True)
+    time.sleep(float(sys.argv[2]))
+print("progress=end", flush=True)
+print("Conversion failed: boom", file=sys.stderr)
+sys.exit(int(sys.argv[1]))
+"""
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    monkeypatch.setattr(simul_pb.shutil, "which", lambda name: "/usr/bin/" + name)
+    return simul_pb.GridExporter()
+
+
+def test_command_reads_each_input_from_its_offset(exporter):
+    inputs = [(0, "a.mp4", 0.0, (1, 1)), (1, "b.mp4", -2.0, (1, 0)), (2, "c.mp4", 1.5, (1, 1))]
+    args = exporter.command(inputs, 2, 2, 3, {0: 50}, 1.0, 11.0, "out.mp4")
+    assert args[:5] == ["/usr/bin/ffmpeg", "-v", "error", "-nostdin", "-y"]
+    assert args[5:20] == ["-ss", "1.000", "-t", "10.000", "-i", "a.mp4",
+                          "-ss", "0.000", "-t", "10.000", "-i", "b.mp4",
+                          "-ss", "2.500", "-t"]
+    graph = args[args.index("-filter_complex") + 1]
+    assert graph == simul_pb.compositor_graph([(0, (1, 1)), (1, (1, 0)), (2, (1, 1))], 2, 2, 3, {0: 50}, ffmpeg=True)
+    assert args[args.index("[vo]") - 1] == "-map" and args[args.index("[ao]") - 1] == "-map"
+    assert args[-5:] == ["+faststart", "-progress", "pipe:1", "-nostats", "out.mp4"]
+
+
+def test_command_without_audio_maps_video_only(exporter):
+    args = exporter.command([(0, "a.mp4", 0.0, (1, 0))], 1, 1, 1, {}, 0.0, 5.0, "out.mp4")
+    assert "[ao]" not in args and "-c:a" not in args
+
+
+def test_run_reports_progress(exporter, tmp_path):
+    script = tmp_path / "ffmpeg.py"
+    script.write_text(FAKE_FFMPEG, encoding="utf-8")
+    progress = []
+    elapsed = exporter.run([sys.executable, str(script), "0", "0"],
+                           lambda done, fps, speed: progress.append((done, fps)))
+    assert elapsed > 0
+    assert progress == [(0.0, 0.0), (0.5, 60.0), (1.0, 0.0), (1.0, 0.0)]
+
+
+def test_run_raises_with_ffmpeg_errors(exporter, tmp_path):
+    script = tmp_path / "ffmpeg.py"
+    script.write_text(FAKE_FFMPEG, encoding="utf-8")
+    with pytest.raises(RuntimeError, match="ffmpeg failed: Conversion failed: boom"):
+        exporter.run([sys.executable, str(script), "1", "0"])
+
+
+def test_cancel_stops_a_running_export(exporter, tmp_path):
+    script = tmp_path / "ffmpeg.py"
+    script.write_text(FAKE_FFMPEG, encoding="utf-8")
+    started = threading.Event()
+
+    def on_progress(done, fps, speed):
+        started.set()
+
+    timer = threading.Thread(target=lambda: started.wait(10) and exporter.cancel())
+    timer.start()
+    with pytest.raises(RuntimeError, match="cancelled"):
+        exporter.run([sys.executable, str(script), "0", "30"], on_progress)
+    timer.join()
@@ -0,0 +1,82 @@
+import types
+
+import pytest
+
+import simul_pb
+
+
+@pytest.mark.parametrize("count, size, expected", [
+    (1, (1280, 680), (1, 1)),
+    (2, (1280, 680), (1, 2)),
+    (4, (1280, 680), (2, 2)),
+    (6, (1280, 680), (2, 3)),
+    (8, (1920, 1080), (3, 3)),
+    (9, (1920, 1080), (3, 3)),
+    (16, (1920, 1080), (4, 4)),
+    (4, (400, 2000), (4, 1)),  # 縦長のウィンドウでは縦に並べる
+])
+def test_compute_grid_maximizes_the_video_area(count, size, expected):
+    assert simul_pb.compute_grid(count, *size) == expected
+
+
+@pytest.mark.parametrize("count", range(1, 26))
+def test_compute_grid_fits_every_tile(count):
+    rows, cols = simul_pb.compute_grid(count, 1920, 1080)
+    assert rows * cols >= count
+    assert (rows - 1) * cols < count  # 空の行を作らない
+
+
+def test_compute_grid_falls_back_to_one_row_when_nothing_fits():
+    assert simul_pb.compute_grid(3, 10, 10) == (1, 3)
+
+
+def test_layout_modes_keep_the_four_tile_order():
+    assert simul_pb.layout_modes(4) == ["1x4", "1x3", "1x2", "1x1", "2x2"]
+
+
+@pytest.mark.parametrize("count, expected", [
+    (1, ["auto", "1x1"]),
+    (2, ["auto", "1x2", "1x1"]),
+    (9, ["auto", "1x4", "1x3", "1x2", "1x1"]),
+])
+def test_layout_modes(count, expected):
+    assert simul_pb.layout_modes(count) == expected
+
+
+def test_layout_window_size():
+    assert simul_pb.layout_window_size(2, 2) == "760x680"
+    assert simul_pb.layout_window_size(3, 3) == "960x960"
+    assert simul_pb.layout_window_size(1, 1) == "400x400"
+
+
+def layout_app(count, mode, size=(1920, 1080)):
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(i) for i in range(count)]
+    app.layout_modes = simul_pb.layout_modes(count)
+    app.layout_mode = mode
+    app.player_frame = types.SimpleNamespace(winfo_width=lambda: size[0], winfo_height=lambda: size[1])
+    return app
+
+
+@pytest.mark.parametrize("count, mode, expected", [
+    (9, "auto", (3, 3, 9)),
+    (9, "1x3", (1, 3, 3)),
+    (2, "1x1", (1, 1, 1)),
+    (4, "2x2", (2, 2, 4)),
+])
+def test_layout_shape(count, mode, expected):
+    assert layout_app(count, mode).layout_shape() == expected
+
+
+def test_auto_layout_uses_a_minimum_size_before_the_window_is_mapped():
+    # 表示前のwinfo_width/heightは1を返す
+    assert layout_app(4, "auto", size=(1, 1)).layout_shape() == simul_pb.compute_grid(4, 320, 240) + (4,)
+
+
+def test_toggle_layout_cycles_through_the_modes():
+    app = layout_app(6, "auto")
+    applied = []
+    app.apply_layout = lambda resize_window=False: applied.append((app.layout_mode, resize_window))
+    for _ in range(len(app.layout_modes)):
+        app.toggle_layout()
+    assert applied == [("1x4", True), ("1x3", True), ("1x2", True), ("1x1", True), ("auto", True)]
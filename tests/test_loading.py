@@ -0,0 +1,152 @@
+import threading
+import types
+
+import pytest
+
+import simul_pb
+
+EVENTS = types.SimpleNamespace(START_FILE=6, END_FILE=7, FILE_LOADED=8, PLAYBACK_RESTART=21)
+END_REASONS = types.SimpleNamespace(EOF=0, STOP=2, ERROR=4)
+
+
+class FakePlayer:
+    # loadfileの引数とイベントコールバックだけを記録する
+    def __init__(self, duration=12.5):
+        self.duration = duration
+        self.loads = []
+        self.callbacks = []
+
+    def register_event_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def loadfile(self, path, **options):
+        self.loads.append((path, options))
+
+    def emit(self, eid, reason=None, error=None):
+        event = types.SimpleNamespace(event_id=types.SimpleNamespace(value=eid),
+                                      data=types.SimpleNamespace(reason=reason, error=error))
+        for callback in self.callbacks:
+            callback(event)
+
+
+@pytest.fixture(autouse=True)
+def fake_mpv(monkeypatch):
+    monkeypatch.setattr(simul_pb, "mpv", types.SimpleNamespace(MpvEventID=EVENTS, MpvEventEndFile=END_REASONS))
+
+
+@pytest.fixture
+def loader():
+    loader = simul_pb.FileLoader(lambda func, *args: func(*args), timeout=5.0, restart_grace=5.0)
+    loader.calls = []  # コールバックの呼び出し記録
+    yield loader
+    for index in list(loader._pending):
+        loader.cancel(index)
+
+
+def recorder(calls, name):
+    return lambda index, request: calls.append((name, index, request))
+
+
+def test_load_passes_start_and_pause_options(loader):
+    player = FakePlayer()
+    loader.load(0, player, "a.mp4", start=1.25, pause=False, options={"vid": "1"})
+    assert player.loads == [("a.mp4", {"vid": "1", "pause": "no", "start": "1.250"})]
+
+
+def test_load_completes_after_file_loaded_and_playback_restart(loader):
+    player = FakePlayer()
+    loader.attach(0, player)
+    request = loader.load(0, player, "a.mp4", on_loaded=recorder(loader.calls, "loaded"))
+    player.emit(EVENTS.START_FILE)
+    player.emit(EVENTS.FILE_LOADED)
+    assert loader.calls == []
+    player.emit(EVENTS.PLAYBACK_RESTART)
+    assert loader.calls == [("loaded", 0, request)]
+    assert request.duration == 12.5 and request.latency is not None and request.error is None
+
+
+def test_events_before_start_file_belong_to_the_previous_file(loader):
+    player = FakePlayer()
+    loader.attach(0, player)
+    loader.load(0, player, "a.mp4", on_loaded=recorder(loader.calls, "loaded"))
+    player.emit(EVENTS.FILE_LOADED)
+    player.emit(EVENTS.PLAYBACK_RESTART)
+    assert loader.calls == []
+
+
+def test_events_from_a_replaced_player_are_ignored(loader):
+    old, new = FakePlayer(), FakePlayer()
+    loader.attach(0, old)
+    loader.attach(0, new)
+    loader.load(0, new, "a.mp4", on_loaded=recorder(loader.calls, "loaded"))
+    for eid in (EVENTS.START_FILE, EVENTS.FILE_LOADED, EVENTS.PLAYBACK_RESTART):
+        old.emit(eid)
+    assert loader.calls == []
+
+
+def test_end_file_error_fails_the_load(loader):
+    player = FakePlayer()
+    loader.attach(1, player)
+    request = loader.load(1, player, "broken.mp4", on_loaded=recorder(loader.calls, "loaded"),
+                          on_failed=recorder(loader.calls, "failed"))
+    player.emit(EVENTS.START_FILE)
+    player.emit(EVENTS.END_FILE, reason=END_REASONS.STOP)
+    assert loader.calls == []
+    player.emit(EVENTS.END_FILE, reason=END_REASONS.ERROR, error=-13)
+    assert loader.calls == [("failed", 1, request)]
+    assert request.error == "end-file error -13"
+
+
+def test_new_load_replaces_the_pending_one(loader):
+    player = FakePlayer()
+    loader.attach(0, player)
+    first = loader.load(0, player, "a.mp4", on_loaded=recorder(loader.calls, "first"))
+    second = loader.load(0, player, "b.mp4", on_loaded=recorder(loader.calls, "second"))
+    for eid in (EVENTS.START_FILE, EVENTS.FILE_LOADED, EVENTS.PLAYBACK_RESTART):
+        player.emit(eid)
+    assert loader.calls == [("second", 0, second)]
+    assert not first.timer.is_alive()
+
+
+def test_load_times_out_without_file_loaded():
+    done = threading.Event()
+    calls = []
+
+    def failed(index, request):
+        calls.append(request.error)
+        done.set()
+
+    loader = simul_pb.FileLoader(lambda func, *args: func(*args), timeout=0.05)
+    loader.load(0, FakePlayer(), "a.mp4", on_failed=failed)
+    assert done.wait(2)
+    assert calls == ["timeout"]
+
+
+def test_missing_playback_restart_still_completes_after_the_grace_period():
+    done = threading.Event()
+    calls = []
+
+    def loaded(index, request):
+        calls.append(request.error)
+        done.set()
+
+    loader = simul_pb.FileLoader(lambda func, *args: func(*args), timeout=5.0, restart_grace=0.05)
+    player = FakePlayer()
+    loader.attach(0, player)
+    loader.load(0, player, "a.mp4", on_loaded=loaded)
+    player.emit(EVENTS.START_FILE)
+    player.emit(EVENTS.FILE_LOADED)
+    assert done.wait(2)
+    assert calls == [None]
+
+
+def test_failed_loadfile_is_not_left_pending(loader):
+    player = FakePlayer()
+
+    def broken(path, **options):
+        raise RuntimeError("no such file")
+
+    player.loadfile = broken
+    with pytest.raises(RuntimeError):
+        loader.load(2, player, "a.mp4")
+    assert 2 not in loader._pending
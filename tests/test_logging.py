@@ -0,0 +1,54 @@
+import logging
+
+import pytest
+
+import simul_pb
+
+
+def record(msg, *args, name="simul_pb.sync"):
+    return logging.LogRecord(name, logging.WARNING, __file__, 1, msg, args, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(simul_pb.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_passes_then_drops(clock):
+    limit = simul_pb.RateLimitFilter(burst=3, period=1.0)
+    results = [limit.filter(record("Player %s drift %dms", 1, i)) for i in range(5)]
+    assert results == [True, True, True, False, False]
+
+
+def test_next_message_reports_the_suppressed_count(clock):
+    limit = simul_pb.RateLimitFilter(burst=1, period=1.0)
+    assert limit.filter(record("Seek %s", 1))
+    assert not limit.filter(record("Seek %s", 2))
+    assert not limit.filter(record("Seek %s", 3))
+    clock[0] += 1.0
+    passed = record("Seek %s", 4)
+    assert limit.filter(passed)
+    assert passed.getMessage() == "Seek 4 (2 similar messages suppressed)"
+    # 数えた分はリセットされる
+    clock[0] += 1.0
+    again = record("Seek %s", 5)
+    assert limit.filter(again)
+    assert again.getMessage() == "Seek 5"
+
+
+def test_formats_and_loggers_are_limited_separately(clock):
+    limit = simul_pb.RateLimitFilter(burst=1, period=1.0)
+    assert limit.filter(record("A %s", 1))
+    assert limit.filter(record("B %s", 1))
+    assert limit.filter(record("A %s", 1, name="simul_pb.seek"))
+    assert not limit.filter(record("A %s", 2))
+
+
+def test_parse_log_levels():
+    assert simul_pb.parse_log_levels(["sync=debug", "mpv=ERROR"]) == {"sync": logging.DEBUG, "mpv": logging.ERROR}
+    assert simul_pb.parse_log_levels(None) == {}
+    for spec in ["nosuch=debug", "sync=loud", "sync"]:
+        with pytest.raises(ValueError):
+            simul_pb.parse_log_levels([spec])
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+
+import pytest
+
+import simul_pb
+
+PROBE_JSON = {
+    "format": {"duration": "62.500000", "bit_rate": "8000000"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080,
+         "avg_frame_rate": "30000/1001", "r_frame_rate": "30000/1001"},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "channels": 2, "sample_rate": "48000"},
+        {"index": 2, "codec_type": "video", "codec_name": "mjpeg", "width": 300, "height": 300,
+         "avg_frame_rate": "0/0", "r_frame_rate": "90000/1"},
+    ],
+}
+
+
+@pytest.mark.parametrize("text, rate", [
+    ("30000/1001", 30000 / 1001),
+    ("25", 25.0),
+    ("0/0", None),
+    ("0/1", None),
+    ("abc", None),
+    (None, None),
+])
+def test_parse_rate(text, rate):
+    assert simul_pb.parse_rate(text) == rate
+
+
+def test_media_summary():
+    media = dict(width=1920, height=1080, codec="h264", fps=25.0, audio=[{}, {}], duration=62.5)
+    assert simul_pb.media_summary(media) == "1920x1080 h264 25fps 2 audio 01:02"
+    assert simul_pb.media_summary(dict(width=None, codec=None, audio=[])) == ""
+
+
+@pytest.mark.parametrize("media, counts", [
+    (None, (1, 0)),
+    ({"video_tracks": 2, "audio": [{}]}, (2, 1)),
+    ({"video_tracks": 0, "audio": []}, (0, 0)),
+])
+def test_track_counts(media, counts):
+    assert simul_pb.track_counts(media) == counts
+
+
+def test_media_key_changes_with_the_file(tmp_path):
+    path = tmp_path / "a.mp4"
+    path.write_bytes(b"one")
+    first = simul_pb.media_key(str(path))
+    assert simul_pb.media_key(str(path)) == first
+    path.write_bytes(b"longer")
+    assert simul_pb.media_key(str(path)) != first
+
+
+@pytest.fixture
+def probe(tmp_path, monkeypatch):
+    monkeypatch.delenv("LOCALAPPDATA", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(simul_pb.shutil, "which", lambda name: "/usr/bin/" + name)
+    runs = []
+
+    def run_tool(args, timeout=120, running=None):
+        runs.append(args[-1])
+        return json.dumps(PROBE_JSON).encode("utf-8")
+
+    monkeypatch.setattr(simul_pb, "run_tool", run_tool)
+    probe = simul_pb.MediaProbe(lambda func, *args: func(*args))
+    probe.runs = runs
+    probe.video = str(tmp_path / "a.mp4")
+    with open(probe.video, "wb") as f:
+        f.write(b"video")
+    yield probe
+    probe.close()
+
+
+def test_probe_parses_ffprobe_output(probe):
+    media = probe.probe(probe.video)
+    assert media == dict(duration=62.5, width=1920, height=1080, fps=30000 / 1001, codec="h264", bitrate=8000000,
+                         audio=[dict(codec="aac", channels=2, sample_rate="48000")], video_tracks=2)
+
+
+def test_probe_result_is_cached_by_file(probe):
+    probe.probe(probe.video)
+    probe.probe(probe.video)
+    assert probe.runs == [probe.video]
+    # 別のインスタンス (次回の起動) でもディスクのキャッシュを使う
+    again = simul_pb.MediaProbe(lambda func, *args: func(*args))
+    try:
+        assert again.cached(probe.video)["codec"] == "h264"
+    finally:
+        again.close()
+    with open(probe.video, "ab") as f:
+        f.write(b"changed")
+    probe.probe(probe.video)
+    assert probe.runs == [probe.video, probe.video]
+
+
+def test_request_probes_in_the_background(probe):
+    ready = threading.Event()
+    results = []
+
+    def on_ready(path, media):
+        results.append((path, media["duration"]))
+        ready.set()
+
+    probe.request(probe.video, on_ready)
+    assert ready.wait(5)
+    probe.request(probe.video, lambda path, media: results.append("cached"))
+    assert results == [(probe.video, 62.5), "cached"]
+
+
+def test_probe_failure_is_not_cached(probe, monkeypatch):
+    def broken(args, timeout=120, running=None):
+        raise RuntimeError("ffprobe failed: invalid data")
+
+    monkeypatch.setattr(simul_pb, "run_tool", broken)
+    assert probe.probe(probe.video) is None
+    assert probe.cached(probe.video) is None
+
+
+def test_remember_keeps_an_existing_probe(probe):
+    probe.remember(probe.video, {"duration": 1.0})
+    probe.remember(probe.video, {"duration": 2.0})
+    assert probe.cached(probe.video) == {"duration": 1.0}
+    probe.remember(os.path.join(os.path.dirname(probe.video), "missing.mp4"), {"duration": 3.0})
@@ -0,0 +1,82 @@
+import pytest
+
+import simul_pb
+
+
+class FakePlayer:
+    # mpvのプロパティ読み取りだけを真似る。辞書にないものは取得できないプロパティ
+    def __init__(self, **properties):
+        self.properties = properties
+
+    def __getitem__(self, name):
+        if name not in self.properties:
+            raise RuntimeError(f"property unavailable: {name}")
+        return self.properties[name]
+
+
+@pytest.mark.parametrize("value, forward, total", [
+    ({"fw-bytes": 1024, "total-bytes": 4096}, 1024, 4096),
+    ({}, None, None),
+    (None, None, None),
+    ("unavailable", None, None),
+])
+def test_cache_state_bytes(value, forward, total):
+    assert simul_pb.cache_fw_bytes(value) == forward
+    assert simul_pb.cache_total_bytes(value) == total
+
+
+def test_sample_reads_every_metric_and_converts_cache_state():
+    player = FakePlayer(**{"frame-drop-count": 3, "demuxer-cache-state": {"fw-bytes": 100, "total-bytes": 300},
+                           "time-pos": 1.5})
+    collector = simul_pb.MetricsCollector(lambda: [(0, player)])
+    [(index, values)] = collector.sample()
+    assert index == 0 and list(values) == simul_pb.MetricsCollector.KEYS
+    assert values["vo_drops"] == 3 and values["cache_bytes"] == 100 and values["cache_total"] == 300
+    assert values["position"] == 1.5 and values["avsync"] is None
+
+
+def test_latest_reports_drop_rates_between_the_last_two_samples():
+    collector = simul_pb.MetricsCollector(lambda: [])
+    collector.history[1].append((10.0, {"vo_drops": 4, "decoder_drops": 0, "delayed": None}))
+    collector.history[1].append((12.0, {"vo_drops": 10, "decoder_drops": 1, "delayed": None}))
+    collector.history[2].append((12.0, {"vo_drops": 1, "decoder_drops": 0, "delayed": 0}))
+    latest = collector.latest()
+    assert latest[1][1] == {"vo_drops": 3.0, "decoder_drops": 0.5}
+    assert latest[2] == ({"vo_drops": 1, "decoder_drops": 0, "delayed": 0}, {})
+    collector.forget(1)
+    assert list(collector.latest()) == [2]
+
+
+def test_history_is_bounded():
+    collector = simul_pb.MetricsCollector(lambda: [(0, FakePlayer())], history=3)
+    for _ in range(5):
+        collector.sample()
+    assert len(collector.history[0]) == 3
+
+
+def test_csv_is_appended_with_one_header(tmp_path):
+    path = tmp_path / "metrics.csv"
+    players = [(0, FakePlayer(**{"frame-drop-count": 2})), (3, FakePlayer())]
+    for _ in range(2):
+        collector = simul_pb.MetricsCollector(lambda: players, csv_path=str(path))
+        collector.sample()
+        collector.stop_thread()
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == ",".join(["timestamp", "tile"] + simul_pb.MetricsCollector.KEYS)
+    assert len(lines) == 5
+    assert [line.split(",")[1:3] for line in lines[1:]] == [["1", "2"], ["4", ""], ["1", "2"], ["4", ""]]
+
+
+def test_prometheus_file_has_the_latest_values_only(tmp_path):
+    path = tmp_path / "metrics.prom"
+    player = FakePlayer(**{"frame-drop-count": 1, "speed": 1.0})
+    collector = simul_pb.MetricsCollector(lambda: [(0, player)], prom_path=str(path))
+    collector.sample()
+    player.properties["frame-drop-count"] = 7
+    collector.sample()
+    text = path.read_text(encoding="utf-8")
+    assert "# TYPE simul_pb_vo_dropped_frames_total counter" in text
+    assert 'simul_pb_vo_dropped_frames_total{tile="1"} 7.0' in text
+    assert 'simul_pb_speed{tile="1"} 1.0' in text
+    assert "simul_pb_avsync_seconds{" not in text
+    assert not (tmp_path / "metrics.prom.tmp").exists()
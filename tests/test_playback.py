@@ -0,0 +1,128 @@
+import queue
+
+import pytest
+
+import simul_pb
+
+
+class FakePlayer:
+    def __init__(self):
+        self.pause = False
+
+
+class FakeSlider:
+    def __init__(self):
+        self.value = 0.0
+
+    def cget(self, name):
+        return {"state": "normal", "resolution": 0.1}[name]
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class FakeLabel:
+    def __init__(self):
+        self.text = None
+
+    def config(self, text):
+        self.text = text
+
+
+class FakeRoot:
+    def after(self, ms, func):
+        return "after"
+
+
+@pytest.fixture
+def app():
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(i) for i in range(2)]
+    for tile in app.tiles:
+        tile.player = FakePlayer()
+        tile.video_file = "a.mp4"
+        tile.duration = 60.0
+    app.loop_enabled = False
+    app.progress_queue = queue.Queue()
+    app.ui_queue = queue.Queue()
+    return app
+
+
+def queued(q):
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait())
+    return items
+
+
+@pytest.mark.parametrize("seconds, text", [
+    (None, "--:--"),
+    (-3, "00:00"),
+    (59.9, "00:59"),
+    (61, "01:01"),
+    (3600 + 62, "1:01:02"),
+])
+def test_format_time(seconds, text):
+    assert simul_pb.format_time(seconds) == text
+
+
+def test_end_before_last_second_is_ignored(app):
+    app.tiles[0].position = 30.0
+    app.on_tile_end(0, "eof-reached", True)
+    assert not app.tiles[0].ended
+    assert not app.tiles[0].player.pause
+    assert app.ui_queue.empty()
+
+
+@pytest.mark.parametrize("name", ["end-file", "eof-reached", "idle"])
+def test_end_pauses_and_defers_check_to_ui(app, name):
+    app.tiles[0].position = 59.5
+    app.on_tile_end(0, name, True)
+    assert app.tiles[0].ended
+    assert app.tiles[0].player.pause
+    assert queued(app.progress_queue) == [(0, "time-pos", 60.0)]
+    # check_all_ended はmpvのスレッドから直接呼ばずUIスレッドに回す
+    assert queued(app.ui_queue) == [(app.check_all_ended, ())]
+
+
+def test_end_is_handled_once(app):
+    app.tiles[0].position = 60.0
+    app.on_tile_end(0, "end-file", True)
+    app.on_tile_end(0, "eof-reached", True)
+    app.on_tile_end(0, "idle", True)
+    assert len(queued(app.ui_queue)) == 1
+
+
+@pytest.mark.parametrize("value, loop", [(False, False), (None, False), (True, True)])
+def test_end_is_ignored_when_false_or_looping(app, value, loop):
+    app.loop_enabled = loop
+    app.tiles[0].position = 60.0
+    app.on_tile_end(0, "eof-reached", value)
+    assert not app.tiles[0].ended
+    assert app.ui_queue.empty()
+
+
+def test_end_without_video_is_ignored(app):
+    app.tiles[1].video_file = None
+    app.on_tile_end(1, "idle", True)
+    assert not app.tiles[1].ended
+
+
+def test_update_progress_keeps_only_the_latest_value(app):
+    app.root = FakeRoot()
+    app.progress_interval_ms = 100
+    app.refresh_group_progress = lambda: None
+    tile = app.tiles[1]
+    tile.progress_slider, tile.time_label = FakeSlider(), FakeLabel()
+    for value in (1.0, 2.0, 3.0):
+        app.progress_queue.put((1, "time-pos", value))
+    app.progress_queue.put((1, "duration", 90.0))
+    app.update_progress()
+    assert tile.position == 3.0 and tile.duration == 90.0
+    assert tile.progress_slider.value == 3.0
+    assert tile.displayed_position == 3.0
+    assert tile.time_label.text == "00:03 / -01:27"
+    assert app.tiles[0].position is None
@@ -0,0 +1,71 @@
+import simul_pb
+
+
+class FakePlayer:
+    # mpvのプロパティの読み書きだけを記録する
+    def __init__(self, vo_configured, vid='auto'):
+        self.properties = {'vo-configured': vo_configured, 'vid': vid}
+        self.writes = []
+
+    def __getitem__(self, name):
+        return self.properties[name]
+
+    def __setitem__(self, name, value):
+        self.properties[name] = value
+        self.writes.append((name, value))
+
+    def __getattr__(self, name):
+        return self.properties[name]
+
+    def __setattr__(self, name, value):
+        if name in ('properties', 'writes'):
+            return super().__setattr__(name, value)
+        self[name] = value
+
+
+def test_bind_window_before_video_output_only_sets_wid():
+    player = FakePlayer(vo_configured=False)
+    simul_pb.bind_window(player, 1234)
+    assert player.writes == [('wid', '1234')]
+
+
+def test_bind_window_recreates_an_existing_video_output():
+    player = FakePlayer(vo_configured=True, vid=2)
+    simul_pb.bind_window(player, 1234)
+    assert player.writes == [('wid', '1234'), ('vid', 'no'), ('vid', 2)]
+
+
+def test_bind_window_leaves_disabled_video_alone():
+    player = FakePlayer(vo_configured=True, vid='no')
+    simul_pb.bind_window(player, 99)
+    assert player.writes == [('wid', '99')]
+
+
+def test_when_mpv_ready_waits_off_the_ui_thread(monkeypatch):
+    import queue
+    import threading
+
+    importing = threading.Event()
+    release = threading.Event()
+
+    def slow_import():
+        importing.set()
+        release.wait(5)
+        monkeypatch.setattr(simul_pb, "mpv", object())
+
+    monkeypatch.setattr(simul_pb, "mpv", None)
+    monkeypatch.setattr(simul_pb, "load_mpv", slow_import)
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.ui_queue = queue.Queue()
+    calls = []
+    app.when_mpv_ready(calls.append, "first")
+    # importが終わるまで呼び出し元 (UIスレッド) には戻ってくるだけで、何も呼ばれない
+    assert importing.wait(5)
+    assert calls == [] and app.ui_queue.empty()
+    release.set()
+    func, args = app.ui_queue.get(timeout=5)
+    func(*args)
+    assert calls == ["first"]
+    # import済みならその場で呼ぶ
+    app.when_mpv_ready(calls.append, "second")
+    assert calls == ["first", "second"]
@@ -0,0 +1,131 @@
+import queue
+import types
+
+import pytest
+
+import simul_pb
+
+
+class FakePlayer:
+    # bind_windowとswap_in_preloadedが触るプロパティだけを持つ
+    def __init__(self, name, vo_configured=False):
+        self.name = name
+        self.properties = {"vo-configured": vo_configured}
+        self.vid = "no"
+
+    def __getitem__(self, key):
+        return self.properties[key]
+
+    def __setitem__(self, key, value):
+        self.properties[key] = value
+
+    def __repr__(self):
+        return self.name
+
+
+class Recorder:
+    # 呼ばれた関数と引数を記録するだけのオブジェクト
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name,) + args)
+
+
+@pytest.fixture
+def app():
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(i) for i in range(4)]
+    for tile in app.tiles:
+        tile.wid = 100 + tile.index
+    app.compositor = None
+    app.playing = False
+    app.is_muted = False
+    app.loop_enabled = True
+    app.preload = None
+    app.set_queue = simul_pb.SetQueue([["a0", "a1", "a2"], ["b0", "b1", "b2"], ["c0"]])
+    app.calls = Recorder()
+    app.terminated = queue.Queue()
+    app.terminate_player = lambda index, player: app.terminated.put(player)
+    app.preload_loader = app.loader = app.seek_barrier = app.scrubber = app.media_probe = app.calls
+    for name in ("clear_tile", "open_file", "on_tile_loaded", "start_preload", "update_set_controls",
+                 "observe_player", "unobserve_player"):
+        setattr(app, name, getattr(app.calls, name))
+
+    def reset_tile_state(index, path):
+        app.tiles[index].video_file = path
+
+    def group_seek(position, resume=None, on_done=None):
+        app.calls.calls.append(("group_seek", position, resume))
+        on_done(types.SimpleNamespace())
+
+    app.reset_tile_state = reset_tile_state
+    app.group_seek = group_seek
+    return app
+
+
+def calls(app, name):
+    return [call[1:] for call in app.calls.calls if call[0] == name]
+
+
+def terminated(app, count):
+    return sorted(repr(app.terminated.get(timeout=5)) for _ in range(count))
+
+
+def preloaded(position, paths, ready, loading=()):
+    preload = simul_pb.Preload(position, paths)
+    for index in list(ready) + list(loading):
+        preload.players[index] = FakePlayer(f"preload{index}")
+    for index in ready:
+        preload.requests[index] = f"request{index}"
+    return preload
+
+
+def test_ready_lists_only_players_that_finished_loading():
+    preload = preloaded(1, ["b0", "b1", "b2"], ready=[0, 2], loading=[1])
+    assert sorted(preload.ready()) == [0, 2]
+
+
+def test_show_set_swaps_in_ready_players_and_loads_the_rest_cold(app):
+    preload = app.preload = preloaded(1, ["b0", "b1", "b2"], ready=[0, 1], loading=[2])
+    players = dict(preload.players)
+    app.show_set(1)
+    assert [tile.player for tile in app.tiles[:2]] == [players[0], players[1]]
+    assert [tile.video_file for tile in app.tiles[:2]] == ["b0", "b1"]
+    assert calls(app, "open_file") == [(2, "b2")]
+    assert calls(app, "clear_tile") == [(3,)]
+    # 読み込み途中だった先読みのプレーヤーは捨てる
+    assert terminated(app, 1) == ["preload2"]
+    # 映像を有効にしたタイルは一時停止のまま先頭に揃えてから読み込み完了の処理をする
+    assert calls(app, "group_seek") == [(0.0, False)]
+    assert calls(app, "on_tile_loaded") == [(0, "request0"), (1, "request1")]
+    assert calls(app, "start_preload") == [(2,)]
+    assert app.preload is None and app.set_queue.position == 1
+
+
+def test_preload_for_other_files_or_sets_is_not_used(app):
+    app.preload = preloaded(1, ["b0", "other", "b2"], ready=[0, 1, 2])
+    app.show_set(1)
+    assert calls(app, "open_file") == [(1, "b1")]
+    assert terminated(app, 1) == ["preload1"]
+    app.calls.calls.clear()
+    app.preload = preloaded(2, ["c0"], ready=[0])
+    app.show_set(0)
+    assert calls(app, "open_file") == [(0, "a0"), (1, "a1"), (2, "a2")]
+    assert calls(app, "group_seek") == []
+    assert terminated(app, 1) == ["preload0"]
+
+
+def test_swap_in_preloaded_replaces_the_tile_player(app):
+    tile = app.tiles[2]
+    old, new = FakePlayer("old"), FakePlayer("new", vo_configured=True)
+    tile.player, tile.volume, tile.quality_level = old, 30, 2
+    app.swap_in_preloaded(2, new, "b2")
+    assert tile.player is new and tile.video_file == "b2"
+    assert not tile.first_play and tile.quality_level == 0
+    assert new["wid"] == "102" and new.vid == "auto"
+    assert new.volume == 30 and new.loop_file == "inf"
+    assert terminated(app, 1) == ["old"]
+    assert calls(app, "unobserve_player") == [(2, old)] and calls(app, "observe_player") == [(2, new)]
+    for name in ("cancel", "forget"):
+        assert (2,) in calls(app, name)
@@ -0,0 +1,76 @@
+import simul_pb
+
+
+def metrics(drops, tiles=4):
+    # MetricsCollector.latest()と同じ形: {index: (値, 秒あたりの増加)}
+    return {i: ({}, {"vo_drops": drops.get(i, 0.0), "decoder_drops": 0.0, "delayed": None}) for i in range(tiles)}
+
+
+def test_overload_degrades_unfocused_tiles_one_step_at_a_time():
+    controller = simul_pb.QualityController(degrade_interval=2.0)
+    active = [0, 1, 2, 3]
+    # 最も番号の大きいフォーカス外のタイルから下げる
+    assert controller.update(10.0, metrics({0: 5.0}), 0, active) == {3: 1}
+    # degrade_interval秒経つまでは次を下げない
+    assert controller.update(11.0, metrics({0: 5.0}), 0, active) == {}
+    assert controller.update(12.0, metrics({0: 5.0}), 0, active) == {2: 1}
+    assert controller.level(0) == 0
+
+
+def test_focused_tile_is_never_degraded_and_is_restored_on_focus():
+    controller = simul_pb.QualityController(degrade_interval=0.0)
+    active = [0, 1]
+    for now in range(10):
+        controller.update(float(now), metrics({0: 5.0}, 2), 0, active)
+    assert controller.level(0) == 0
+    assert controller.level(1) == len(simul_pb.QualityController.LEVELS) - 1
+    # フォーカスを移すとそのタイルはすぐに最高画質に戻る
+    assert controller.update(20.0, metrics({}, 2), 1, active)[1] == 0
+
+
+def test_degraded_tiles_do_not_count_towards_pressure():
+    controller = simul_pb.QualityController()
+    controller.levels[1] = 2
+    assert controller.pressure(metrics({1: 50.0, 2: 1.0}), 0) == 1.0
+    # フォーカス中のタイルは下げていても数える
+    assert controller.pressure(metrics({1: 50.0}), 1) == 50.0
+
+
+def test_recovers_after_a_calm_period():
+    controller = simul_pb.QualityController(recover_after=5.0)
+    active = [0, 1, 2]
+    controller.update(100.0, metrics({0: 5.0}), 0, active)
+    assert controller.level(2) == 1
+    assert controller.update(101.0, metrics({}), 0, active) == {}  # 落ち着き始め
+    assert controller.update(105.0, metrics({}), 0, active) == {}
+    assert controller.update(106.0, metrics({}), 0, active) == {2: 0}
+    assert controller.levels == {}
+
+
+def test_moderate_drops_hold_the_current_level():
+    controller = simul_pb.QualityController(drop_threshold=2.0, recover_threshold=0.5, recover_after=1.0)
+    active = [0, 1]
+    controller.update(100.0, metrics({0: 3.0}, 2), 0, active)
+    for now in range(101, 120):
+        assert controller.update(float(now), metrics({0: 1.0}, 2), 0, active) == {}
+    assert controller.level(1) == 1
+
+
+def test_degrading_again_right_after_recovery_backs_off():
+    controller = simul_pb.QualityController(degrade_interval=0.0, recover_after=5.0)
+    active = [0, 1]
+    controller.update(0.0, metrics({0: 5.0}, 2), 0, active)
+    controller.update(1.0, metrics({}, 2), 0, active)
+    assert controller.update(6.0, metrics({}, 2), 0, active) == {1: 0}
+    # 戻した直後にまた下げると、次に戻すまでの時間が2倍になる
+    assert controller.update(7.0, metrics({0: 5.0}, 2), 0, active) == {1: 1}
+    controller.update(8.0, metrics({}, 2), 0, active)
+    assert controller.update(13.0, metrics({}, 2), 0, active) == {}
+    assert controller.update(18.0, metrics({}, 2), 0, active) == {1: 0}
+
+
+def test_inactive_tiles_are_reset():
+    controller = simul_pb.QualityController()
+    controller.levels = {1: 2, 2: 1}
+    assert controller.update(0.0, metrics({}), 0, [0, 2]) == {1: 0}
+    assert controller.levels == {2: 1}
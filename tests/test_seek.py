@@ -0,0 +1,205 @@
+import threading
+import types
+
+import pytest
+
+import simul_pb
+
+EVENTS = types.SimpleNamespace(END_FILE=7, PLAYBACK_RESTART=21, PROPERTY_CHANGE=22)
+
+
+class FakePlayer:
+    # command_asyncの引数とイベントコールバックだけを記録する
+    def __init__(self, fail=False):
+        self.commands = []
+        self.callbacks = []
+        self.fail = fail
+        self.pause = False
+
+    def register_event_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def command_async(self, *args):
+        if self.fail:
+            raise RuntimeError("core shut down")
+        self.commands.append(args)
+
+    def emit(self, eid):
+        event = types.SimpleNamespace(event_id=types.SimpleNamespace(value=eid), data=None)
+        for callback in self.callbacks:
+            callback(event)
+
+
+@pytest.fixture(autouse=True)
+def fake_mpv(monkeypatch):
+    monkeypatch.setattr(simul_pb, "mpv", types.SimpleNamespace(MpvEventID=EVENTS))
+
+
+@pytest.fixture
+def barrier():
+    barrier = simul_pb.SeekBarrier(lambda func, *args: func(*args), timeout=5.0)
+    barrier.players = [FakePlayer() for _ in range(3)]
+    for index, player in enumerate(barrier.players):
+        barrier.attach(index, player)
+    yield barrier
+    group = barrier._group
+    if group and group.timer:
+        group.timer.cancel()
+
+
+def targets(players, position):
+    return [(index, player, position + index * 0.5) for index, player in enumerate(players)]
+
+
+def test_seek_is_issued_to_every_player_with_its_own_target(barrier):
+    barrier.seek(targets(barrier.players, 10.0), 10.0)
+    assert [player.commands for player in barrier.players] == [
+        [("seek", "10.000", "absolute", "exact")],
+        [("seek", "10.500", "absolute", "exact")],
+        [("seek", "11.000", "absolute", "exact")],
+    ]
+
+
+def test_done_waits_for_every_playback_restart(barrier):
+    done = []
+    group = barrier.seek(targets(barrier.players, 10.0), 10.0, done.append)
+    barrier.players[0].emit(EVENTS.PROPERTY_CHANGE)
+    barrier.players[0].emit(EVENTS.PLAYBACK_RESTART)
+    barrier.players[2].emit(EVENTS.PLAYBACK_RESTART)
+    assert done == [] and group.waiting() == [1]
+    barrier.players[1].emit(EVENTS.PLAYBACK_RESTART)
+    assert done == [group]
+    assert sorted(group.latencies) == [0, 1, 2] and group.errors == {}
+    assert "P1 " in group.summary() and "(10.000s)" in group.summary()
+
+
+def test_end_file_and_replaced_players_do_not_block_the_group(barrier):
+    done = []
+    group = barrier.seek(targets(barrier.players, 0.0), 0.0, done.append)
+    barrier.players[0].emit(EVENTS.END_FILE)
+    barrier.forget(1)
+    assert done == []
+    barrier.players[2].emit(EVENTS.PLAYBACK_RESTART)
+    assert done == [group]
+    assert group.errors == {0: "file ended", 1: "replaced"}
+
+
+def test_failed_seek_is_recorded_and_finishes_immediately():
+    barrier = simul_pb.SeekBarrier(lambda func, *args: func(*args))
+    done = []
+    group = barrier.seek([(0, FakePlayer(fail=True), 3.0)], 3.0, done.append)
+    assert done == [group]
+    assert group.errors == {0: "error: core shut down"}
+
+
+def test_new_group_seek_discards_the_previous_one(barrier):
+    done = []
+    first = barrier.seek(targets(barrier.players, 1.0), 1.0, lambda group: done.append("first"))
+    second = barrier.seek(targets(barrier.players, 2.0), 2.0, lambda group: done.append("second"))
+    assert not first.timer.is_alive()
+    for player in barrier.players:
+        player.emit(EVENTS.PLAYBACK_RESTART)
+    assert done == ["second"] and second.latencies.keys() == {0, 1, 2}
+
+
+def test_group_times_out_on_missing_restarts():
+    finished = threading.Event()
+    barrier = simul_pb.SeekBarrier(lambda func, *args: func(*args), timeout=0.05)
+    players = [FakePlayer(), FakePlayer()]
+    for index, player in enumerate(players):
+        barrier.attach(index, player)
+    group = barrier.seek(targets(players, 5.0), 5.0, lambda group: finished.set())
+    players[0].emit(EVENTS.PLAYBACK_RESTART)
+    assert finished.wait(2)
+    assert list(group.latencies) == [0] and group.errors == {1: "timeout"}
+
+
+@pytest.fixture
+def app(barrier):
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(i) for i in range(4)]
+    for tile, player in zip(app.tiles, barrier.players):
+        tile.player, tile.video_file, tile.duration = player, f"{tile.index}.mp4", 60.0
+    app.tiles[2].duration = 8.0
+    app.compositor = None
+    app.playing = True
+    app.seek_barrier = barrier
+    app.scrubber = simul_pb.Scrubber()
+    app.sync_engine = types.SimpleNamespace(pause=lambda: None)
+    app.started = []
+    app.start_playback = app.started.append
+    return app
+
+
+def test_group_seek_pauses_clamps_and_resumes_together(app):
+    group = app.group_seek(30.0)
+    players = app.seek_barrier.players
+    assert all(player.pause for player in players)
+    # 短いファイルは末尾の手前で止める
+    assert [player.commands[-1][1] for player in players] == ["30.000", "30.000", "7.900"]
+    players[0].emit(EVENTS.PLAYBACK_RESTART)
+    players[1].emit(EVENTS.PLAYBACK_RESTART)
+    assert app.started == []
+    players[2].emit(EVENTS.END_FILE)
+    assert app.started == [[0, 1]]
+    assert group.errors == {2: "file ended"}
+
+
+def test_group_seek_while_paused_does_not_resume(app):
+    app.playing = False
+    app.group_seek(5.0)
+    for player in app.seek_barrier.players:
+        player.emit(EVENTS.PLAYBACK_RESTART)
+    assert app.started == []
+
+
+@pytest.fixture
+def scrubber():
+    scrubber = simul_pb.Scrubber(settle_timeout=5.0)
+    scrubber.player = FakePlayer()
+    scrubber.attach(0, scrubber.player)
+    return scrubber
+
+
+def test_scrub_keeps_one_keyframe_seek_in_flight(scrubber):
+    player = scrubber.player
+    assert scrubber.request(0, player, 1.0)
+    assert not scrubber.request(0, player, 2.0)
+    assert not scrubber.request(0, player, 3.0)
+    assert player.commands == [("seek", "1.000", "absolute", "keyframes")]
+    # 前のシークが終わったら最新の位置だけをシークする
+    player.emit(EVENTS.PLAYBACK_RESTART)
+    assert player.commands[1:] == [("seek", "3.000", "absolute", "keyframes")]
+    player.emit(EVENTS.PLAYBACK_RESTART)
+    assert len(player.commands) == 2
+    assert scrubber.request(0, player, 4.0)
+
+
+def test_scrub_finish_drops_pending_and_seeks_exactly(scrubber):
+    player = scrubber.player
+    scrubber.request(0, player, 1.0)
+    scrubber.request(0, player, 2.0)
+    scrubber.finish(0, player, 2.5)
+    player.emit(EVENTS.PLAYBACK_RESTART)
+    assert player.commands == [("seek", "1.000", "absolute", "keyframes"), ("seek", "2.500", "absolute", "exact")]
+
+
+def test_scrub_without_restart_is_released_after_settle_timeout():
+    scrubber = simul_pb.Scrubber(settle_timeout=0.0)
+    player = FakePlayer()
+    assert scrubber.request(0, player, 1.0)
+    assert scrubber.request(0, player, 2.0)
+    assert len(player.commands) == 2
+
+
+def test_scrub_players_are_independent(scrubber):
+    other = FakePlayer()
+    scrubber.request(0, scrubber.player, 1.0)
+    assert scrubber.request(1, other, 1.0)
+    scrubber.forget(0)
+    assert scrubber.request(0, scrubber.player, 2.0)
+
+
+def test_scrub_seek_errors_are_logged_not_raised():
+    scrubber = simul_pb.Scrubber()
+    assert scrubber.request(0, FakePlayer(fail=True), 1.0)
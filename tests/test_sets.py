@@ -0,0 +1,47 @@
+import json
+import os
+
+import simul_pb
+
+
+def test_text_manifest_groups_by_blank_lines(tmp_path):
+    manifest = tmp_path / "sets.txt"
+    manifest.write_text("# encoder comparison\na/x264.mp4\na/x265.mp4\n\n\n# second\nb/x264.mp4\n", encoding="utf-8")
+    assert simul_pb.read_manifest(str(manifest)) == [
+        [str(tmp_path / "a" / "x264.mp4"), str(tmp_path / "a" / "x265.mp4")],
+        [str(tmp_path / "b" / "x264.mp4")],
+    ]
+
+
+def test_text_manifest_with_bom_and_absolute_paths(tmp_path):
+    absolute = os.path.abspath(os.path.join(os.sep, "media", "clip.mkv"))
+    manifest = tmp_path / "sets.lst"
+    manifest.write_text(f"{absolute}\nrelative.mkv\n", encoding="utf-8-sig")
+    assert simul_pb.read_manifest(str(manifest)) == [[absolute, str(tmp_path / "relative.mkv")]]
+
+
+def test_json_manifest_list_and_object(tmp_path):
+    listing = tmp_path / "list.json"
+    listing.write_text(json.dumps([["a.mp4", "b.mp4"], [], ["c.mp4"]]), encoding="utf-8")
+    assert simul_pb.read_manifest(str(listing)) == [
+        [str(tmp_path / "a.mp4"), str(tmp_path / "b.mp4")], [str(tmp_path / "c.mp4")]]
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    wrapped = sub / "sets.json"
+    wrapped.write_text(json.dumps({"sets": [["../a.mp4"]]}), encoding="utf-8")
+    assert simul_pb.read_manifest(str(wrapped)) == [[str(tmp_path / "a.mp4")]]
+
+
+def test_scan_folder_uses_subfolders_as_sets(tmp_path):
+    for name in ["one/b.mp4", "one/a.mkv", "one/notes.txt", "two/c.mp4", "empty/readme.md"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+    assert simul_pb.scan_folder(str(tmp_path), 4) == [
+        [str(tmp_path / "one" / "a.mkv"), str(tmp_path / "one" / "b.mp4")], [str(tmp_path / "two" / "c.mp4")]]
+
+
+def test_scan_folder_splits_flat_folders_by_tile_count(tmp_path):
+    for i in range(5):
+        (tmp_path / f"{i}.mp4").write_bytes(b"")
+    sets = simul_pb.scan_folder(str(tmp_path), 2)
+    assert [len(s) for s in sets] == [2, 2, 1]
@@ -0,0 +1,165 @@
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import simul_pb
+
+
+@pytest.fixture
+def state():
+    state = simul_pb.SharedState(slots=3)
+    yield state
+    state.close(unlink=True)
+
+
+def test_slots_round_trip_state_and_commands(state):
+    first, second = state.acquire(), state.acquire()
+    assert (first, second) == (0, 1)
+    state.write_state(first, 5, 1, 2, 10.0, 9.5, 3.25, 60.0)
+    state.write_commands(first, 4, 7, 1.0, 8, 9, 1.05)
+    state.write_state(second, 0, 0, 0, 11.0, 0.0, 0.0, 0.0)
+    assert state.read_state(first) == (5, 1, 2, 10.0, 9.5, 3.25, 60.0)
+    assert state.read_commands(first) == (4, 7, 1.0, 8, 9, 1.05)
+    assert state.read_state(second)[3] == 11.0
+    assert state.read_commands(second) == (0, 0, 0.0, 0, 0, 0.0)
+
+
+def test_layouts_fit_in_a_slot():
+    assert simul_pb.SharedState.STATE.size + simul_pb.SharedState.COMMAND.size <= simul_pb.SharedState.SLOT_SIZE
+
+
+def test_acquire_resets_a_released_slot(state):
+    slot = state.acquire()
+    state.write_state(slot, simul_pb.SharedState.EOF, 3, 3, 1.0, 1.0, 42.0, 60.0)
+    state.release(slot)
+    state.release(slot)  # 二重に返しても1つ分
+    assert [state.acquire() for _ in range(3)] == [1, 2, 0]
+    assert state.read_state(0)[0] == 0 and state.read_state(0)[5] == 0.0
+    with pytest.raises(RuntimeError):
+        state.acquire()
+
+
+def test_sequence_is_even_after_each_write(state):
+    slot = state.acquire()
+    for i in range(3):
+        state.write_state(slot, i, 0, 0, 0.0, 0.0, float(i), 0.0)
+        seq = struct.unpack_from("<Q", state.shm.buf, slot * state.SLOT_SIZE)[0]
+        assert seq % 2 == 0
+
+
+def test_read_of_a_slot_stuck_mid_write_returns(state):
+    # 書き込み途中で終了したワーカーのスロットでも読み取りは止まらない
+    slot = state.acquire()
+    struct.pack_into("<Q", state.shm.buf, slot * state.SLOT_SIZE, 7)
+    assert len(state.read_state(slot)) == 7
+
+
+def test_concurrent_reads_never_see_a_torn_write(state):
+    slot = state.acquire()
+    done = threading.Event()
+
+    def writer():
+        i = 0
+        while not done.is_set():
+            i += 1
+            state.write_state(slot, i, i, i, float(i), float(i), float(i), float(i))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(20000):
+            values = state.read_state(slot)
+            assert len(set(values)) == 1, values
+    finally:
+        done.set()
+        thread.join()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 13), reason="attaching without tracking needs Python 3.13")
+def test_worker_attaches_by_name(state):
+    slot = state.acquire()
+    worker = simul_pb.SharedState(name=state.name)
+    try:
+        worker.write_state(slot, 1, 0, 0, 2.0, 2.0, 12.5, 30.0)
+        assert state.read_state(slot)[5] == 12.5
+        state.write_commands(slot, 1, 0, 1.0, 0, 0, 1.0)
+        assert worker.read_commands(slot)[2] == 1.0
+    finally:
+        worker.close()
+
+
+class FakeMpv:
+    # run_player_worker から見たmpv.MPV。設定された値を記録する
+    def __init__(self, log_handler=None, **options):
+        self.mpv_version = "fake"
+        self.core_shutdown = False
+        self.values = []
+
+    def observe_property(self, name, handler):
+        pass
+
+    def register_event_callback(self, callback):
+        pass
+
+    def __setattr__(self, name, value):
+        if name in ("pause", "speed"):
+            self.values.append((name, value))
+        super().__setattr__(name, value)
+
+    def terminate(self):
+        pass
+
+
+@pytest.fixture
+def worker(state, monkeypatch):
+    # ワーカーのループをスレッドで動かす。共有メモリは同じプロセスのものをそのまま使う
+    fake = types.SimpleNamespace(players=[])
+    monkeypatch.setattr(simul_pb, "load_mpv", lambda: types.SimpleNamespace(
+        MPV=lambda **options: fake.players.append(FakeMpv(**options)) or fake.players[-1]))
+    writes = []
+
+    class Attached(simul_pb.SharedState):
+        def __init__(self, slots=0, name=None):
+            self.__dict__.update(state.__dict__)
+
+        def write_state(self, slot, *values):
+            writes.append(time.monotonic())
+            state.write_state(slot, *values)
+
+        def close(self, unlink=False):
+            pass
+
+    monkeypatch.setattr(simul_pb, "SharedState", Attached)
+    slot = state.acquire()
+    conn, child = multiprocessing.Pipe()
+    thread = threading.Thread(target=simul_pb.run_player_worker, args=(child, state.name, slot, {}), daemon=True)
+    thread.start()
+    assert conn.recv() == ("ready", "fake")
+    yield types.SimpleNamespace(conn=conn, slot=slot, writes=writes, players=fake.players)
+    conn.send(("terminate",))
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_idle_worker_only_writes_heartbeats(worker):
+    worker.writes.clear()
+    time.sleep(1.2)
+    # 0.5秒ごとのハートビートだけ (以前は2msごとに書いていた)
+    assert 1 <= len(worker.writes) <= 4
+
+
+def test_worker_applies_commands_when_woken(state, worker):
+    time.sleep(0.1)  # ワーカーがパイプを待ち始めてから
+    state.write_commands(worker.slot, 1, 0, 1.0, 1, 0, 1.25)
+    worker.conn.send(("wake",))
+    started = time.monotonic()
+    while state.read_state(worker.slot)[1:3] != (1, 1) and time.monotonic() - started < 2:
+        time.sleep(0.005)
+    assert state.read_state(worker.slot)[1:3] == (1, 1)  # pauseとspeedを受理した
+    assert time.monotonic() - started < simul_pb.SharedState.HEARTBEAT / 2  # ハートビートを待たずに起きる
+    assert worker.players[0].values == [("pause", True), ("speed", 1.25)]
@@ -0,0 +1,113 @@
+import types
+
+import pytest
+
+import simul_pb
+
+
+class FakePlayer:
+    # プロパティの書き込みとcommand_asyncを記録する
+    def __init__(self):
+        self.__dict__.update(play_direction="forward", speed=1.0, writes=[], commands=[])
+
+    def __setattr__(self, name, value):
+        self.writes.append((name, value))
+        super().__setattr__(name, value)
+
+    def command_async(self, *args):
+        self.commands.append(args)
+
+
+@pytest.fixture
+def app():
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(i) for i in range(3)]
+    for tile in app.tiles[:2]:
+        tile.player, tile.video_file = FakePlayer(), f"{tile.index}.mp4"
+    app.compositor = None
+    app.playing = False
+    app.shuttle_speed = 1.0
+    app.sync_engine = types.SimpleNamespace(pause=lambda: None, rate=1.0)
+    app.start_sync = lambda: None
+
+    def toggle_play():
+        # 実際のtoggle_playと同じく、再生開始時にapply_shuttleし、一時停止で通常速度に戻す
+        app.playing = not app.playing
+        if app.playing:
+            app.apply_shuttle()
+        else:
+            app.shuttle_speed = 1.0
+
+    app.toggle_play = toggle_play
+    return app
+
+
+def players(app):
+    return [tile.player for tile in app.tiles[:2]]
+
+
+def test_l_from_pause_plays_forward_at_normal_speed(app):
+    app.shuttle(1)
+    assert app.playing and app.shuttle_speed == 1.0
+    assert app.sync_engine.rate == 1.0
+
+
+def test_repeated_presses_double_the_speed_up_to_the_limit(app):
+    speeds = []
+    for _ in range(6):
+        app.shuttle(1)
+        speeds.append(app.shuttle_speed)
+    assert speeds == [1.0, 2.0, 4.0, 8.0, 8.0, 8.0]
+    assert [player.speed for player in players(app)] == [8.0, 8.0]
+    assert app.sync_engine.rate == 8.0
+
+
+def test_j_reverses_and_doubles_backwards(app):
+    app.shuttle(1)
+    app.shuttle(1)
+    app.shuttle(-1)
+    assert app.shuttle_speed == -1.0
+    app.shuttle(-1)
+    assert app.shuttle_speed == -2.0
+    assert [(player.play_direction, player.speed) for player in players(app)] == [("backward", 2.0)] * 2
+
+
+def test_k_pauses_and_the_next_press_starts_at_normal_speed(app):
+    app.shuttle(1)
+    app.shuttle(1)
+    app.shuttle(0)
+    assert not app.playing
+    app.shuttle(0)
+    assert not app.playing
+    app.shuttle(-1)
+    assert app.playing and app.shuttle_speed == -1.0
+
+
+def test_apply_shuttle_only_writes_changed_properties(app):
+    app.shuttle_speed = 1.0
+    app.apply_shuttle()
+    assert all(player.writes == [] for player in players(app))
+
+
+def test_step_frames_pauses_and_steps_every_loaded_tile(app):
+    app.shuttle(1)
+    for tile in app.tiles:
+        tile.ended = True
+    app.step_frames(-1)
+    assert not app.playing
+    assert not any(tile.ended or tile.first_play for tile in app.tiles)
+    for player in players(app):
+        assert player.play_direction == "backward" and player.commands == [("frame-step",)]
+    app.step_frames(-1)
+    # 向きが同じなら設定し直さない (デコード済みのフレームを使い続ける)
+    assert [player.writes.count(("play_direction", "backward")) for player in players(app)] == [1, 1]
+    app.step_frames(1)
+    assert [player.play_direction for player in players(app)] == ["forward", "forward"]
+
+
+def test_compositor_steps_its_single_player(app):
+    compositor = FakePlayer()
+    app.compositor = types.SimpleNamespace(player=compositor)
+    app.step_frames(1)
+    assert compositor.commands == [("frame-step",)]
+    assert all(player.commands == [] for player in players(app))
@@ -0,0 +1,96 @@
+import pytest
+
+import simul_pb
+
+
+class FakePlayer:
+    def __init__(self, time_pos, fps=25.0, duration=60.0):
+        self.time_pos = time_pos
+        self.container_fps = fps
+        self.estimated_vf_fps = None
+        self.duration = duration
+        self.speed = 1.0
+        self.seeks = []
+
+    def seek(self, target, reference=None, precision=None):
+        self.seeks.append((target, reference, precision))
+
+
+def engine_for(players, **options):
+    engine = simul_pb.SyncEngine(lambda: list(enumerate(players)), **options)
+    engine.set_master(0)
+    engine.resume(players[0].time_pos)
+    return engine
+
+
+def test_small_drift_within_half_a_frame_keeps_normal_speed():
+    players = [FakePlayer(10.0), FakePlayer(10.015)]  # 25fpsの1フレームは40ms
+    engine = engine_for(players)
+    engine._step()
+    assert players[1].speed == 1.0
+    assert players[1].seeks == []
+    assert engine.stats[1].speed_corrections == 0
+
+
+def test_follower_ahead_is_slowed_down():
+    players = [FakePlayer(10.0), FakePlayer(10.2)]
+    engine = engine_for(players, smoothing=1.0)
+    engine._step()
+    # 1秒で0.2秒のずれを解消したいが、補正幅は±5%まで
+    assert players[1].speed == pytest.approx(0.95)
+    assert engine.stats[1].speed_corrections == 1
+
+
+def test_follower_behind_is_sped_up_in_proportion():
+    players = [FakePlayer(10.0), FakePlayer(9.98)]
+    engine = engine_for(players, smoothing=1.0)
+    engine._step()
+    assert players[1].speed == pytest.approx(1.02, abs=1e-3)
+
+
+def test_drift_is_smoothed_before_correcting():
+    players = [FakePlayer(10.0), FakePlayer(10.1)]
+    engine = engine_for(players, smoothing=0.5)
+    engine._step()
+    assert players[1].speed == pytest.approx(0.95)
+    assert engine._smoothed[1] == pytest.approx(0.1, abs=1e-3)
+
+
+def test_large_drift_hard_seeks_and_cools_down():
+    players = [FakePlayer(10.0), FakePlayer(11.0)]
+    engine = engine_for(players)
+    engine._step()
+    [(target, reference, precision)] = players[1].seeks
+    assert reference == "absolute" and precision == "exact"
+    assert 10.0 < target < 10.2  # シークにかかる時間の分だけ先へ
+    assert engine.stats[1].hard_seeks == 1
+    # 直後はシークが終わるのを待ち、重ねてシークしない
+    engine._step()
+    assert len(players[1].seeks) == 1
+
+
+def test_threshold_is_configurable():
+    players = [FakePlayer(10.0), FakePlayer(10.3)]
+    engine = engine_for(players, seek_threshold=0.25)
+    engine._step()
+    assert len(players[1].seeks) == 1
+
+
+def test_loop_wraparound_is_not_a_drift():
+    # マスターは折り返した直後、フォロワーはまだ終端の手前
+    players = [FakePlayer(0.01, duration=60.0), FakePlayer(59.99, duration=60.0)]
+    engine = engine_for(players, smoothing=1.0)
+    engine.loop = True
+    engine._step()
+    # 1周分を除いた20msの遅れだけを速度で補正する
+    assert players[1].seeks == []
+    assert players[1].speed == pytest.approx(1.02, abs=1e-3)
+
+
+def test_pause_restores_the_nominal_speed():
+    players = [FakePlayer(10.0), FakePlayer(10.2)]
+    engine = engine_for(players, smoothing=1.0)
+    engine._step()
+    assert players[1].speed != 1.0
+    engine.pause()
+    assert players[1].speed == 1.0
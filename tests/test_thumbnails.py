@@ -0,0 +1,147 @@
+import os
+import threading
+
+import pytest
+
+import simul_pb
+
+PROBE_OUTPUT = b"0.000000,K__\n0.033367,___\n2.002000,K__\n4.004000,K_\nbad,K__\n240.000000\n"
+
+
+def test_thumbnail_path_is_clamped_to_the_generated_images():
+    index = simul_pb.ThumbnailIndex("dir", 240.0, 2.0, [0.0, 2.0, 4.0], 120)
+    assert index.thumbnail_path(-5) == os.path.join("dir", "0001.png")
+    assert index.thumbnail_path(3.9) == os.path.join("dir", "0002.png")
+    assert index.thumbnail_path(999) == os.path.join("dir", "0120.png")
+    assert simul_pb.ThumbnailIndex("dir", 0.0, 1.0, [], 0).thumbnail_path(1.0) is None
+
+
+@pytest.mark.parametrize("position, keyframe", [(-1.0, None), (0.0, 0.0), (1.9, 0.0), (2.0, 2.0), (100.0, 4.0)])
+def test_keyframe_before(position, keyframe):
+    assert simul_pb.ThumbnailIndex("dir", 240.0, 2.0, [0.0, 2.0, 4.0], 3).keyframe_before(position) == keyframe
+
+
+@pytest.fixture
+def tools(tmp_path, monkeypatch):
+    # ffprobeはパケット一覧を返し、ffmpegは出力先に画像を3枚書くだけの偽物にする
+    monkeypatch.delenv("LOCALAPPDATA", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(simul_pb.shutil, "which", lambda name: "/usr/bin/" + name)
+    calls = []
+
+    def run_tool(args, timeout=120, running=None):
+        calls.append(os.path.basename(args[0]))
+        if args[0].endswith("ffprobe"):
+            return PROBE_OUTPUT
+        directory = os.path.dirname(args[-1])
+        for n in range(3):
+            with open(os.path.join(directory, f"{n + 1:04d}.png"), "wb") as f:
+                f.write(b"x" * 100)
+        return b""
+
+    monkeypatch.setattr(simul_pb, "run_tool", run_tool)
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b"video")
+    return calls, str(video)
+
+
+def dispatch(func, *args):
+    func(*args)
+
+
+def build(cache, path):
+    ready = threading.Event()
+    key = cache.request(path, on_ready=lambda key, entry: ready.set())
+    assert ready.wait(5)
+    return key, cache.get(key)
+
+
+def test_request_builds_the_index_and_dispatches_the_result(tools):
+    calls, video = tools
+    ready = []
+
+    def record(func, *args):
+        ready.append(args)
+        func(*args)
+
+    cache = simul_pb.ThumbnailCache(record)
+    try:
+        key, entry = build(cache, video)
+    finally:
+        cache.close()
+    assert calls == ["ffprobe", "ffmpeg"]
+    assert entry.keyframes == [0.0, 2.002, 4.004]
+    assert entry.duration == 240.0 and entry.interval == 2.0 and entry.count == 3
+    assert cache.get(key) is entry
+    # 完了の通知はdispatch経由でUIスレッドに回す
+    assert ready == [(key, entry)]
+
+
+def test_memory_hit_calls_back_immediately(tools):
+    calls, video = tools
+    cache = simul_pb.ThumbnailCache(dispatch)
+    try:
+        key, entry = build(cache, video)
+        ready = []
+        assert cache.request(video, on_ready=lambda key, entry: ready.append(entry)) == key
+    finally:
+        cache.close()
+    assert ready == [entry] and calls == ["ffprobe", "ffmpeg"]
+
+
+def test_disk_cache_is_reused_by_a_new_instance(tools):
+    calls, video = tools
+    first = simul_pb.ThumbnailCache(dispatch)
+    try:
+        build(first, video)
+    finally:
+        first.close()
+    second = simul_pb.ThumbnailCache(dispatch)
+    try:
+        key, entry = build(second, video)
+    finally:
+        second.close()
+    assert calls == ["ffprobe", "ffmpeg"]
+    assert entry.keyframes == [0.0, 2.002, 4.004] and entry.count == 3
+
+
+def test_memory_entries_are_evicted_least_recently_used(tools):
+    cache = simul_pb.ThumbnailCache(dispatch, memory_entries=2)
+    try:
+        for key in ("a", "b"):
+            cache._remember(key, key)
+        cache.get("a")
+        cache._remember("c", "c")
+    finally:
+        cache.close()
+    assert list(cache._entries) == ["a", "c"]
+
+
+def test_disk_is_trimmed_oldest_first(tools, tmp_path):
+    cache = simul_pb.ThumbnailCache(dispatch, max_bytes=250)
+    try:
+        for n, name in enumerate(("old", "new")):
+            directory = os.path.join(cache.directory, name)
+            os.makedirs(directory)
+            with open(os.path.join(directory, "0001.png"), "wb") as f:
+                f.write(b"x" * 200)
+            index_path = os.path.join(directory, "index.json")
+            with open(index_path, "w") as f:
+                f.write("{}")
+            os.utime(index_path, (1000 + n, 1000 + n))
+        cache._trim_disk()
+    finally:
+        cache.close()
+    assert sorted(os.listdir(cache.directory)) == ["new"]
+
+
+def test_missing_tools_disable_previews(tmp_path, monkeypatch):
+    monkeypatch.delenv("LOCALAPPDATA", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(simul_pb.shutil, "which", lambda name: None)
+    cache = simul_pb.ThumbnailCache(dispatch)
+    try:
+        assert not cache.available
+        assert cache.request(str(tmp_path / "a.mp4")) is None
+    finally:
+        cache.close()
@@ -0,0 +1,98 @@
+import json
+import types
+
+import pytest
+
+import simul_pb
+
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.delenv("LOCALAPPDATA", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    return tmp_path / "simul_pb"
+
+
+def test_json_cache_persists_across_instances(cache_home):
+    cache = simul_pb.JsonCache("vo_cache.json")
+    cache.put("host", {"vo": "gpu"})
+    assert json.loads((cache_home / "vo_cache.json").read_text(encoding="utf-8")) == {"host": {"vo": "gpu"}}
+    assert not (cache_home / "vo_cache.json.tmp").exists()
+    assert simul_pb.JsonCache("vo_cache.json").get("host") == {"vo": "gpu"}
+
+
+def test_json_cache_remove(cache_home):
+    cache = simul_pb.JsonCache("vo_cache.json")
+    cache.put("a", 1)
+    cache.remove("a")
+    cache.remove("missing")
+    assert simul_pb.JsonCache("vo_cache.json").get("a", "none") == "none"
+
+
+def test_json_cache_ignores_an_unreadable_file(cache_home):
+    cache_home.mkdir()
+    (cache_home / "vo_cache.json").write_text("{broken", encoding="utf-8")
+    cache = simul_pb.JsonCache("vo_cache.json")
+    assert cache.get("host") is None
+    cache.put("host", {"vo": "win"})
+    assert simul_pb.JsonCache("vo_cache.json").get("host") == {"vo": "win"}
+
+
+def test_startup_timer_records_phases_in_order():
+    timer = simul_pb.StartupTimer(0.0)
+    timer.add("import mpv", 0.25)
+    timer.mark("tk root")
+    assert [name for name, _ in timer.phases] == ["import mpv", "tk root"]
+    assert timer.phases[0][1] == 0.25 and timer.last > 0.0
+
+
+class FakeLabel:
+    def config(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def app(cache_home):
+    app = object.__new__(simul_pb.VideoPlayerApp)
+    app.tiles = [simul_pb.Tile(0)]
+    app.tiles[0].label = FakeLabel()
+    app.vo_cache = simul_pb.JsonCache("vo_cache.json")
+    app.vo_cache_key = lambda: "host|libmpv-api 2.1"
+    app.selected_vo = None
+    app.hwdec_recorded = False
+    app.is_muted = False
+    app.loop_enabled = False
+    app.observe_player = lambda index, player: None
+    app.attempts = []
+
+    def new_player(wid, vo):
+        # gpu以外は作成に失敗するものとする
+        app.attempts.append(vo)
+        if vo != "gpu":
+            raise RuntimeError(f"vo {vo} unavailable")
+        return types.SimpleNamespace(mpv_version="mpv 0.38.0", hwdec_current="d3d11va")
+
+    app.new_player = new_player
+    return app
+
+
+def test_first_player_probes_and_saves_the_selected_vo(app):
+    assert app.create_first_player(0)
+    assert app.attempts == ["opengl", "gpu"]
+    assert app.vo_cache.get("host|libmpv-api 2.1") == {"vo": "gpu", "mpv_version": "mpv 0.38.0", "hwdec": None}
+    app.record_hwdec(0)
+    assert app.vo_cache.get("host|libmpv-api 2.1")["hwdec"] == "d3d11va"
+
+
+def test_cached_vo_is_tried_first(app):
+    app.vo_cache.put("host|libmpv-api 2.1", {"vo": "gpu", "mpv_version": "mpv 0.38.0", "hwdec": "d3d11va"})
+    assert app.create_first_player(0)
+    assert app.attempts == ["gpu"]
+    # 同じVOとmpvのバージョンなら書き直さず、hwdecも記録済みとして扱う
+    assert app.hwdec_recorded
+
+
+def test_cache_for_another_key_is_not_used(app):
+    app.vo_cache.put("other host", {"vo": "gpu"})
+    app.create_first_player(0)
+    assert app.attempts == ["opengl", "gpu"]
@@ -0,0 +1,67 @@
+import tkinter as tk
+
+import simul_pb
+
+
+class FakeRoot:
+    # afterの予約だけを覚えておくTkの代わり
+    def __init__(self):
+        self.pending = {}
+
+    def after(self, ms, func):
+        self.pending[str(len(self.pending))] = func
+        return str(len(self.pending) - 1)
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+
+def on_click(value):
+    return value * 2
+
+
+def test_install_times_callbacks_and_stop_restores_the_wrapper():
+    original = tk.CallWrapper
+    root = FakeRoot()
+    watchdog = simul_pb.UiWatchdog()
+    watchdog.install(root)
+    try:
+        assert tk.CallWrapper is not original
+        assert tk.CallWrapper.watchdog is watchdog
+
+        wrapper = tk.CallWrapper(on_click, None, None)
+        assert wrapper(21) == 42
+        assert watchdog.handlers["on_click"][0] == 1
+    finally:
+        watchdog.stop()
+    assert tk.CallWrapper is original
+    assert root.pending == {}
+    # 停止後は既に登録済みのコールバックも計測せずに呼ぶ
+    assert wrapper(1) == 2
+    assert watchdog.handlers["on_click"][0] == 1
+
+
+def test_second_watchdog_does_not_wrap_twice():
+    original = tk.CallWrapper
+    first, second = simul_pb.UiWatchdog(), simul_pb.UiWatchdog()
+    first.install(FakeRoot())
+    second.install(FakeRoot())
+    try:
+        assert tk.CallWrapper.watchdog is first
+        assert tk.CallWrapper.__bases__ == (original,)
+        second.stop()
+        assert tk.CallWrapper.watchdog is first
+    finally:
+        first.stop()
+    assert tk.CallWrapper is original
+
+
+def test_summary_reports_handlers_by_total_time():
+    watchdog = simul_pb.UiWatchdog(threshold=0.2)
+    watchdog.handlers = {"fast": [10, 0.01, 0.002], "slow": [1, 0.5, 0.5]}
+    report = watchdog.report()
+    assert [handler["name"] for handler in report["handlers"]] == ["slow", "fast"]
+    assert report["stall_threshold_ms"] == 200
+    lines = watchdog.summary()
+    assert lines[0].endswith("0 stalls over 200ms")
+    assert lines[1] == "  slow: 1 calls, total 500ms, max 500.0ms"